@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dc_assistant.settings')
 
 application = get_asgi_application()
+
+# Start generating RSA key pairs when the server starts, so the first user keys don't wait for one. Management
+# commands don't load this module and never start the generator process.
+from secret.keypool import get_key_pair_pool  # noqa: E402
+get_key_pair_pool()
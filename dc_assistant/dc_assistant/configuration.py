@@ -25,5 +25,68 @@ SECRET_KEY = '_r^9!7plgkf2u-ri^fga&c^1gohf@8x0=#rzgdq3f(a9gd*h!='
 #########################
 
 PAGINATE_COUNT = 5
+
+# Verified session keys are cached in each worker so only the first request of a session runs the slow hash check.
+SESSION_KEY_CACHE_SIZE = 1024                   # Max number of cached session keys
+SESSION_KEY_CACHE_TTL = 300                     # Seconds before a session key is checked against its hash again
+
+# A user can hold several named session keys, e.g. one per automation client. Keys requested without a `ttl` expire
+# after SESSION_KEY_DEFAULT_TTL seconds (None: never). Expired keys are deleted in the background.
+SESSION_KEY_DEFAULT_TTL = None
+SESSION_KEY_CLEANUP_INTERVAL = 300              # Min seconds between two cleanups of expired session keys
+
+# Where session keys are looked up on each request:
+# 'database': no store, read the SessionKey table on every request (default)
+# 'file': opt-in, directory of the host given by SESSION_KEY_STORE_PATH (e.g. '/dev/shm/dc_assistant-session-keys'),
+#         works across all gunicorn workers. The directory is created if missing and must be owned by the user running
+#         the workers, with no group or other permissions.
+# 'locmem': opt-in, memory of each worker, a deleted key stays usable in other workers until its entry expires
+#           (the master key can't be rotated with this store)
+SESSION_KEY_STORE = 'database'
+SESSION_KEY_STORE_PATH = None                   # Directory of the 'file' store, required with it
+SESSION_KEY_STORE_TTL = 300                     # Seconds before a stored session key is read from the database again
+
+# Secret role membership of each user is cached in each worker. A change is seen at once by the worker which made it;
+# other workers keep the old membership until their entry expires, so a user removed from a role can still decrypt
+# its secrets for up to SECRET_ROLE_CACHE_TTL seconds. Keep it short, 0 disables the cache.
+SECRET_ROLE_CACHE_SIZE = 1024                   # Max number of cached users
+SECRET_ROLE_CACHE_TTL = 5                       # Seconds
+
+# Secrets of a list page are decrypted on a thread pool of each worker. Smaller pages are decrypted inline.
+SECRET_DECRYPT_WORKERS = 4                      # Threads per worker, 1 disables the pool
+SECRET_DECRYPT_PARALLEL_MIN = 16                # Min number of secrets to use the pool
+
+# Let the browser decrypt secrets with WebCrypto. The server only sends the ciphertext and the master key wrapped with
+# the session key, so the master key is exposed to the browser of the user. Secrets in the legacy format and browsers
+# without WebCrypto are still decrypted by the server.
+SECRET_CLIENT_DECRYPTION = False
+
+# Every secret read is logged. Records are queued in each worker and written in batches by a background thread.
+SECRET_AUDIT_LOG = True
+SECRET_AUDIT_BUFFER_SIZE = 10000                # Max queued records, further records are dropped until the queue drains
+SECRET_AUDIT_BATCH_SIZE = 500                   # Max records per insert
+SECRET_AUDIT_FLUSH_INTERVAL = 2.0               # Max seconds a record waits for its batch to fill
+
+# RSA key pairs offered by the API are pre-generated in a background process of each worker.
+RSA_KEY_POOL_SIZES = [2048, 4096]               # Key sizes kept ready, other sizes are generated on request
+RSA_KEY_POOL_DEPTH = 2                          # Key pairs kept ready per size, 0 disables the pool
+
+# Parsed RSA public keys of user keys are cached in each worker, keyed by fingerprint.
+RSA_PUBLIC_KEY_CACHE_SIZE = 256                 # Max number of cached public keys
+RSA_PUBLIC_KEY_CACHE_TTL = 3600                 # Seconds
+
+# Bulk activation of user keys encrypts the master key for each public key on a pool of processes.
+USERKEY_ACTIVATE_WORKERS = None                 # Number of processes, None: one per CPU, 1: no pool
+
+# Rendered rack elevations are cached in each worker. An entry is reused until the rack or one of its devices changes.
+RACK_ELEVATION_CACHE_SIZE = 2048                # Max number of cached racks
+RACK_ELEVATION_CACHE_TTL = 3600                 # Seconds
+
+# Statistics of each region subtree (locations, racks, devices, secrets, rack units) are computed with one query and
+# cached in each worker. The cache is checked against row counts and last update times read from the database at
+# most once a second, so changes made through any worker or command show up within a second. Changes written to the
+# database without updating last_updated (raw SQL) may be missed until the entry expires.
+REGION_STATS_CACHE_TTL = 300                    # Seconds
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
\ No newline at end of file
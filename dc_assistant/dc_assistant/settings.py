@@ -39,6 +39,30 @@ ALLOWED_HOSTS = getattr(configuration, 'ALLOWED_HOSTS')
 DATABASE = getattr(configuration, 'DATABASE')
 SECRET_KEY = getattr(configuration, 'SECRET_KEY')
 PAGINATE_COUNT = getattr(configuration, 'PAGINATE_COUNT', 5)
+SESSION_KEY_CACHE_SIZE = getattr(configuration, 'SESSION_KEY_CACHE_SIZE', 1024)
+SESSION_KEY_CACHE_TTL = getattr(configuration, 'SESSION_KEY_CACHE_TTL', 300)
+SESSION_KEY_DEFAULT_TTL = getattr(configuration, 'SESSION_KEY_DEFAULT_TTL', None)
+SESSION_KEY_CLEANUP_INTERVAL = getattr(configuration, 'SESSION_KEY_CLEANUP_INTERVAL', 300)
+SESSION_KEY_STORE = getattr(configuration, 'SESSION_KEY_STORE', 'database')
+SESSION_KEY_STORE_PATH = getattr(configuration, 'SESSION_KEY_STORE_PATH', None)
+SESSION_KEY_STORE_TTL = getattr(configuration, 'SESSION_KEY_STORE_TTL', 300)
+SECRET_ROLE_CACHE_SIZE = getattr(configuration, 'SECRET_ROLE_CACHE_SIZE', 1024)
+SECRET_ROLE_CACHE_TTL = getattr(configuration, 'SECRET_ROLE_CACHE_TTL', 5)
+SECRET_DECRYPT_WORKERS = getattr(configuration, 'SECRET_DECRYPT_WORKERS', 4)
+SECRET_DECRYPT_PARALLEL_MIN = getattr(configuration, 'SECRET_DECRYPT_PARALLEL_MIN', 16)
+SECRET_CLIENT_DECRYPTION = getattr(configuration, 'SECRET_CLIENT_DECRYPTION', False)
+SECRET_AUDIT_LOG = getattr(configuration, 'SECRET_AUDIT_LOG', True)
+SECRET_AUDIT_BUFFER_SIZE = getattr(configuration, 'SECRET_AUDIT_BUFFER_SIZE', 10000)
+SECRET_AUDIT_BATCH_SIZE = getattr(configuration, 'SECRET_AUDIT_BATCH_SIZE', 500)
+SECRET_AUDIT_FLUSH_INTERVAL = getattr(configuration, 'SECRET_AUDIT_FLUSH_INTERVAL', 2.0)
+RSA_KEY_POOL_SIZES = getattr(configuration, 'RSA_KEY_POOL_SIZES', [2048, 4096])
+RSA_KEY_POOL_DEPTH = getattr(configuration, 'RSA_KEY_POOL_DEPTH', 2)
+RSA_PUBLIC_KEY_CACHE_SIZE = getattr(configuration, 'RSA_PUBLIC_KEY_CACHE_SIZE', 256)
+RSA_PUBLIC_KEY_CACHE_TTL = getattr(configuration, 'RSA_PUBLIC_KEY_CACHE_TTL', 3600)
+USERKEY_ACTIVATE_WORKERS = getattr(configuration, 'USERKEY_ACTIVATE_WORKERS', None)
+RACK_ELEVATION_CACHE_SIZE = getattr(configuration, 'RACK_ELEVATION_CACHE_SIZE', 2048)
+RACK_ELEVATION_CACHE_TTL = getattr(configuration, 'RACK_ELEVATION_CACHE_TTL', 3600)
+REGION_STATS_CACHE_TTL = getattr(configuration, 'REGION_STATS_CACHE_TTL', 300)
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = getattr(configuration, 'DEBUG', False)
 
@@ -1,13 +1,16 @@
 import django_filters
+from django import forms
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
-from organisation.models import Region, Location, Vendor, VendorModel, Rack, DeviceRole, Platform, Device
+from organisation.models import Location, Vendor, VendorModel, Rack, RackFreeSpace, DeviceRole, Platform, Device
 from extend.models import Tag
-from secret.models import Secret, SecretRole
+from organisation.regions import get_region_intervals, region_subtree_q
+from secret.models import Secret, SecretAccessLog, SecretRole, get_member_role_ids
+from secret.search import search_secrets
 
 __all__ = (
     'LocationFilterSet',
     'RackFilterSet',
+    'RackFreeSpaceFilterSet',
     'DeviceModelFilterSet',
     'DeviceFilterSet',
     'SecretFilterSet',
@@ -21,20 +24,64 @@ class NumericInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
     pass
 
 
-class TreeNodeMultipleChoiceFilter(django_filters.ModelMultipleChoiceFilter):
+class TreeNodeMultipleChoiceField(forms.Field):
     """
-    Filters for a set of Models, including all descendant models within a Tree.  Example: [<Region: R1>,<Region: R2>]
+    List of values identifying tree nodes by to_field_name. Cleans to the (tree_id, lft, rght) intervals of the
+    selected regions, read in one query; the null choice (if null_label is set) cleans to None.
     """
+    widget = forms.SelectMultiple
+    default_error_messages = {
+        'invalid_choice': 'Select a valid choice. %(value)s is not one of the available choices.',
+    }
 
-    def get_filter_predicate(self, v):
-        # null value filtering
-        if v is None:
-            return {self.field_name.replace('in', 'isnull'): True}
-        return super().get_filter_predicate(v)
+    def __init__(self, to_field_name='pk', null_label=None, null_value='null', **kwargs):
+        self.to_field_name = to_field_name
+        self.null_label = null_label
+        self.null_value = null_value
+        super().__init__(**kwargs)
+
+    def to_python(self, value):
+        if not value:
+            return []
+        return [str(v) for v in value]
+
+    def clean(self, value):
+        value = super().clean(value)
+        include_null = self.null_label is not None and self.null_value in value
+        if include_null:
+            value = [v for v in value if v != self.null_value]
+        try:
+            intervals = get_region_intervals(value, self.to_field_name) if value else {}
+        except (ValueError, TypeError, forms.ValidationError):
+            # A value which is not valid for to_field_name (like a non numeric id)
+            intervals = {}
+        for v in value:
+            if v not in intervals:
+                raise forms.ValidationError(
+                    self.error_messages['invalid_choice'], code='invalid_choice', params={'value': v}
+                )
+        return [intervals[v] for v in value] + ([None] if include_null else [])
+
+
+class TreeNodeMultipleChoiceFilter(django_filters.Filter):
+    """
+    Filters for a set of Regions, including all descendant regions within the tree. Example: ?region=r1&region=r2
+    Each selected subtree is matched by a range on the MPTT columns of the joined region, so the query has the same
+    shape for a leaf and for a whole country.
+    """
+    field_class = TreeNodeMultipleChoiceField
+
+    def __init__(self, *args, to_field_name='pk', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.extra['to_field_name'] = to_field_name
 
     def filter(self, qs, value):
-        value = [node.get_descendants(include_self=True) if not isinstance(node, str) else node for node in value]
-        return super().filter(qs, value)
+        if not value:
+            return qs
+        return self.get_method(qs)(region_subtree_q(
+            self.field_name, [v for v in value if v is not None], include_null=None in value
+        ))
+
 
 class TagFilter(django_filters.ModelMultipleChoiceFilter):
     """
@@ -53,13 +100,11 @@ class TagFilter(django_filters.ModelMultipleChoiceFilter):
 
 class LocationFilterSet(django_filters.FilterSet):
     # region_id = TreeNodeMultipleChoiceFilter(
-    #     queryset=Region.objects.all(),
-    #     field_name='region__in',
+    #     field_name='region',
     #     label='Region (ID)',
     # )
     region = TreeNodeMultipleChoiceFilter(
-        queryset=Region.objects.all(),
-        field_name='region__in',
+        field_name='region',
         to_field_name='slug',
         label='Region (slug)',
     )
@@ -85,6 +130,54 @@ class RackFilterSet(django_filters.FilterSet):
             'id', 'name', 'racktype', 'u_height'
         ]
 
+
+class RackFreeSpaceFilterSet(django_filters.FilterSet):
+    FACE_CHOICES = (
+        ('front', 'Front'),
+        ('rear', 'Rear'),
+    )
+
+    location = django_filters.ModelMultipleChoiceFilter(
+        field_name='rack__location__slug',
+        queryset=Location.objects.all(),
+        to_field_name='slug',
+        label='Location (slug)',
+    )
+    region = TreeNodeMultipleChoiceFilter(
+        field_name='rack__location__region',
+        to_field_name='slug',
+        label='Region (slug), including its subregions',
+    )
+    face = django_filters.ChoiceFilter(
+        choices=FACE_CHOICES,
+        method='filter_face',
+        label='Face',
+    )
+    full_depth = django_filters.BooleanFilter(
+        method='filter_full_depth',
+        label='Free on both faces',
+    )
+    size = django_filters.NumberFilter(
+        field_name='size',
+        lookup_expr='gte',
+        label='Minimum contiguous units',
+    )
+
+    class Meta:
+        model = RackFreeSpace
+        fields = ['rack_id']
+
+    def filter_face(self, queryset, name, value):
+        if self.form.cleaned_data.get('full_depth'):
+            return queryset
+        return queryset.filter(face=Device.REAR if value == 'rear' else Device.FRONT)
+
+    def filter_full_depth(self, queryset, name, value):
+        if value:
+            return queryset.filter(face=RackFreeSpace.FULL_DEPTH)
+        return queryset
+
+
 class DeviceModelFilterSet(django_filters.FilterSet):
     vendor_id = django_filters.ModelMultipleChoiceFilter(
         queryset=Vendor.objects.all(),
@@ -156,13 +249,11 @@ class DeviceFilterSet(django_filters.FilterSet):
         label='Platform (ID)',
     )
     region_id = TreeNodeMultipleChoiceFilter(
-        queryset=Region.objects.all(),
-        field_name='location__region__in',
+        field_name='location__region',
         label='Region (ID)',
     )
     region = TreeNodeMultipleChoiceFilter(
-        queryset=Region.objects.all(),
-        field_name='location__region__in',
+        field_name='location__region',
         to_field_name='slug',
         label='Region (slug)',
     )
@@ -211,16 +302,54 @@ class SecretFilterSet(django_filters.FilterSet):
         to_field_name='name',
         label='Device (name)',
     )
+    decryptable = django_filters.BooleanFilter(
+        method='filter_decryptable',
+        label='Decryptable by current user',
+    )
     tag = TagFilter()
 
     class Meta:
         model = Secret
         fields = ['name']
 
+    def filter_decryptable(self, queryset, name, value):
+        user = getattr(self.request, 'user', None)
+        if user is None or not user.is_authenticated:
+            # Without a user nothing can be decrypted
+            return queryset.none() if value else queryset
+        if user.is_superuser:
+            return queryset if value else queryset.none()
+        role_ids = get_member_role_ids(user)
+        if value:
+            return queryset.filter(role_id__in=role_ids)
+        return queryset.exclude(role_id__in=role_ids)
+
     def search(self, queryset, name, value):
         if not value.strip():
             return queryset
-        return queryset.filter(
-            Q(name__icontains=value) |
-            Q(device__name__icontains=value)
-        )
+        return search_secrets(queryset, value.strip())
+
+
+class SecretAccessLogFilterSet(django_filters.FilterSet):
+    secret_id = django_filters.NumberFilter(
+        label='Secret (ID)',
+    )
+    user_id = django_filters.NumberFilter(
+        label='User (ID)',
+    )
+    user = django_filters.CharFilter(
+        field_name='username',
+        label='User (name)',
+    )
+    since = django_filters.IsoDateTimeFilter(
+        field_name='time',
+        lookup_expr='gte',
+    )
+    until = django_filters.IsoDateTimeFilter(
+        field_name='time',
+        lookup_expr='lt',
+    )
+
+    class Meta:
+        model = SecretAccessLog
+        fields = ['access']
@@ -0,0 +1,14 @@
+from copy import deepcopy
+from rest_framework import routers
+
+
+class BulkRouter(routers.DefaultRouter):
+    """
+    DefaultRouter which also routes PUT and PATCH requests to a list endpoint, as bulk_update() and
+    bulk_partial_update() of the viewset.
+    """
+    routes = deepcopy(routers.DefaultRouter.routes)
+    routes[0].mapping.update({
+        'put': 'bulk_update',
+        'patch': 'bulk_partial_update',
+    })
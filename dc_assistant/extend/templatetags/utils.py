@@ -1,4 +1,5 @@
 from django import template
+from django.conf import settings
 from django.urls import reverse
 import re
 
@@ -65,6 +66,16 @@ def edit_button(instance, use_pk=False):
 @register.filter()
 def decryptable_by(secret, user):
     """
-    Determine whether a given User is permitted to decrypt a Secret.
+    Determine whether a given User is permitted to decrypt a Secret. Role membership is resolved once per user, not
+    for each Secret.
     """
     return secret.decryptable_by(user)
+
+@register.inclusion_tag('secret/secret_scripts.html')
+def secret_scripts():
+    """
+    Include the scripts for unlocking secrets, with the WebCrypto module if client-side decryption is enabled.
+    """
+    return {
+        'client_decryption': settings.SECRET_CLIENT_DECRYPTION,
+    }
@@ -1,3 +1,73 @@
+import django_filters
+from django.http import QueryDict
 from django.test import TestCase
+from organisation.models import Location, Region
+from .filters import LocationFilterSet, TreeNodeMultipleChoiceFilter
 
-# Create your tests here.
+
+class NullRegionFilterSet(django_filters.FilterSet):
+    region = TreeNodeMultipleChoiceFilter(field_name='region', to_field_name='slug', null_label='None')
+
+    class Meta:
+        model = Location
+        fields = []
+
+
+class RegionFilterTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.europe = Region.objects.create(name='Europe', slug='europe')
+        cls.germany = Region.objects.create(name='Germany', slug='germany', parent=cls.europe)
+        cls.berlin = Region.objects.create(name='Berlin', slug='berlin', parent=cls.germany)
+        cls.asia = Region.objects.create(name='Asia', slug='asia')
+        for region in (cls.europe, cls.germany, cls.berlin, cls.asia, None):
+            slug = region.slug if region else 'nowhere'
+            Location.objects.create(name=slug, slug=slug, region=region)
+
+    def filter(self, query, filterset_class=LocationFilterSet):
+        filterset = filterset_class(QueryDict(query), Location.objects.all())
+        self.assertTrue(filterset.is_valid(), filterset.errors)
+        return set(filterset.qs.values_list('slug', flat=True))
+
+    def test_subtree(self):
+        self.assertEqual(self.filter('region=europe'), {'europe', 'germany', 'berlin'})
+        self.assertEqual(self.filter('region=germany'), {'germany', 'berlin'})
+        self.assertEqual(self.filter('region=berlin&region=asia'), {'berlin', 'asia'})
+        self.assertEqual(self.filter('region=europe&region=berlin'), {'europe', 'germany', 'berlin'})
+        self.assertEqual(self.filter(''), {'europe', 'germany', 'berlin', 'asia', 'nowhere'})
+
+    def test_unknown_region_is_rejected(self):
+        filterset = LocationFilterSet(QueryDict('region=europe&region=mars'), Location.objects.all())
+        self.assertFalse(filterset.is_valid())
+        self.assertIn('region', filterset.errors)
+
+    def test_tree_change(self):
+        self.assertEqual(self.filter('region=europe'), {'europe', 'germany', 'berlin'})
+
+        # Moving a subtree changes the intervals of the regions around it
+        germany = Region.objects.get(pk=self.germany.pk)
+        germany.parent = self.asia
+        germany.save()
+        self.assertEqual(self.filter('region=europe'), {'europe'})
+        self.assertEqual(self.filter('region=asia'), {'asia', 'germany', 'berlin'})
+
+        # A new region can be selected at once
+        munich = Region.objects.create(name='Munich', slug='munich', parent=germany)
+        Location.objects.create(name='munich', slug='munich', region=munich)
+        self.assertEqual(self.filter('region=munich'), {'munich'})
+        self.assertEqual(self.filter('region=asia'), {'asia', 'germany', 'berlin', 'munich'})
+
+    def test_null_choice(self):
+        self.assertEqual(self.filter('region=null', NullRegionFilterSet), {'nowhere'})
+        self.assertEqual(
+            self.filter('region=null&region=germany', NullRegionFilterSet), {'nowhere', 'germany', 'berlin'}
+        )
+        # Without null_label, null is not a valid choice
+        self.assertFalse(LocationFilterSet(QueryDict('region=null'), Location.objects.all()).is_valid())
+
+    def test_queries(self):
+        filterset = LocationFilterSet(QueryDict('region=europe&region=asia'), Location.objects.all())
+        # One query for the intervals of the selected regions, one for the locations
+        with self.assertNumQueries(2):
+            list(filterset.qs)
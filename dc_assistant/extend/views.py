@@ -24,7 +24,7 @@ class ListObjectsView(View):
         content_type = ContentType.objects.get_for_model(model)
 
         if self.filterset:
-            self.queryset = self.filterset(request.GET, self.queryset).qs
+            self.queryset = self.filterset(request.GET, self.queryset, request=request).qs
 
         table = self.table(self.queryset)
         if 'pk' in table.base_columns:
@@ -1,5 +1,8 @@
-from rest_framework.serializers import ModelSerializer
-from organisation.models import Device
+from copy import copy
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.serializers import ChoiceField, IntegerField, ModelSerializer, Serializer, SerializerMethodField, \
+    ValidationError
+from organisation.models import Device, Rack, RackFreeSpace, Region
 
 class DeviceSerializer(ModelSerializer):
 
@@ -9,3 +12,56 @@ class DeviceSerializer(ModelSerializer):
             'id', 'name', 'display_name', 'device_model', 'device_role', 'platform', 'serial',
             'location', 'rack', 'position', 'face_position', 'created', 'last_updated',
         ]
+
+    def validate(self, attrs):
+        # Run the model validation, which checks the rack position
+        device = copy(self.instance) if self.instance is not None else Device()
+        for name, value in attrs.items():
+            setattr(device, name, value)
+        try:
+            device.clean()
+        except DjangoValidationError as e:
+            raise ValidationError(e.message_dict)
+        return attrs
+
+
+class DevicePlacementSerializer(Serializer):
+    device = IntegerField()
+    rack = IntegerField(allow_null=True)
+    position = IntegerField(min_value=1, allow_null=True, required=False)
+    face_position = ChoiceField(choices=Device.RACK_SIDE_CHOICES, allow_null=True, required=False)
+
+
+class NestedRackSerializer(ModelSerializer):
+    location = SerializerMethodField()
+
+    class Meta:
+        model = Rack
+        fields = ['id', 'name', 'location', 'u_height']
+
+    def get_location(self, obj):
+        return obj.location.slug
+
+
+class RackFreeSpaceSerializer(ModelSerializer):
+    rack = NestedRackSerializer()
+    face = SerializerMethodField()
+
+    class Meta:
+        model = RackFreeSpace
+        fields = ['rack', 'face', 'position', 'size']
+
+    def get_face(self, obj):
+        return obj.get_face_display()
+
+
+class RegionSerializer(ModelSerializer):
+    stats = SerializerMethodField()
+
+    class Meta:
+        model = Region
+        fields = ['id', 'name', 'slug', 'parent', 'stats']
+
+    def get_stats(self, obj):
+        stats = obj.stats
+        return dict(stats._asdict(), utilization=stats.utilization)
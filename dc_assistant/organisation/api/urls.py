@@ -13,7 +13,9 @@ class OrganisationRootView(routers.APIRootView):
 router = routers.DefaultRouter()
 router.APIRootView = OrganisationRootView
 
+router.register('regions', views.RegionViewSet)
 router.register('devices', views.DeviceViewSet)
+router.register('free-space', views.RackFreeSpaceViewSet)
 
 app_name = 'organisation-api'
 urlpatterns = router.urls
\ No newline at end of file
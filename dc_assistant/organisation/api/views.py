@@ -1,7 +1,14 @@
-from rest_framework.viewsets import ModelViewSet
-from organisation.models import Device
-from extend.filters import DeviceFilterSet
-from .serializers import DeviceSerializer
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from django_filters.rest_framework import DjangoFilterBackend
+from organisation.models import Device, RackFreeSpace, Region
+from organisation.placement import place_devices
+from extend.filters import DeviceFilterSet, RackFreeSpaceFilterSet
+from .serializers import DevicePlacementSerializer, DeviceSerializer, RackFreeSpaceSerializer, RegionSerializer
 
 class DeviceViewSet(ModelViewSet):
     queryset = Device.objects.prefetch_related(
@@ -9,3 +16,45 @@ class DeviceViewSet(ModelViewSet):
     )
     filterset_class = DeviceFilterSet
     serializer_class = DeviceSerializer
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def place(self, request):
+        """
+        Move many devices at once. Expects a list of {"device": id, "rack": id or null, "position": unit,
+        "face_position": 1 (front) or 0 (rear)}. All moves are validated together and applied in one transaction;
+        if any of them fails, nothing changes and the errors are returned by index of the move.
+        """
+        if not request.user.has_perm('organisation.change_device'):
+            raise PermissionDenied()
+        serializer = DevicePlacementSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            devices = place_devices(serializer.validated_data)
+        except DjangoValidationError as e:
+            raise ValidationError(e.message_dict)
+        return Response([
+            {'id': device.pk, 'rack': device.rack_id, 'position': device.position, 'face_position': device.face_position}
+            for device in devices
+        ])
+
+
+class RackFreeSpaceViewSet(ReadOnlyModelViewSet):
+    """
+    Runs of contiguous free units in racks. Filter by `location` and `region` (slugs, a region includes its
+    subregions), `face` (front or rear), `full_depth` (free on both faces) and `size` (minimum number of units).
+    Example: ?region=moscow&face=front&size=4
+    """
+    queryset = RackFreeSpace.objects.select_related('rack__location').order_by(
+        'rack__location__name', 'rack__name', 'rack_id', 'face', 'position'
+    )
+    serializer_class = RackFreeSpaceSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = RackFreeSpaceFilterSet
+
+
+class RegionViewSet(ReadOnlyModelViewSet):
+    """
+    Regions with the totals of their whole subtree: locations, racks, devices, secrets and rack units.
+    """
+    queryset = Region.objects.all()
+    serializer_class = RegionSerializer
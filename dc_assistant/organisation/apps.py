@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class OrganisationConfig(AppConfig):
     name = 'organisation'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,71 @@
+from django.db import transaction
+from .elevation import RackElevation, load_rack_devices
+from .models import Device, Rack, RackFreeSpace
+
+# Racks recomputed per query by rebuild_free_space()
+REBUILD_CHUNK_SIZE = 500
+
+
+def free_intervals(occupancy):
+    """
+    Return list of (position, size) of the runs of free units in an occupancy array (one entry per unit starting
+    at U1, 0 when free).
+    """
+    intervals = []
+    start = None
+    for unit, used in enumerate(occupancy, 1):
+        if not used and start is None:
+            start = unit
+        elif used and start is not None:
+            intervals.append((start, unit - start))
+            start = None
+    if start is not None:
+        intervals.append((start, len(occupancy) - start + 1))
+    return intervals
+
+
+def rack_free_space(rack, devices):
+    """
+    Return unsaved RackFreeSpace of a rack for the given ElevationDevices. Devices which overlap others still take
+    their units, so a conflicting placement never shows up as free space.
+    """
+    elevation = RackElevation(rack, devices)
+    for index, device in enumerate(elevation.conflicts, len(devices) + 1):
+        for face in elevation.faces(device):
+            for unit in range(max(device.position, 1) - 1, min(device.position - 1 + device.u_height, rack.u_height)):
+                face[unit] = index
+    full_depth = [front or rear for front, rear in zip(elevation.front, elevation.rear)]
+    return [
+        RackFreeSpace(rack=rack, face=face, position=position, size=size)
+        for face, occupancy in (
+            (Device.FRONT, elevation.front),
+            (Device.REAR, elevation.rear),
+            (RackFreeSpace.FULL_DEPTH, full_depth),
+        )
+        for position, size in free_intervals(occupancy)
+    ]
+
+
+def update_free_space(rack_ids):
+    """
+    Recompute the free space of the given racks. Called when devices are mounted, moved or removed.
+    """
+    rack_ids = {pk for pk in rack_ids if pk is not None}
+    if not rack_ids:
+        return
+    racks = list(Rack.objects.filter(pk__in=rack_ids).only('pk', 'u_height'))
+    devices = load_rack_devices(racks)
+    with transaction.atomic():
+        RackFreeSpace.objects.filter(rack_id__in=rack_ids).delete()
+        RackFreeSpace.objects.bulk_create([
+            free_space for rack in racks for free_space in rack_free_space(rack, devices[rack.pk])
+        ])
+
+
+def rebuild_free_space():
+    """
+    Recompute the free space of all racks.
+    """
+    rack_ids = list(Rack.objects.values_list('pk', flat=True))
+    for i in range(0, len(rack_ids), REBUILD_CHUNK_SIZE):
+        update_free_space(rack_ids[i:i + REBUILD_CHUNK_SIZE])
@@ -0,0 +1,221 @@
+from array import array
+from collections import namedtuple
+from django.conf import settings
+from django.db.models import Count, Max
+from django.urls import reverse
+from django.utils.html import escape
+from extend.templatetags.utils import foreground_color
+from secret.cache import TTLCache
+from .models import Device, Rack
+
+# Size of the SVG elevation in pixels
+UNIT_HEIGHT = 22
+UNIT_WIDTH = 230
+LABEL_WIDTH = 30
+
+SVG_STYLE = (
+    'text{font:11px sans-serif;dominant-baseline:middle}'
+    '.unit{fill:#6c757d;text-anchor:end}'
+    '.slot{fill:#f8f9fa;stroke:#dee2e6}'
+    '.device{stroke:#343a40}'
+    '.back{fill-opacity:.35}'
+    '.name{text-anchor:middle}'
+)
+
+# Device of a rack as the elevation needs it
+ElevationDevice = namedtuple('ElevationDevice', [
+    'pk', 'name', 'position', 'u_height', 'face', 'full_depth', 'model', 'role', 'color',
+])
+
+# Rendered elevations: rack id -> (version, RackElevation)
+elevation_cache = TTLCache(
+    maxsize=settings.RACK_ELEVATION_CACHE_SIZE,
+    ttl=settings.RACK_ELEVATION_CACHE_TTL
+)
+
+
+class RackElevation:
+    """
+    Unit occupancy of a rack. `front` and `rear` hold one entry per unit, starting at U1: 0 for a free unit,
+    otherwise the index in `devices` plus one. Full depth devices occupy both faces. Devices which overlap an
+    earlier device or don't fit in the rack are left out of the occupancy and listed in `conflicts`.
+    """
+    def __init__(self, rack, devices):
+        self.rack = rack
+        self.devices = devices
+        self.conflicts = []
+        self.front = array('H', bytes(2 * rack.u_height))
+        self.rear = array('H', bytes(2 * rack.u_height))
+        self._svg = {}
+
+        for index, device in enumerate(devices, 1):
+            faces = self.faces(device)
+            units = range(device.position - 1, device.position - 1 + device.u_height)
+            if units.start < 0 or units.stop > rack.u_height or any(face[unit] for face in faces for unit in units):
+                self.conflicts.append(device)
+                continue
+            for face in faces:
+                for unit in units:
+                    face[unit] = index
+
+    def faces(self, device):
+        if device.full_depth:
+            return self.front, self.rear
+        return (self.rear,) if device.face == Device.REAR else (self.front,)
+
+    @property
+    def free_units(self):
+        """
+        Number of units free on both faces.
+        """
+        return sum(1 for front, rear in zip(self.front, self.rear) if not front and not rear)
+
+    def _y(self, position, u_height):
+        """
+        Return the SVG y coordinate of the top of a block of units starting at position.
+        """
+        if self.rack.desc_units == Rack.BUTTOM_TO_TOP:
+            return (self.rack.u_height - position - u_height + 1) * UNIT_HEIGHT
+        return (position - 1) * UNIT_HEIGHT
+
+    def svg(self, face=Device.FRONT):
+        """
+        Return the elevation of one face of the rack as an SVG document.
+        """
+        if face not in self._svg:
+            self._svg[face] = self._render(face)
+        return self._svg[face]
+
+    @property
+    def front_svg(self):
+        return self.svg(Device.FRONT)
+
+    @property
+    def rear_svg(self):
+        return self.svg(Device.REAR)
+
+    def _render(self, face):
+        occupancy = self.front if face == Device.FRONT else self.rear
+        width = LABEL_WIDTH + UNIT_WIDTH
+        height = self.rack.u_height * UNIT_HEIGHT
+        parts = [
+            '<svg xmlns="http://www.w3.org/2000/svg" class="rack-elevation" width="{0}" height="{1}" '
+            'viewBox="0 0 {0} {1}"><style>{2}</style>'.format(width, height, SVG_STYLE)
+        ]
+        for unit in range(1, self.rack.u_height + 1):
+            y = self._y(unit, 1)
+            parts.append('<text class="unit" x="{}" y="{}">{}</text>'.format(
+                LABEL_WIDTH - 4, y + UNIT_HEIGHT // 2, unit
+            ))
+            if not occupancy[unit - 1]:
+                parts.append('<rect class="slot" x="{}" y="{}" width="{}" height="{}"/>'.format(
+                    LABEL_WIDTH, y, UNIT_WIDTH, UNIT_HEIGHT
+                ))
+
+        drawn = set()
+        for index in occupancy:
+            if not index or index in drawn:
+                continue
+            drawn.add(index)
+            device = self.devices[index - 1]
+            # A full depth device mounted on the other face is drawn faded
+            back = device.full_depth and (device.face == Device.REAR) != (face == Device.REAR)
+            y = self._y(device.position, device.u_height)
+            parts.append(
+                '<a href="{url}"><title>{name} ({model}, {role})</title>'
+                '<rect class="device{back}" x="{x}" y="{y}" width="{w}" height="{h}" fill="#{color}"/>'
+                '<text class="name" x="{tx}" y="{ty}" fill="#{fg}">{name}</text></a>'.format(
+                    url=reverse('organisation:device', args=[device.pk]),
+                    name=escape(device.name),
+                    model=escape(device.model),
+                    role=escape(device.role),
+                    back=' back' if back else '',
+                    x=LABEL_WIDTH,
+                    y=y,
+                    w=UNIT_WIDTH,
+                    h=device.u_height * UNIT_HEIGHT,
+                    color=device.color,
+                    tx=LABEL_WIDTH + UNIT_WIDTH // 2,
+                    ty=y + device.u_height * UNIT_HEIGHT // 2,
+                    fg=foreground_color(device.color),
+                )
+            )
+        parts.append('</svg>')
+        return ''.join(parts)
+
+
+def _rack_versions(racks):
+    """
+    Return rack id -> version of the elevation. The version changes when the rack or one of its mounted devices, their
+    models or roles is saved, or when a device is mounted or removed.
+    """
+    rows = Device.objects.filter(
+        rack__in=racks,
+        position__isnull=False
+    ).order_by().values('rack_id').annotate(
+        count=Count('pk'),
+        device_updated=Max('last_updated'),
+        model_updated=Max('device_model__last_updated'),
+        role_updated=Max('device_role__last_updated'),
+    )
+    devices = {
+        row['rack_id']: (row['count'], row['device_updated'], row['model_updated'], row['role_updated'])
+        for row in rows
+    }
+    return {
+        rack.pk: (rack.last_updated, rack.u_height, rack.desc_units) + devices.get(rack.pk, ())
+        for rack in racks
+    }
+
+
+def load_rack_devices(racks):
+    """
+    Return rack id -> list of ElevationDevice of the devices mounted in the rack, in one query.
+    """
+    devices = {rack.pk: [] for rack in racks}
+    rows = Device.objects.filter(
+        rack__in=racks,
+        position__isnull=False
+    ).order_by('rack_id', 'position', 'pk').values_list(
+        'rack_id', 'pk', 'name', 'position', 'device_model__u_height', 'face_position', 'device_model__depth',
+        'device_model__vendor__name', 'device_model__model', 'device_role__name', 'device_role__color'
+    )
+    for rack_id, pk, name, position, u_height, face, full_depth, vendor, model, role, color in rows:
+        devices[rack_id].append(ElevationDevice(
+            pk, name, position, max(u_height, 1), Device.FRONT if face is None else face, full_depth,
+            '{} {}'.format(vendor, model), role, color
+        ))
+    return devices
+
+
+def get_rack_elevations(racks):
+    """
+    Return rack id -> RackElevation for a list of racks. Cached elevations are checked with one aggregate query,
+    the devices of all changed racks are then read with a second one.
+    """
+    racks = list(racks)
+    if not racks:
+        return {}
+    elevations = {}
+    missing = []
+    versions = _rack_versions(racks)
+    for rack in racks:
+        cached = elevation_cache.get(rack.pk)
+        if cached is not None and cached[0] == versions[rack.pk]:
+            elevations[rack.pk] = cached[1]
+        else:
+            missing.append(rack)
+    if missing:
+        devices = load_rack_devices(missing)
+        for rack in missing:
+            elevation = RackElevation(rack, devices[rack.pk])
+            elevation_cache.set(rack.pk, (versions[rack.pk], elevation))
+            elevations[rack.pk] = elevation
+    return elevations
+
+
+def get_rack_elevation(rack):
+    """
+    Return the RackElevation of a rack.
+    """
+    return get_rack_elevations([rack])[rack.pk]
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from organisation.capacity import rebuild_free_space
+from organisation.models import RackFreeSpace
+
+
+class Command(BaseCommand):
+    help = "Recompute the free space index of all racks"
+
+    def handle(self, *args, **options):
+        rebuild_free_space()
+        self.stdout.write(self.style.SUCCESS("Indexed {} runs of free units".format(RackFreeSpace.objects.count())))
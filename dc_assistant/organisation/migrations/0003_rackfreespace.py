@@ -0,0 +1,81 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def free_intervals(occupancy):
+    """
+    Return list of (position, size) of the runs of free units in an occupancy list (0 when free). Frozen copy of
+    organisation.capacity.free_intervals.
+    """
+    intervals = []
+    start = None
+    for unit, used in enumerate(occupancy, 1):
+        if not used and start is None:
+            start = unit
+        elif used and start is not None:
+            intervals.append((start, unit - start))
+            start = None
+    if start is not None:
+        intervals.append((start, len(occupancy) - start + 1))
+    return intervals
+
+
+def populate_free_space(apps, schema_editor):
+    """
+    Build the free space of existing racks. Units taken by overlapping devices count as used.
+    """
+    Rack = apps.get_model('organisation', 'Rack')
+    Device = apps.get_model('organisation', 'Device')
+    RackFreeSpace = apps.get_model('organisation', 'RackFreeSpace')
+
+    units = {pk: ([0] * u_height, [0] * u_height) for pk, u_height in Rack.objects.values_list('pk', 'u_height')}
+    devices = Device.objects.filter(rack__isnull=False, position__isnull=False).values_list(
+        'rack_id', 'position', 'device_model__u_height', 'face_position', 'device_model__depth'
+    )
+    for rack_id, position, u_height, face, full_depth in devices:
+        front, rear = units[rack_id]
+        # Device.REAR is 0
+        faces = (front, rear) if full_depth else ((rear,) if face == 0 else (front,))
+        for occupancy in faces:
+            for unit in range(max(position, 1) - 1, min(position - 1 + max(u_height, 1), len(occupancy))):
+                occupancy[unit] = 1
+
+    free_space = []
+    for rack_id, (front, rear) in units.items():
+        full_depth = [f or r for f, r in zip(front, rear)]
+        for face, occupancy in ((1, front), (0, rear), (2, full_depth)):
+            free_space.extend(
+                RackFreeSpace(rack_id=rack_id, face=face, position=position, size=size)
+                for position, size in free_intervals(occupancy)
+            )
+    RackFreeSpace.objects.bulk_create(free_space)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisation', '0002_auto_20200916_2258'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RackFreeSpace',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('face', models.PositiveSmallIntegerField(choices=[(1, 'Front'), (0, 'Rear'), (2, 'Full depth')])),
+                ('position', models.PositiveSmallIntegerField(help_text='Lowest free unit number')),
+                ('size', models.PositiveSmallIntegerField(verbose_name='Size (U)')),
+                ('rack', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='free_space', to='organisation.Rack')),
+            ],
+            options={
+                'ordering': ('rack', 'face', 'position'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='rackfreespace',
+            index=models.Index(fields=['face', 'size'], name='organisatio_face_4c961b_idx'),
+        ),
+        migrations.RunPython(populate_free_space, migrations.RunPython.noop),
+    ]
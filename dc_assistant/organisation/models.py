@@ -39,6 +39,15 @@ class Region(MPTTModel):
     def get_absolute_url(self):
         return "{}?region={}".format(reverse('organisation:location_list'), self.slug)
 
+    @property
+    def stats(self):
+        """
+        RegionStats of this region and its subregions.
+        """
+        from .regions import EMPTY_REGION_STATS, get_region_stats
+        return get_region_stats().get(self.pk, EMPTY_REGION_STATS)
+
+
 class Location(LoggingModel):
     """
     The place where located IT infrastructure (Build, Office, DC and so on)
@@ -390,5 +399,48 @@ class Device(LoggingModel):
                 raise ValidationError({
                     'face_position': "Cannot select face_position without rack selected.",
                 })
+        elif self.position and self.device_model_id:
+            from .placement import RackUnitIndex
+            error = RackUnitIndex.for_rack(self.rack).device_error(self)
+            if error:
+                raise ValidationError({
+                    'position': error,
+                })
+
+
+class RackFreeSpace(models.Model):
+    """
+    Run of contiguous free units of a rack, kept up to date by organisation.capacity when devices are saved or
+    deleted. FULL_DEPTH runs are free on both faces.
+    """
+    FULL_DEPTH = 2
+
+    FACE_CHOICES = (
+        (Device.FRONT, 'Front'),
+        (Device.REAR, 'Rear'),
+        (FULL_DEPTH, 'Full depth'),
+    )
 
+    rack = models.ForeignKey(
+        to=Rack,
+        on_delete=models.CASCADE,
+        related_name='free_space'
+    )
+    face = models.PositiveSmallIntegerField(
+        choices=FACE_CHOICES
+    )
+    position = models.PositiveSmallIntegerField(
+        help_text='Lowest free unit number'
+    )
+    size = models.PositiveSmallIntegerField(
+        verbose_name='Size (U)'
+    )
 
+    class Meta:
+        ordering = ('rack', 'face', 'position')
+        indexes = [
+            models.Index(fields=['face', 'size']),
+        ]
+
+    def __str__(self):
+        return '{} U{}-U{}'.format(self.rack, self.position, self.position + self.size - 1)
@@ -0,0 +1,155 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from .capacity import update_free_space
+from .elevation import load_rack_devices
+from .models import Device, Rack
+from .regions import bump_tree_version
+
+
+def units_label(position, last):
+    return 'U{}'.format(position) if position == last else 'U{}-U{}'.format(position, last)
+
+
+class RackUnitIndex:
+    """
+    Units taken in one rack: for each face, the id of the device mounted in every unit (None when free). Full depth
+    devices take both faces. Once built from the devices of the rack, placements are checked without queries.
+    """
+    def __init__(self, rack, devices=()):
+        self.rack = rack
+        self.front = [None] * rack.u_height
+        self.rear = [None] * rack.u_height
+        self.names = {}
+        for device in devices:
+            self.add(device.pk, device.name, device.position, device.u_height, device.face, device.full_depth)
+
+    @classmethod
+    def for_racks(cls, racks):
+        """
+        Return rack id -> RackUnitIndex for a list of racks, in one query.
+        """
+        devices = load_rack_devices(racks)
+        return {rack.pk: cls(rack, devices[rack.pk]) for rack in racks}
+
+    @classmethod
+    def for_rack(cls, rack):
+        return cls.for_racks([rack])[rack.pk]
+
+    def _faces(self, face, full_depth):
+        if full_depth:
+            return self.front, self.rear
+        return (self.rear,) if face == Device.REAR else (self.front,)
+
+    def add(self, pk, name, position, u_height, face, full_depth):
+        self.names[pk] = name
+        for units in self._faces(face, full_depth):
+            for unit in range(max(position, 1) - 1, min(position - 1 + u_height, self.rack.u_height)):
+                if units[unit] is None:
+                    units[unit] = pk
+
+    def remove(self, pk):
+        for units in (self.front, self.rear):
+            for unit, owner in enumerate(units):
+                if owner == pk:
+                    units[unit] = None
+        self.names.pop(pk, None)
+
+    def error(self, pk, position, u_height, face, full_depth):
+        """
+        Return why the device pk can't take u_height units from position on, or None if it can.
+        """
+        last = position + u_height - 1
+        if position < 1 or last > self.rack.u_height:
+            return "{} does not fit in rack {} (U1-U{}).".format(
+                units_label(position, last), self.rack, self.rack.u_height
+            )
+        taken = {
+            owner for units in self._faces(face, full_depth) for owner in units[position - 1:last]
+            if owner is not None and owner != pk
+        }
+        if taken:
+            return "{} of rack {} is already taken by {}.".format(
+                units_label(position, last), self.rack, ', '.join(sorted(self.names[owner] for owner in taken))
+            )
+        return None
+
+    def device_error(self, device):
+        """
+        Return why a Device can't be mounted at its rack position, or None if it can.
+        """
+        face = Device.FRONT if device.face_position is None else device.face_position
+        model = device.device_model
+        return self.error(device.pk, device.position, max(model.u_height, 1), face, model.depth)
+
+
+def place_devices(placements):
+    """
+    Move devices in one transaction. placements is a list of dicts with device (id), rack (id or None), position and
+    face_position (None keeps the current face). All moves are checked together, so devices can swap places. The
+    racks involved are locked until the moves are saved, so concurrent placements can't take the same units. A device
+    moved to another rack also moves to the location of the rack. If any placement fails, nothing is saved and
+    ValidationError is raised with a dict: index of the placement -> list of messages. Return the moved devices.
+    """
+    errors = [[] for placement in placements]
+    with transaction.atomic():
+        devices = Device.objects.select_related('device_model').in_bulk(
+            [placement['device'] for placement in placements]
+        )
+        rack_ids = {placement['rack'] for placement in placements} | {device.rack_id for device in devices.values()}
+        rack_ids.discard(None)
+        # Lock in a fixed order so concurrent placements don't deadlock
+        racks = {rack.pk: rack for rack in Rack.objects.select_for_update().filter(pk__in=rack_ids).order_by('pk')}
+        indexes = RackUnitIndex.for_racks(list(racks.values()))
+
+        seen = set()
+        for i, placement in enumerate(placements):
+            device = devices.get(placement['device'])
+            if device is None:
+                errors[i].append("Device {} does not exist.".format(placement['device']))
+            elif device.pk in seen:
+                errors[i].append("Device {} is placed more than once.".format(device))
+            elif device.rack_id is not None:
+                indexes[device.rack_id].remove(device.pk)
+            seen.add(placement['device'])
+
+        moved = []
+        for i, placement in enumerate(placements):
+            device = devices.get(placement['device'])
+            if errors[i]:
+                continue
+            rack = racks.get(placement['rack'])
+            position = placement.get('position')
+            face = placement.get('face_position')
+            if face is None:
+                face = Device.FRONT if device.face_position is None else device.face_position
+            if placement['rack'] is None:
+                if position:
+                    errors[i].append("Cannot select position without rack selected.")
+                    continue
+                face = None
+            elif rack is None:
+                errors[i].append("Rack {} does not exist.".format(placement['rack']))
+                continue
+            elif position:
+                u_height = max(device.device_model.u_height, 1)
+                error = indexes[rack.pk].error(device.pk, position, u_height, face, device.device_model.depth)
+                if error:
+                    errors[i].append(error)
+                    continue
+                indexes[rack.pk].add(device.pk, device.name, position, u_height, face, device.device_model.depth)
+
+            if rack is not None and device.rack_id != rack.pk:
+                device.location_id = rack.location_id
+            device.rack = rack
+            device.position = position or None
+            device.face_position = face
+            device.last_updated = timezone.now()
+            moved.append(device)
+
+        if any(errors):
+            raise ValidationError({i: messages for i, messages in enumerate(errors) if messages})
+        Device.objects.bulk_update(moved, ['rack', 'position', 'face_position', 'location', 'last_updated'])
+        update_free_space(rack_ids)
+    bump_tree_version()
+    return moved
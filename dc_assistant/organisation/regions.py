@@ -0,0 +1,166 @@
+from collections import namedtuple
+from django.conf import settings
+from django.db.models import BigIntegerField, Count, IntegerField, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce
+from secret.cache import TTLCache
+from .models import Device, Location, Rack, Region, VendorModel
+
+
+def get_region_intervals(values, to_field_name='pk'):
+    """
+    Return str(value of to_field_name) -> (tree_id, lft, rght) of the regions matching values, in one query. The
+    intervals are read for each request: they change for other regions of the tree when a region is added or moved.
+    """
+    rows = Region.objects.filter(**{'{}__in'.format(to_field_name): values}).order_by().values_list(
+        to_field_name, 'tree_id', 'lft', 'rght'
+    )
+    return {str(value): (tree_id, lft, rght) for value, tree_id, lft, rght in rows}
+
+
+def merge_intervals(intervals):
+    """
+    Drop intervals nested in another one, so each selected subtree is matched once.
+    """
+    merged = []
+    for tree_id, lft, rght in sorted(intervals):
+        if merged and merged[-1][0] == tree_id and rght <= merged[-1][2]:
+            continue
+        merged.append((tree_id, lft, rght))
+    return merged
+
+
+def region_subtree_q(field_name, intervals, include_null=False):
+    """
+    Return Q matching objects whose region (field_name is the path to it, like 'location__region') lies in one of
+    the (tree_id, lft, rght) intervals, or which have no region if include_null. The region table is joined once
+    whatever the size of the subtrees.
+    """
+    query = Q(**{'{}__isnull'.format(field_name): True}) if include_null else Q()
+    for tree_id, lft, rght in merge_intervals(intervals):
+        query |= Q(**{
+            '{}__tree_id'.format(field_name): tree_id,
+            '{}__lft__range'.format(field_name): (lft, rght),
+        })
+    return query
+
+
+class RegionStats(namedtuple('RegionStats', ['locations', 'racks', 'devices', 'secrets', 'rack_units', 'used_units'])):
+    """
+    Totals of a region and all its subregions. rack_units is the height of all racks, used_units the height of the
+    devices mounted in them.
+    """
+    @property
+    def utilization(self):
+        """
+        Share of rack units in use, in percent, or None without racks.
+        """
+        if not self.rack_units:
+            return None
+        return round(100 * self.used_units / self.rack_units, 1)
+
+
+EMPTY_REGION_STATS = RegionStats(0, 0, 0, 0, 0, 0)
+
+# Region statistics: tree version -> region id -> RegionStats
+region_stats_cache = TTLCache(
+    maxsize=2,
+    ttl=settings.REGION_STATS_CACHE_TTL
+)
+
+# The tree version is read from the database at most once a second, a list of regions asks for the statistics of
+# each of them
+TREE_VERSION_TTL = 1
+tree_version_cache = TTLCache(
+    maxsize=1,
+    ttl=TREE_VERSION_TTL
+)
+
+
+def get_tree_version():
+    """
+    Return a version of everything the region statistics are computed from, read from the database so changes made
+    by any worker or command are seen. Rows are counted and the latest last_updated of each counted model is taken;
+    regions have no timestamp, a move changes the sum of pk * parent_id instead.
+    """
+    # Imported here, the secret app depends on organisation
+    from secret.models import Secret
+
+    version = tree_version_cache.get('version')
+    if version is None:
+        aggregates = [Region.objects.aggregate(
+            count=Count('pk'),
+            parents=Sum(Cast('pk', BigIntegerField()) * Cast('parent_id', BigIntegerField())),
+        )]
+        for model in (Location, Rack, Device, VendorModel, Secret):
+            aggregates.append(model.objects.aggregate(count=Count('pk'), last_updated=Max('last_updated')))
+        version = tuple(tuple(values.values()) for values in aggregates)
+        tree_version_cache.set('version', version)
+    return version
+
+
+def bump_tree_version():
+    """
+    Read the tree version from the database again on the next request for region statistics, so changes made in
+    this worker are seen at once. Called when regions or the objects they count change.
+    """
+    tree_version_cache.clear()
+
+
+def _subquery(queryset, region_field, aggregate):
+    """
+    Return Subquery of aggregate over the rows of queryset in the region of the outer query.
+    """
+    return Coalesce(Subquery(
+        queryset.filter(**{region_field: OuterRef('pk')}).order_by().values(region_field).annotate(
+            value=aggregate
+        ).values('value'),
+        output_field=IntegerField()
+    ), 0)
+
+
+def compute_region_stats():
+    """
+    Return region id -> RegionStats of all regions. The direct totals of every region are read in one query, then
+    added up to each ancestor walking the regions in MPTT order.
+    """
+    # Imported here, the secret app depends on organisation
+    from secret.models import Secret
+
+    rows = Region.objects.annotate(
+        location_count=_subquery(Location.objects.all(), 'region', Count('pk')),
+        rack_count=_subquery(Rack.objects.all(), 'location__region', Count('pk')),
+        device_count=_subquery(Device.objects.all(), 'location__region', Count('pk')),
+        secret_count=_subquery(Secret.objects.all(), 'device__location__region', Count('pk')),
+        rack_units=_subquery(Rack.objects.all(), 'location__region', Sum('u_height')),
+        used_units=_subquery(
+            Device.objects.filter(rack__isnull=False, position__isnull=False),
+            'rack__location__region',
+            Sum('device_model__u_height')
+        ),
+    ).order_by('tree_id', 'lft').values_list(
+        'pk', 'tree_id', 'rght', 'location_count', 'rack_count', 'device_count', 'secret_count', 'rack_units', 'used_units'
+    )
+
+    totals = {}
+    ancestors = []
+    for pk, tree_id, rght, *values in rows:
+        # Regions come in MPTT order: drop the ancestors whose subtree ended before this region
+        while ancestors and (ancestors[-1][1] != tree_id or ancestors[-1][2] < rght):
+            ancestors.pop()
+        totals[pk] = values
+        for ancestor, _, _ in ancestors:
+            totals[ancestor] = [a + b for a, b in zip(totals[ancestor], values)]
+        ancestors.append((pk, tree_id, rght))
+    return {pk: RegionStats(*values) for pk, values in totals.items()}
+
+
+def get_region_stats():
+    """
+    Return region id -> RegionStats, cached for the current tree version.
+    """
+    version = get_tree_version()
+    stats = region_stats_cache.get(version)
+    if stats is None:
+        stats = compute_region_stats()
+        region_stats_cache.set(version, stats)
+    return stats
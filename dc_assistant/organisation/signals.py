@@ -0,0 +1,54 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .capacity import update_free_space
+from .models import Device, Location, Rack, Region, VendorModel
+from .regions import bump_tree_version
+
+
+@receiver(pre_save, sender=Device)
+def remember_device_rack(instance, **kwargs):
+    """
+    Keep the rack a device is saved from, so its free space is updated when the device moves to another rack.
+    """
+    instance._previous_rack_id = None
+    if instance.pk is not None:
+        instance._previous_rack_id = Device.objects.filter(pk=instance.pk).values_list('rack_id', flat=True).first()
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def update_device_free_space(instance, **kwargs):
+    update_free_space({instance.rack_id, getattr(instance, '_previous_rack_id', None)})
+
+
+@receiver(post_save, sender=Rack)
+def update_rack_free_space(instance, **kwargs):
+    update_free_space({instance.pk})
+
+
+@receiver(post_save, sender=VendorModel)
+def update_model_free_space(instance, created, **kwargs):
+    """
+    Height and depth of the model may have changed, update the racks its devices are mounted in.
+    """
+    if not created:
+        update_free_space(set(instance.instances.filter(
+            rack__isnull=False
+        ).order_by().values_list('rack_id', flat=True).distinct()))
+
+
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+def invalidate_region_tree(**kwargs):
+    bump_tree_version()
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(post_save, sender=Rack)
+@receiver(post_delete, sender=Rack)
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+@receiver(post_save, sender=VendorModel)
+def invalidate_region_stats(**kwargs):
+    bump_tree_version()
@@ -1,7 +1,7 @@
 import django_tables2 as tables
 #from extend.tables import BaseTable
 from django_tables2.utils import Accessor
-from .models import Region, Location, Rack, VendorModel, DeviceRole, Device, Platform
+from .models import Region, Location, Rack, RackFreeSpace, VendorModel, DeviceRole, Device, Platform
 
 
 REGION_ACTIONS = """
@@ -68,9 +68,23 @@ COLOR_LABEL = """
 <label class="label" style="color: {{ record.color|fgcolor }}; background-color: #{{ record.color }}">{{ record }}</label>
 """
 
+REGION_UTILIZATION = """
+{% if record.stats.utilization is not None %}{{ record.stats.utilization }}% of {{ record.stats.rack_units }}U{% else %}&mdash;{% endif %}
+"""
+
 
 
 class RegionTable(tables.Table):
+    name = tables.LinkColumn('organisation:region', args=[Accessor('pk')], order_by=('name',))
+    locations = tables.Column(accessor='stats.locations', orderable=False)
+    racks = tables.Column(accessor='stats.racks', orderable=False)
+    devices = tables.Column(accessor='stats.devices', orderable=False)
+    secrets = tables.Column(accessor='stats.secrets', orderable=False)
+    utilization = tables.TemplateColumn(
+        template_code=REGION_UTILIZATION,
+        orderable=False,
+        verbose_name='Rack utilization'
+    )
     actions = tables.TemplateColumn(
         template_code=REGION_ACTIONS,
         attrs={'td': {'class': 'text-right noprint'}},
@@ -79,7 +93,7 @@ class RegionTable(tables.Table):
 
     class Meta:
         model = Region
-        fields = ('name', 'parent', 'slug', 'actions')
+        fields = ('name', 'parent', 'slug', 'locations', 'racks', 'devices', 'secrets', 'utilization', 'actions')
         attrs = {'class': 'table table-hover table-headings'}
 
 class LocationTable(tables.Table):
@@ -111,6 +125,24 @@ class RackTable(tables.Table):
         fields = ('name', 'location', 'u_height', 'device_count')
         attrs = {'class': 'table table-hover table-headings',}
 
+class RackFreeSpaceTable(tables.Table):
+    rack = tables.LinkColumn('organisation:rack', args=[Accessor('rack_id')])
+    location = tables.LinkColumn(
+        'organisation:location', args=[Accessor('rack.location.slug')], accessor='rack.location'
+    )
+    face = tables.Column()
+    units = tables.TemplateColumn(
+        "U{{ record.position }}&ndash;U{{ record.position|add:record.size|add:-1 }}",
+        order_by=('position',),
+        verbose_name='Units'
+    )
+    size = tables.TemplateColumn("{{ record.size }}U", verbose_name='Size')
+
+    class Meta:
+        model = RackFreeSpace
+        fields = ('rack', 'location', 'face', 'units', 'size')
+        attrs = {'class': 'table table-hover table-headings',}
+
 class VendorModelTable(tables.Table):
     #model = tables.LinkColumn('organisation:model', args=[Accessor('pk')], verbose_name='Device Model')
     instance_count = tables.TemplateColumn(
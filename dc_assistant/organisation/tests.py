@@ -1,3 +1,328 @@
+from django.core.exceptions import ValidationError
 from django.test import TestCase
+from django.utils import timezone
+from .capacity import free_intervals, rebuild_free_space
+from .models import Device, DeviceRole, Location, Rack, RackFreeSpace, Region, Vendor, VendorModel
+from .elevation import RackElevation, elevation_cache, get_rack_elevation
+from .placement import place_devices
+from .regions import EMPTY_REGION_STATS, RegionStats, get_region_stats, tree_version_cache
 
-# Create your tests here.
+
+class PlaceDevicesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Region', slug='region')
+        cls.location = Location.objects.create(name='Location', slug='location', region=region)
+        cls.rack = Rack.objects.create(name='R1', location=cls.location, u_height=10)
+        cls.other_rack = Rack.objects.create(name='R2', location=cls.location, u_height=10)
+        vendor = Vendor.objects.create(name='Vendor', slug='vendor')
+        cls.full_depth = VendorModel.objects.create(vendor=vendor, model='2U', slug='2u', u_height=2, depth=True)
+        cls.half_depth = VendorModel.objects.create(vendor=vendor, model='1U', slug='1u', u_height=1, depth=False)
+        cls.role = DeviceRole.objects.create(name='Server', slug='server', color='00ff00')
+
+    def create_device(self, name, model, rack=None, position=None, face=Device.FRONT):
+        return Device.objects.create(
+            name=name, device_model=model, device_role=self.role, location=self.location, rack=rack,
+            position=position, face_position=face
+        )
+
+    def placement(self, device, rack, position, face=None):
+        return {'device': device.pk, 'rack': rack.pk if rack else None, 'position': position, 'face_position': face}
+
+    def assertPosition(self, device, rack, position):
+        device = Device.objects.get(pk=device.pk)
+        self.assertEqual((device.rack_id, device.position), (rack.pk if rack else None, position))
+
+    def test_overlap_with_mounted_device(self):
+        self.create_device('a', self.full_depth, self.rack, 3)
+        b = self.create_device('b', self.full_depth)
+
+        with self.assertRaises(ValidationError) as cm:
+            place_devices([self.placement(b, self.rack, 4)])
+        self.assertIn('U4-U5 of rack R1 is already taken by a.', cm.exception.message_dict[0])
+        self.assertPosition(b, None, None)
+
+        place_devices([self.placement(b, self.rack, 5)])
+        self.assertPosition(b, self.rack, 5)
+
+    def test_overlap_within_placements(self):
+        a = self.create_device('a', self.full_depth)
+        b = self.create_device('b', self.full_depth)
+        c = self.create_device('c', self.full_depth)
+
+        with self.assertRaises(ValidationError) as cm:
+            place_devices([
+                self.placement(a, self.rack, 1),
+                self.placement(b, self.rack, 2),
+                self.placement(c, self.rack, 3),
+            ])
+        self.assertEqual(set(cm.exception.message_dict), {1})
+        # Nothing is saved when one placement fails
+        self.assertPosition(a, None, None)
+        self.assertPosition(c, None, None)
+
+    def test_swap(self):
+        a = self.create_device('a', self.full_depth, self.rack, 1)
+        b = self.create_device('b', self.full_depth, self.rack, 3)
+
+        place_devices([self.placement(a, self.rack, 3), self.placement(b, self.rack, 1)])
+        self.assertPosition(a, self.rack, 3)
+        self.assertPosition(b, self.rack, 1)
+
+    def test_half_depth_devices_share_units(self):
+        front = self.create_device('front', self.half_depth)
+        rear = self.create_device('rear', self.half_depth)
+        full = self.create_device('full', self.full_depth)
+
+        place_devices([
+            self.placement(front, self.rack, 1, Device.FRONT),
+            self.placement(rear, self.rack, 1, Device.REAR),
+        ])
+        with self.assertRaises(ValidationError):
+            place_devices([self.placement(full, self.rack, 1)])
+
+    def test_invalid_placements(self):
+        a = self.create_device('a', self.full_depth)
+        b = self.create_device('b', self.full_depth)
+
+        with self.assertRaises(ValidationError) as cm:
+            place_devices([
+                self.placement(a, self.rack, 10),
+                self.placement(b, self.rack, 1),
+                self.placement(b, self.other_rack, 1),
+                {'device': 0, 'rack': self.rack.pk, 'position': 5, 'face_position': None},
+            ])
+        self.assertEqual(set(cm.exception.message_dict), {0, 2, 3})
+        self.assertIn('U10-U11 does not fit in rack R1 (U1-U10).', cm.exception.message_dict[0])
+
+    def test_move_updates_free_space(self):
+        a = self.create_device('a', self.full_depth, self.rack, 1)
+
+        place_devices([self.placement(a, self.other_rack, 9)])
+        self.assertPosition(a, self.other_rack, 9)
+        self.assertEqual(
+            list(self.rack.free_space.filter(face=RackFreeSpace.FULL_DEPTH).values_list('position', 'size')),
+            [(1, 10)]
+        )
+        self.assertEqual(
+            list(self.other_rack.free_space.filter(face=RackFreeSpace.FULL_DEPTH).values_list('position', 'size')),
+            [(1, 8)]
+        )
+
+
+class RackElevationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Region', slug='region')
+        cls.location = Location.objects.create(name='Location', slug='location', region=region)
+        cls.rack = Rack.objects.create(name='R1', location=cls.location, u_height=6)
+        vendor = Vendor.objects.create(name='Vendor', slug='vendor')
+        cls.full_depth = VendorModel.objects.create(vendor=vendor, model='2U', slug='2u', u_height=2, depth=True)
+        cls.half_depth = VendorModel.objects.create(vendor=vendor, model='1U', slug='1u', u_height=1, depth=False)
+        cls.role = DeviceRole.objects.create(name='Server', slug='server', color='00ff00')
+
+    def setUp(self):
+        # Elevations cached by other tests refer to rolled back devices
+        elevation_cache.clear()
+
+    def create_device(self, name, model, position, face=Device.FRONT):
+        return Device.objects.create(
+            name=name, device_model=model, device_role=self.role, location=self.location, rack=self.rack,
+            position=position, face_position=face
+        )
+
+    def occupancy(self, elevation):
+        """
+        Return the names of the devices on each unit of both faces, None for a free unit.
+        """
+        def names(face):
+            return [elevation.devices[index - 1].name if index else None for index in face]
+        return names(elevation.front), names(elevation.rear)
+
+    def test_occupancy(self):
+        self.create_device('full', self.full_depth, 1, Device.REAR)
+        self.create_device('front', self.half_depth, 3, Device.FRONT)
+        self.create_device('rear', self.half_depth, 4, Device.REAR)
+
+        elevation = get_rack_elevation(self.rack)
+        self.assertEqual(self.occupancy(elevation), (
+            ['full', 'full', 'front', None, None, None],
+            ['full', 'full', None, 'rear', None, None],
+        ))
+        self.assertEqual(elevation.conflicts, [])
+        self.assertEqual(elevation.free_units, 2)
+        self.assertIn('>front</text>', elevation.front_svg)
+        self.assertNotIn('>rear</text>', elevation.front_svg)
+
+    def test_conflicts(self):
+        self.create_device('a', self.full_depth, 2)
+        self.create_device('overlap', self.half_depth, 3, Device.REAR)
+        self.create_device('too-high', self.full_depth, 6)
+
+        elevation = get_rack_elevation(self.rack)
+        self.assertEqual([device.name for device in elevation.conflicts], ['overlap', 'too-high'])
+        self.assertEqual(self.occupancy(elevation), (
+            [None, 'a', 'a', None, None, None],
+            [None, 'a', 'a', None, None, None],
+        ))
+        self.assertEqual(elevation.free_units, 4)
+
+    def test_device_changes(self):
+        a = self.create_device('a', self.full_depth, 1)
+        elevation = get_rack_elevation(self.rack)
+        self.assertIsInstance(elevation, RackElevation)
+        self.assertIs(get_rack_elevation(self.rack), elevation)
+
+        # Moving and adding devices replaces the cached elevation
+        a.position = 5
+        a.save()
+        self.create_device('b', self.half_depth, 1)
+        self.assertEqual(self.occupancy(get_rack_elevation(self.rack)), (
+            ['b', None, None, None, 'a', 'a'],
+            [None, None, None, None, 'a', 'a'],
+        ))
+
+        a.delete()
+        self.assertEqual(get_rack_elevation(self.rack).free_units, 5)
+
+
+class RackFreeSpaceTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name='Region', slug='region')
+        cls.location = Location.objects.create(name='Location', slug='location', region=region)
+        cls.rack = Rack.objects.create(name='R1', location=cls.location, u_height=10)
+        cls.other_rack = Rack.objects.create(name='R2', location=cls.location, u_height=10)
+        vendor = Vendor.objects.create(name='Vendor', slug='vendor')
+        cls.full_depth = VendorModel.objects.create(vendor=vendor, model='2U', slug='2u', u_height=2, depth=True)
+        cls.half_depth = VendorModel.objects.create(vendor=vendor, model='1U', slug='1u', u_height=1, depth=False)
+        cls.role = DeviceRole.objects.create(name='Server', slug='server', color='00ff00')
+
+    def create_device(self, name, model, rack, position, face=Device.FRONT):
+        return Device.objects.create(
+            name=name, device_model=model, device_role=self.role, location=self.location, rack=rack,
+            position=position, face_position=face
+        )
+
+    def free_space(self, rack, face=RackFreeSpace.FULL_DEPTH):
+        return list(rack.free_space.filter(face=face).values_list('position', 'size'))
+
+    def test_free_intervals(self):
+        self.assertEqual(free_intervals([0, 0, 1, 1, 0, 2, 0, 0]), [(1, 2), (5, 1), (7, 2)])
+        self.assertEqual(free_intervals([1, 0, 0]), [(2, 2)])
+        self.assertEqual(free_intervals([1, 1]), [])
+        self.assertEqual(free_intervals([]), [])
+
+    def test_faces(self):
+        self.create_device('front', self.half_depth, self.rack, 3, Device.FRONT)
+        self.create_device('rear', self.half_depth, self.rack, 6, Device.REAR)
+        self.create_device('full', self.full_depth, self.rack, 9)
+
+        self.assertEqual(self.free_space(self.rack, Device.FRONT), [(1, 2), (4, 5)])
+        self.assertEqual(self.free_space(self.rack, Device.REAR), [(1, 5), (7, 2)])
+        self.assertEqual(self.free_space(self.rack), [(1, 2), (4, 2), (7, 2)])
+
+    def test_device_move_and_delete(self):
+        a = self.create_device('a', self.full_depth, self.rack, 1)
+        b = self.create_device('b', self.full_depth, self.rack, 5)
+        self.assertEqual(self.free_space(self.rack), [(3, 2), (7, 4)])
+
+        # Within the rack
+        a.position = 9
+        a.save()
+        self.assertEqual(self.free_space(self.rack), [(1, 4), (7, 2)])
+
+        # To another rack, both racks are updated
+        b.rack = self.other_rack
+        b.position = 1
+        b.save()
+        self.assertEqual(self.free_space(self.rack), [(1, 8)])
+        self.assertEqual(self.free_space(self.other_rack), [(3, 8)])
+
+        # Out of any rack
+        b.rack = None
+        b.position = None
+        b.save()
+        self.assertEqual(self.free_space(self.other_rack), [(1, 10)])
+
+        a.delete()
+        self.assertEqual(self.free_space(self.rack), [(1, 10)])
+
+    def test_rebuild(self):
+        self.create_device('a', self.full_depth, self.rack, 4)
+        RackFreeSpace.objects.all().delete()
+
+        rebuild_free_space()
+        self.assertEqual(self.free_space(self.rack), [(1, 3), (6, 5)])
+        self.assertEqual(self.free_space(self.other_rack), [(1, 10)])
+
+
+class RegionStatsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.europe = Region.objects.create(name='Europe', slug='europe')
+        cls.germany = Region.objects.create(name='Germany', slug='germany', parent=cls.europe)
+        cls.asia = Region.objects.create(name='Asia', slug='asia')
+        cls.berlin = Location.objects.create(name='Berlin', slug='berlin', region=cls.germany)
+        cls.paris = Location.objects.create(name='Paris', slug='paris', region=cls.europe)
+        cls.rack = Rack.objects.create(name='R1', location=cls.berlin, u_height=10)
+        vendor = Vendor.objects.create(name='Vendor', slug='vendor')
+        cls.model = VendorModel.objects.create(vendor=vendor, model='2U', slug='2u', u_height=2)
+        cls.role = DeviceRole.objects.create(name='Server', slug='server', color='00ff00')
+        Device.objects.create(
+            name='a', device_model=cls.model, device_role=cls.role, location=cls.berlin, rack=cls.rack, position=1,
+            face_position=Device.FRONT
+        )
+
+    def setUp(self):
+        # Rolled back changes of other tests send no signals
+        tree_version_cache.clear()
+
+    def stats(self, region):
+        return get_region_stats().get(region.pk, EMPTY_REGION_STATS)
+
+    def test_rollup(self):
+        self.assertEqual(self.stats(self.germany), RegionStats(1, 1, 1, 0, 10, 2))
+        self.assertEqual(self.stats(self.europe), RegionStats(2, 1, 1, 0, 10, 2))
+        self.assertEqual(self.stats(self.europe).utilization, 20.0)
+        self.assertEqual(self.stats(self.asia), EMPTY_REGION_STATS)
+
+    def test_tree_changes(self):
+        self.stats(self.europe)
+
+        # Moving a subtree moves its totals to the new ancestors
+        germany = Region.objects.get(pk=self.germany.pk)
+        germany.parent = self.asia
+        germany.save()
+        self.assertEqual(self.stats(self.europe), RegionStats(1, 0, 0, 0, 0, 0))
+        self.assertEqual(self.stats(self.asia), RegionStats(1, 1, 1, 0, 10, 2))
+
+        Device.objects.create(
+            name='b', device_model=self.model, device_role=self.role, location=self.berlin, rack=self.rack,
+            position=5, face_position=Device.FRONT
+        )
+        self.assertEqual(self.stats(self.asia), RegionStats(1, 1, 2, 0, 10, 4))
+
+        Device.objects.get(name='a').delete()
+        rack = Rack.objects.get(pk=self.rack.pk)
+        rack.u_height = 20
+        rack.save()
+        self.assertEqual(self.stats(self.asia), RegionStats(1, 1, 1, 0, 20, 2))
+
+    def test_changes_from_other_workers(self):
+        self.stats(self.europe)
+
+        # No signal is sent, as for a change made by another worker: only the database tells the stats changed
+        Location.objects.filter(pk=self.paris.pk).update(region=self.asia, last_updated=timezone.now())
+        tree_version_cache.clear()
+        self.assertEqual(self.stats(self.europe), RegionStats(1, 1, 1, 0, 10, 2))
+        self.assertEqual(self.stats(self.asia), RegionStats(1, 0, 0, 0, 0, 0))
+
+        Region.objects.filter(pk=self.germany.pk).update(parent=self.asia)
+        Region.objects.rebuild()
+        tree_version_cache.clear()
+        self.assertEqual(self.stats(self.asia), RegionStats(2, 1, 1, 0, 10, 2))
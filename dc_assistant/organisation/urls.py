@@ -8,15 +8,18 @@ app_name = 'organisation'
 urlpatterns = [
     path('regions/', views.RegionListView.as_view(), name='region_list'),
     path('regions/add', views.RegionAdd.as_view(), name='region_add'),
+    path('regions/<int:pk>/', views.RegionView.as_view(), name='region'),
     path('regions/<int:pk>/edit', views.RegionEdit.as_view(), name='region_edit'),
 
     path('locations/', views.LocationListView.as_view(), name='location_list'),
     path('locations/add', views.LocationAdd.as_view(), name='location_add'),
     path('locations/<slug:slug>/', views.LocationView.as_view(), name='location'),
     path('locations/<slug:slug>/edit', views.LocationEdit.as_view(), name='location_edit'),
+    path('locations/<slug:slug>/elevations/', views.LocationElevationsView.as_view(), name='location_elevations'),
 
     path('racks/', views.RackListView.as_view(), name='rack_list'),
     path('racks/add', views.RackAdd.as_view(), name='rack_add'),
+    path('racks/free-space/', views.RackFreeSpaceListView.as_view(), name='rack_free_space'),
     path('racks/<int:pk>/', views.RackView.as_view(), name='rack'),
     path('racks/<int:pk>/edit/', views.RackEdit.as_view(), name='rack_edit'),
 
@@ -5,10 +5,11 @@ from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMix
 from django.urls import reverse, reverse_lazy
 from django.views.generic import View, CreateView, UpdateView
 from .forms import RegionAddForm, LocationAddForm, RackAddForm, VendorAddForm, VendorModelAddForm, RoleModelAddForm, DeviceAddForm, PlatformAddForm
-from .models import Region, Location, Rack, Vendor, VendorModel, Device, DeviceRole, Platform
+from .models import Region, Location, Rack, RackFreeSpace, Vendor, VendorModel, Device, DeviceRole, Platform
+from .elevation import get_rack_elevation, get_rack_elevations
 from extend.views import ListObjectsView
 from extend import filters
-from .tables import RegionTable, LocationTable, RackTable, VendorTable, VendorModelTable, DeviceRoleTable, DeviceTable, PlatformTable
+from .tables import RegionTable, LocationTable, RackTable, RackFreeSpaceTable, VendorTable, VendorModelTable, DeviceRoleTable, DeviceTable, PlatformTable
 
 
 class RegionListView(PermissionRequiredMixin, ListObjectsView):
@@ -34,6 +35,22 @@ class RegionEdit(PermissionRequiredMixin, UpdateView):
     template_name = 'organisation/region_add.html'
 
 
+class RegionView(PermissionRequiredMixin, View):
+    permission_required = 'organisation.view_region'
+
+    def get(self, request, pk):
+        region = get_object_or_404(Region, pk=pk)
+        children = region.get_children()
+        locations = Location.objects.filter(region=region)
+
+        return render(request, 'organisation/region.html', {
+            'region': region,
+            'stats': region.stats,
+            'children': children,
+            'locations': locations,
+        })
+
+
 class LocationListView(PermissionRequiredMixin, ListObjectsView):
     permission_required = 'organisation.view_location'
     queryset = Location.objects.prefetch_related('region')
@@ -74,6 +91,20 @@ class LocationView(PermissionRequiredMixin, View):
         })
 
 
+class LocationElevationsView(PermissionRequiredMixin, View):
+    permission_required = 'organisation.view_rack'
+
+    def get(self, request, slug):
+        location = get_object_or_404(Location, slug=slug)
+        racks = list(Rack.objects.filter(location=location))
+        elevations = get_rack_elevations(racks)
+
+        return render(request, 'organisation/location_elevations.html', {
+            'location': location,
+            'elevations': [elevations[rack.pk] for rack in racks],
+        })
+
+
 class RackListView(PermissionRequiredMixin, ListObjectsView):
     permission_required = 'organisation.view_rack'
     queryset = Rack.objects.prefetch_related('location').annotate(device_count=Count('devices'))
@@ -82,6 +113,16 @@ class RackListView(PermissionRequiredMixin, ListObjectsView):
     template_name = 'organisation/racks_tab.html'
 
 
+class RackFreeSpaceListView(PermissionRequiredMixin, ListObjectsView):
+    permission_required = 'organisation.view_rack'
+    queryset = RackFreeSpace.objects.select_related('rack__location').order_by(
+        'rack__location__name', 'rack__name', 'rack_id', 'face', 'position'
+    )
+    filterset = filters.RackFreeSpaceFilterSet
+    table = RackFreeSpaceTable
+    template_name = 'organisation/rack_free_space.html'
+
+
 class RackAdd(PermissionRequiredMixin, CreateView):
     permission_required = 'organisation.add_rack'
     form_class = RackAddForm
@@ -107,9 +148,11 @@ class RackView(View):
             rack=rack,
             position__isnull=True,
         ).prefetch_related('device_model__vendor')
+        elevation = get_rack_elevation(rack)
         return render(request, 'organisation/rack.html', {
             'rack': rack,
             'nonracked_devices': nonracked_devices,
+            'elevation': elevation,
         })
 
 
@@ -230,7 +273,7 @@ class DeviceView(View):
         device = get_object_or_404(Device.objects.prefetch_related(
             'location__region', 'device_role', 'platform'
         ), pk=pk)
-        secrets = device.secrets.all()
+        secrets = device.secrets.select_related('role').defer('ciphertext', 'hash')
 
         return render(request, 'organisation/device.html', {
             'device': device,
@@ -0,0 +1,64 @@
+// Client-side decryption of secrets with WebCrypto. The server sends the AES-GCM ciphertext of each secret and the
+// master key wrapped with the session key (XOR). The session key is read from the session_key cookie.
+var secret_webcrypto = (function() {
+    var CIPHER_VERSION_GCM = 2;
+
+    function available() {
+        return !!(window.crypto && window.crypto.subtle && window.TextDecoder);
+    }
+
+    function b64decode(value) {
+        var raw = atob(value);
+        var bytes = new Uint8Array(raw.length);
+        for (var i = 0; i < raw.length; i++) {
+            bytes[i] = raw.charCodeAt(i);
+        }
+        return bytes;
+    }
+
+    function get_session_key() {
+        var match = document.cookie.match(/(?:^|;\s*)session_key=([^;]*)/);
+        if (!match) {
+            return null;
+        }
+        // Django quotes cookie values which contain '/' or '='
+        return b64decode(decodeURIComponent(match[1]).replace(/^"|"$/g, ''));
+    }
+
+    // Return a promise of the master key as a non-extractable CryptoKey
+    function unwrap_master_key(wrapped_key) {
+        var session_key = get_session_key();
+        var master_key = b64decode(wrapped_key);
+        if (session_key === null || session_key.length != master_key.length) {
+            return Promise.reject(new Error("No valid session key"));
+        }
+        for (var i = 0; i < master_key.length; i++) {
+            master_key[i] ^= session_key[i];
+        }
+        return window.crypto.subtle.importKey('raw', master_key, {name: 'AES-GCM'}, false, ['decrypt']);
+    }
+
+    // Return a promise of the plaintext of a secret. See Secret.encrypt() for the ciphertext layout.
+    function decrypt(master_key, ciphertext) {
+        var data = b64decode(ciphertext);
+        if (data[0] != CIPHER_VERSION_GCM) {
+            return Promise.reject(new Error("Unsupported ciphertext version"));
+        }
+        var nonce = data.subarray(1, 13);
+        // WebCrypto expects the tag after the ciphertext
+        var sealed = new Uint8Array(data.length - 13);
+        sealed.set(data.subarray(29));
+        sealed.set(data.subarray(13, 29), data.length - 29);
+        return window.crypto.subtle.decrypt({name: 'AES-GCM', iv: nonce}, master_key, sealed).then(function(padded) {
+            padded = new Uint8Array(padded);
+            var length = (padded[0] << 8) + padded[1];
+            return new TextDecoder('utf-8').decode(padded.subarray(2, length + 2));
+        });
+    }
+
+    return {
+        available: available,
+        unwrap_master_key: unwrap_master_key,
+        decrypt: decrypt
+    };
+})();
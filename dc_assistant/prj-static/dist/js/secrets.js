@@ -5,7 +5,24 @@ $(document).ready(function() {
     // Unlocking a secret
     $('button.unlock-secret').click(function(event) {
         var secret_id = $(this).attr('secret-id');
-        unlock_secret(secret_id);
+        if (client_decryption()) {
+            unlock_secrets_client([parseInt(secret_id)]);
+        } else {
+            unlock_secret(secret_id);
+        }
+        event.preventDefault();
+    });
+
+    // Unlocking all secrets on the page with one request
+    $('button.unlock-all-secrets').click(function(event) {
+        var secret_ids = $('button.unlock-secret').map(function() {
+            return parseInt($(this).attr('secret-id'));
+        }).get();
+        if (client_decryption()) {
+            unlock_secrets_client(secret_ids);
+        } else {
+            unlock_secrets(secret_ids);
+        }
         event.preventDefault();
     });
 
@@ -65,6 +82,111 @@ $(document).ready(function() {
         });
     }
 
+    // Retrieve many secrets via the batch API
+    function unlock_secrets(secret_ids) {
+        if (!secret_ids.length) {
+            return;
+        }
+        var csrf_token = $('input[name=csrfmiddlewaretoken]').val();
+        $.ajax({
+            url: dc_assistant_api_path + 'secrets/secrets/decrypt-batch/',
+            type: 'POST',
+            data: JSON.stringify(secret_ids),
+            contentType: 'application/json',
+            dataType: 'json',
+            beforeSend: function(xhr, settings) {
+                xhr.setRequestHeader("X-CSRFToken", csrf_token);
+            },
+            success: function (response, status) {
+                $.each(response, function(index, secret) {
+                    if (secret.plaintext) {
+                        $('#secret_' + secret.id).text(secret.plaintext);
+                        $('button.unlock-secret[secret-id=' + secret.id + ']').hide();
+                        $('button.copy-secret[secret-id=' + secret.id + ']').show();
+                        $('button.lock-secret[secret-id=' + secret.id + ']').show();
+                    } else {
+                        console.log("Secret " + secret.request + " was not decrypted: " + secret.error);
+                    }
+                });
+            },
+            error: function (xhr, ajaxOptions, thrownError) {
+                console.log("Error: " + xhr.responseText);
+                if (xhr.status == 400) {
+                    console.log("Secrets were not decrypted. Prompt user for private key.");
+                    $('#privkey_modal').modal('show');
+                } else if (xhr.status == 403) {
+                    alert("Permission denied");
+                } else {
+                    alert(xhr.responseText);
+                }
+            }
+        });
+    }
+
+    // Decrypt secrets in the browser if enabled (see secrets-webcrypto.js)
+    function client_decryption() {
+        return typeof secret_client_decryption !== 'undefined' && secret_client_decryption &&
+            typeof secret_webcrypto !== 'undefined' && secret_webcrypto.available();
+    }
+
+    function show_secret(secret_id, plaintext) {
+        $('#secret_' + secret_id).text(plaintext);
+        $('button.unlock-secret[secret-id=' + secret_id + ']').hide();
+        $('button.copy-secret[secret-id=' + secret_id + ']').show();
+        $('button.lock-secret[secret-id=' + secret_id + ']').show();
+    }
+
+    // Retrieve encrypted secrets via the API and decrypt them with WebCrypto. Secrets which can't be decrypted in
+    // the browser are unlocked by the server.
+    function unlock_secrets_client(secret_ids) {
+        if (!secret_ids.length) {
+            return;
+        }
+        var csrf_token = $('input[name=csrfmiddlewaretoken]').val();
+        $.ajax({
+            url: dc_assistant_api_path + 'secrets/secrets/encrypted-batch/',
+            type: 'POST',
+            data: JSON.stringify(secret_ids),
+            contentType: 'application/json',
+            dataType: 'json',
+            beforeSend: function(xhr, settings) {
+                xhr.setRequestHeader("X-CSRFToken", csrf_token);
+            },
+            success: function (response, status) {
+                secret_webcrypto.unwrap_master_key(response.wrapped_key).then(function(master_key) {
+                    $.each(response.secrets, function(index, secret) {
+                        if (secret.plaintext) {
+                            show_secret(secret.id, secret.plaintext);
+                        } else if (secret.ciphertext) {
+                            secret_webcrypto.decrypt(master_key, secret.ciphertext).then(function(plaintext) {
+                                show_secret(secret.id, plaintext);
+                            }).catch(function(error) {
+                                console.log("Secret " + secret.id + " was not decrypted by the browser: " + error);
+                                unlock_secret(secret.id);
+                            });
+                        } else {
+                            console.log("Secret " + secret.request + " was not decrypted: " + secret.error);
+                        }
+                    });
+                }).catch(function(error) {
+                    console.log("Master key was not unwrapped by the browser: " + error);
+                    unlock_secrets(secret_ids);
+                });
+            },
+            error: function (xhr, ajaxOptions, thrownError) {
+                console.log("Error: " + xhr.responseText);
+                if (xhr.status == 400) {
+                    console.log("Secrets were not decrypted. Prompt user for private key.");
+                    $('#privkey_modal').modal('show');
+                } else if (xhr.status == 403) {
+                    alert("Permission denied");
+                } else {
+                    alert(xhr.responseText);
+                }
+            }
+        });
+    }
+
     // Remove secret data from the DOM
     function lock_secret(secret_id) {
         var secret_div = $('#secret_' + secret_id);
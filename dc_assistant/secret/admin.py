@@ -1,11 +1,26 @@
 from django.contrib import admin, messages
 from django.shortcuts import redirect, render
-from .models import UserKey, Secret, SecretRole
+from .models import UserKey, Secret, SecretRole, SecretAttachment, SecretAccessLog
 from .forms import ActivateUserKeyForm
 from dc_assistant.admin import admin_site
 
 admin_site.register(SecretRole)
 admin_site.register(Secret)
+admin_site.register(SecretAttachment)
+
+
+@admin.register(SecretAccessLog, site=admin_site)
+class SecretAccessLogAdmin(admin.ModelAdmin):
+    list_display = ['time', 'username', 'access', 'secret_name', 'remote_addr']
+    list_filter = ['access']
+    search_fields = ['username', 'secret_name']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 
 @admin.register(UserKey, site=admin_site)
 class UserKeyAdmin(admin.ModelAdmin):
@@ -33,10 +48,8 @@ class UserKeyAdmin(admin.ModelAdmin):
         """
         Enable activation of UserKeys
         """
-        print('request.user', request.user)
         try:
             my_userkey = UserKey.objects.get(user=request.user)
-            print('my_userkey:', my_userkey)
         except UserKey.DoesNotExist:
             messages.error(request, "You do not have an active User Key.")
             return redirect('/admin/secret/userkey')
@@ -45,11 +58,13 @@ class UserKeyAdmin(admin.ModelAdmin):
             form = ActivateUserKeyForm(request.POST)
             if form.is_valid():
                 master_key = my_userkey.get_master_key(form.cleaned_data['secret_key'])
-                print('if form valid - master_key:', master_key)
                 if master_key is not None:
-                    for uk in form.cleaned_data['_selected_action']:
-                        print('each uk:', uk)
-                        uk.activate(master_key)
+                    activated, invalid = form.cleaned_data['_selected_action'].activate(master_key)
+                    messages.success(request, "Activated {} user keys.".format(len(activated)))
+                    if invalid:
+                        messages.error(request, "Invalid public key of: {}".format(
+                            ', '.join(str(uk) for uk in invalid)
+                        ))
                     return redirect('/admin/secret/userkey')
                 else:
                     messages.error(
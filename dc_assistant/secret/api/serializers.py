@@ -1,18 +1,26 @@
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
-from secret.models import Secret
+from secret.models import MasterKeyRotation, Secret, SecretAccessLog
 
 
 class SecretSerializer(ModelSerializer):
     plaintext = serializers.CharField()
+    error = serializers.CharField(source='decrypt_error', read_only=True)
 
     class Meta:
         model = Secret
         fields = [
-            'id', 'name', 'plaintext', 'hash',
+            'id', 'device', 'role', 'name', 'plaintext', 'hash', 'error',
         ]
         validators = []
 
+    def get_fields(self):
+        fields = super().get_fields()
+        # Fields the view did not load from the database
+        for name in self.context.get('deferred_fields', ()):
+            fields.pop(name, None)
+        return fields
+
     def validate(self, data):
 
         # Encrypt plaintext using master key from view
@@ -26,3 +34,23 @@ class SecretSerializer(ModelSerializer):
         super().validate(data)
 
         return data
+
+
+class MasterKeyRotationSerializer(ModelSerializer):
+    userkey = serializers.StringRelatedField()
+    failed_secrets = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+
+    class Meta:
+        model = MasterKeyRotation
+        fields = [
+            'id', 'userkey', 'last_secret_id', 'processed', 'failed_secrets', 'started', 'last_updated', 'completed',
+        ]
+
+
+class SecretAccessLogSerializer(ModelSerializer):
+
+    class Meta:
+        model = SecretAccessLog
+        fields = [
+            'id', 'time', 'secret', 'secret_name', 'user', 'username', 'access', 'remote_addr',
+        ]
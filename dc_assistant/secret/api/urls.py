@@ -1,13 +1,18 @@
-from rest_framework import routers
-from .views import SecretsRootView, GenerateRSAKeyPairViewSet, GetSessionKeyViewSet, SecretViewSet
+from extend.routers import BulkRouter
+from .views import SecretsRootView, GenerateRSAKeyPairViewSet, GetSessionKeyViewSet, MasterKeyRotationViewSet, \
+    SecretAccessLogViewSet, SecretByKeyViewSet, SecretViewSet, VaultBackupViewSet
 
 
-router = routers.DefaultRouter()
+router = BulkRouter()
 router.APIRootView = SecretsRootView
 
 router.register('get-session-key', GetSessionKeyViewSet, basename='get-session-key')
 router.register('generate-rsa-key-pair', GenerateRSAKeyPairViewSet, basename='generate-rsa-key-pair')
+router.register('rotate-master-key', MasterKeyRotationViewSet, basename='rotate-master-key')
+router.register('backup', VaultBackupViewSet, basename='backup')
+router.register('access-log', SecretAccessLogViewSet)
 router.register('secrets', SecretViewSet)
+router.register(r'by-key/(?P<device>[^/]+)/(?P<role>[^/]+)', SecretByKeyViewSet, basename='by-key')
 
 app_name = 'secrets-api'
 urlpatterns = router.urls
\ No newline at end of file
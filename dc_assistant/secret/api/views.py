@@ -1,25 +1,62 @@
 import base64
 from rest_framework import routers
-from rest_framework.viewsets import ViewSet, ModelViewSet
-from rest_framework.permissions import IsAuthenticated
-from rest_framework.exceptions import ValidationError
-from Crypto.PublicKey import RSA
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.viewsets import ViewSet, ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.response import Response
-from django.http import HttpResponseBadRequest
-from secret.models import UserKey, SessionKey, Secret
-from extend.filters import SecretFilterSet
-from .serializers import SecretSerializer
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from Crypto.Util import strxor
+from secret.models import UserKey, SessionKey, Secret, InvalidKey, MasterKeyRotation, SecretAccessLog, \
+    get_member_role_ids, CIPHER_VERSION_GCM
+from secret.audit import log_secret_access
+from django_filters.rest_framework import DjangoFilterBackend
+from extend.filters import SecretAccessLogFilterSet, SecretFilterSet
+from organisation.regions import bump_tree_version
+from secret.backup import ArchiveError, iter_backup, restore_backup
+from secret.keypool import get_key_pair_pool
+from secret.rotation import MasterKeyRotator, RotationError, RotationRunning, rotation_running, start_rotation
+from secret.sessionstore import get_master_key
+from secret.utils import decrypt_secrets
+from .serializers import MasterKeyRotationSerializer, SecretAccessLogSerializer, SecretSerializer
 
 ERR_USERKEY_MISSING = "No UserKey found for the current user."
 ERR_USERKEY_INACTIVE = "UserKey has not been activated for decryption."
 ERR_PRIVKEY_MISSING = "Private key was not provided."
 ERR_PRIVKEY_INVALID = "Invalid private key."
-
-class InvalidKey(Exception):
+ERR_SESSION_KEY_TTL = "ttl must be a positive number of seconds."
+ERR_SESSION_KEY_NAME = "name must be a string of at most {} characters.".format(
+    SessionKey._meta.get_field('name').max_length
+)
+ERR_SECRET_NOT_FOUND = "Secret not found."
+ERR_SECRET_PERMISSION = "You do not have permission to decrypt this secret."
+ERR_ROTATION_IN_PROGRESS = "Master key rotation is in progress. Secrets can't be changed until it completes."
+ERR_ROTATION_RUNNING = "Master key rotation is already running."
+ERR_SECRET_EXISTS = "Secret with this device, role and name already exists."
+ERR_CLIENT_DECRYPTION_DISABLED = "Client-side decryption is disabled."
+NOTE_ROTATION_OUTAGE = (
+    "Secrets can't be read until the rotation completes. Session keys are reset then and must be requested again."
+)
+
+MAX_BATCH_SIZE = 1000
+
+
+def get_request_session_key(request):
     """
-    Raised when a provided key is invalid.
+    Return the session key sent in the session_key cookie or the X-Session-Key header, or None.
     """
-    pass
+    if 'session_key' in request.COOKIES:
+        return base64.b64decode(request.COOKIES['session_key'])
+    if 'HTTP_X_SESSION_KEY' in request.META:
+        return base64.b64decode(request.META['HTTP_X_SESSION_KEY'])
+    return None
+
 
 class SecretsRootView(routers.APIRootView):
     """
@@ -42,20 +79,29 @@ class GenerateRSAKeyPairViewSet(ViewSet):
     def list(self, request):
 
         # Determine what size key to generate
-        key_size = request.GET.get('key_size', 2048)
+        try:
+            key_size = int(request.GET.get('key_size', 2048))
+        except ValueError:
+            key_size = 2048
         if key_size not in range(2048, 4097, 256):
             key_size = 2048
 
-        # Export RSA private and public keys in PEM format
-        key = RSA.generate(key_size)
-        private_key = key.exportKey('PEM')
-        public_key = key.publickey().exportKey('PEM')
+        # Take a pre-generated key pair in PEM format
+        private_key, public_key = get_key_pair_pool().get(key_size)
 
         return Response({
             'private_key': private_key,
             'public_key': public_key,
         })
 
+    @action(detail=False, permission_classes=[IsAdminUser])
+    def stats(self, request):
+        """
+        Key pair pool state and exhaustion counters per key size.
+        """
+        return Response(get_key_pair_pool().stats())
+
+
 class GetSessionKeyViewSet(ViewSet):
     """
     Retrieve a temporary session key to use for encrypting and decrypting secrets via the API. The user's private RSA
@@ -71,8 +117,14 @@ class GetSessionKeyViewSet(ViewSet):
             "session_key": "+8t4SI6XikgVmB5+/urhozx9O5qCQANyOk1MNe6taRf="
         }
 
-    This endpoint accepts one optional parameter: `preserve_key`. If True and a session key exists, the existing session
-    key will be returned instead of a new one.
+    A user can hold several session keys at once, so parallel clients don't invalidate each other's key. Optional
+    parameters:
+
+    * `name`: name of the session key (default: empty). Requesting a key with a name already in use replaces that key.
+    * `ttl`: lifetime of the session key in seconds (default: `SESSION_KEY_DEFAULT_TTL`). Expired keys are rejected
+      and deleted in the background.
+    * `preserve_key`: if True and an active session key with the same name exists, the existing session key will be
+      returned instead of a new one.
     """
     permission_classes = [IsAuthenticated]
 
@@ -96,23 +148,38 @@ class GetSessionKeyViewSet(ViewSet):
         if master_key is None:
             return HttpResponseBadRequest(ERR_PRIVKEY_INVALID)
 
-        try:
-            current_session_key = SessionKey.objects.get(userkey__user_id=request.user.pk)
-        except SessionKey.DoesNotExist:
-            current_session_key = None
-
-        if current_session_key and request.GET.get('preserve_key', False):
+        name = request.data.get('name', '')
+        if not isinstance(name, str) or len(name) > SessionKey._meta.get_field('name').max_length:
+            return HttpResponseBadRequest(ERR_SESSION_KEY_NAME)
+        ttl = request.data.get('ttl', settings.SESSION_KEY_DEFAULT_TTL)
+        if ttl is not None:
+            try:
+                ttl = int(ttl)
+            except (TypeError, ValueError):
+                ttl = 0
+            if ttl <= 0:
+                return HttpResponseBadRequest(ERR_SESSION_KEY_TTL)
+
+        with transaction.atomic():
+            # Serialize requests of the same user so concurrent clients can't issue the same name twice
+            user_key = UserKey.objects.select_for_update().get(pk=user_key.pk)
+            current_session_key = user_key.session_keys.active().filter(name=name).first()
+
+            if current_session_key and request.GET.get('preserve_key', False):
+
+                # Retrieve the existing session key
+                sk = current_session_key
+                key = current_session_key.get_session_key(master_key)
 
-            # Retrieve the existing session key
-            key = current_session_key.get_session_key(master_key)
-
-        else:
+            else:
 
-            # Create a new SessionKey
-            SessionKey.objects.filter(userkey__user=request.user).delete()
-            sk = SessionKey(userkey=user_key)
-            sk.save(master_key=master_key)
-            key = sk.key
+                # Create a new SessionKey, replacing the one with the same name
+                user_key.session_keys.filter(name=name).delete()
+                sk = SessionKey(userkey=user_key, name=name)
+                if ttl is not None:
+                    sk.expires = timezone.now() + timedelta(seconds=ttl)
+                sk.save(master_key=master_key)
+                key = sk.key
 
         # Encode the key using base64. (b64decode() returns a bytestring under Python 3.)
         encoded_key = base64.b64encode(key).decode()
@@ -120,6 +187,8 @@ class GetSessionKeyViewSet(ViewSet):
         # Craft the response
         response = Response({
             'session_key': encoded_key,
+            'name': sk.name,
+            'expires': sk.expires,
         })
 
         # If token authentication is not in use, assign the session key as a cookie
@@ -129,20 +198,192 @@ class GetSessionKeyViewSet(ViewSet):
         return response
 
 
+class MasterKeyRotationViewSet(ViewSet):
+    """
+    Re-encrypt all secrets with a new master key. The rotation is started (or an interrupted one resumed) by POSTing
+    your private key with the name `private_key`, and runs in the background:
+
+        curl -v -X POST -H "Authorization: Token <token>" -H "Accept: application/json; indent=4" \\
+        --data-urlencode "private_key@<filename>" https://dcassistant/api/secrets/rotate-master-key/
+
+    GET returns the progress of the latest rotation. All session keys are reset when the rotation completes.
+    Secrets which can't be decrypted with the old master key are skipped and listed in `failed_secrets`.
+
+    Secrets can't be read while the rotation runs: session keys still wrap the old master key, so every secret
+    which is already re-encrypted fails to decrypt until the rotation completes and users request new session keys.
+    """
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        rotation = MasterKeyRotation.objects.first()
+        if rotation is None:
+            return Response({})
+        return Response(dict(
+            MasterKeyRotationSerializer(rotation).data,
+            remaining=Secret.objects.filter(pk__gt=rotation.last_secret_id).count() if not rotation.completed else 0,
+            running=rotation_running(),
+        ))
+
+    def create(self, request):
+
+        # Read private key
+        private_key = request.POST.get('private_key', None)
+        if private_key is None:
+            return HttpResponseBadRequest(ERR_PRIVKEY_MISSING)
+
+        # Validate user key
+        try:
+            user_key = UserKey.objects.get(user=request.user)
+        except UserKey.DoesNotExist:
+            return HttpResponseBadRequest(ERR_USERKEY_MISSING)
+        if not user_key.is_active():
+            return HttpResponseBadRequest(ERR_USERKEY_INACTIVE)
+
+        # The rotation is claimed in the database, so it can't run twice even if POSTed to several workers
+        try:
+            rotator = MasterKeyRotator(user_key, private_key)
+        except RotationRunning:
+            return HttpResponseBadRequest(ERR_ROTATION_RUNNING)
+        except (InvalidKey, RotationError) as e:
+            return HttpResponseBadRequest(str(e))
+        start_rotation(rotator)
+
+        return Response(dict(
+            MasterKeyRotationSerializer(rotator.rotation).data,
+            note=NOTE_ROTATION_OUTAGE,
+        ), status=202)
+
+
+class VaultBackupViewSet(ViewSet):
+    """
+    GET streams an archive of all secrets. Secrets stay encrypted with the master key. POST restores secrets from an
+    archive uploaded with the name `archive`:
+
+        curl -v -X POST -H "Authorization: Token <token>" -H "X-Session-Key: <session key>" \\
+        -F "archive=@<filename>" https://dcassistant/api/secrets/backup/
+
+    Both need a session key: the archive records the fingerprint of the master key, and only archives written with
+    the current master key are restored.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get_master_key(self, request):
+        session_key = get_request_session_key(request)
+        if session_key is None:
+            raise ValidationError("A session key must exist to back up or restore secrets.")
+        try:
+            return get_master_key(request.user, session_key)
+        except InvalidKey:
+            raise ValidationError("Invalid or expired session key.")
+
+    def list(self, request):
+        master_key = self.get_master_key(request)
+        response = StreamingHttpResponse(iter_backup(master_key), content_type='application/octet-stream')
+        response['Content-Disposition'] = 'attachment; filename="secrets-{}.vault"'.format(
+            timezone.now().strftime('%Y%m%d-%H%M%S')
+        )
+        return response
+
+    def create(self, request):
+        archive = request.FILES.get('archive', None)
+        if archive is None:
+            return HttpResponseBadRequest("Archive was not provided.")
+        if MasterKeyRotation.objects.in_progress().exists():
+            return HttpResponseBadRequest(ERR_ROTATION_IN_PROGRESS)
+        master_key = self.get_master_key(request)
+        try:
+            restored, skipped = restore_backup(archive, master_key)
+        except ArchiveError as e:
+            return HttpResponseBadRequest(str(e))
+
+        return Response({
+            'restored': restored,
+            'skipped': skipped,
+        })
+
+
+class SecretAccessLogViewSet(ReadOnlyModelViewSet):
+    """
+    Audit log of secret reads, newest first. Filter by `secret_id`, `user_id`, `user` (username), `access` and a time
+    range with `since`/`until` (ISO 8601). Records are written in batches, so the latest reads show up after a few
+    seconds.
+    """
+    permission_classes = [IsAdminUser]
+    queryset = SecretAccessLog.objects.all()
+    serializer_class = SecretAccessLogSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = SecretAccessLogFilterSet
+
+
+class SecretByKeyViewSet(ViewSet):
+    """
+    Fetch the plaintext of one secret by device name, role slug and secret name. This is the fastest way to read a
+    single secret: the secret is found with one query on its unique key and nothing else is returned:
+
+        curl -H "Authorization: Token <token>" -H "X-Session-Key: <session key>" \\
+        https://dcassistant/api/secrets/by-key/<device>/<role>/<name>/
+
+        {
+            "plaintext": "..."
+        }
+
+    A secret without a name is fetched with `by-key/<device>/<role>/`.
+    """
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'name'
+    lookup_value_regex = '[^/]+'
+
+    def get_plaintext(self, request, device, role, name):
+
+        session_key = get_request_session_key(request)
+        if session_key is None:
+            raise ValidationError("A session key must exist to decrypt secrets.")
+        try:
+            master_key = get_master_key(request.user, session_key)
+        except InvalidKey:
+            raise ValidationError("Invalid or expired session key.")
+
+        try:
+            secret = Secret.objects.only('role_id', 'name', 'ciphertext', 'hash').get(
+                device__name=device, role__slug=role, name=name
+            )
+        except Secret.DoesNotExist:
+            raise NotFound(ERR_SECRET_NOT_FOUND)
+        if not secret.decryptable_by(request.user):
+            raise PermissionDenied(ERR_SECRET_PERMISSION)
+
+        try:
+            secret.decrypt(master_key)
+        except ValueError as e:
+            raise ValidationError(str(e))
+        log_secret_access(request, [secret])
+
+        return Response({'plaintext': secret.plaintext})
+
+    def list(self, request, device, role):
+        return self.get_plaintext(request, device, role, '')
+
+    def retrieve(self, request, device, role, name):
+        return self.get_plaintext(request, device, role, name)
+
+
 class SecretViewSet(ModelViewSet):
-    queryset = Secret.objects.prefetch_related(
-        'role', 'role__users', 'role__groups',
-    )
+    queryset = Secret.objects.all()
     serializer_class = SecretSerializer
+    filter_backends = [DjangoFilterBackend]
     filterset_class = SecretFilterSet
 
     master_key = None
+    session_key = None
+    role_ids = None
+    deferred_fields = ()
 
     def get_serializer_context(self):
 
         # Make the master key available to the serializer for encrypting plaintext values
         context = super().get_serializer_context()
         context['master_key'] = self.master_key
+        context['deferred_fields'] = self.deferred_fields
 
         return context
 
@@ -152,33 +393,153 @@ class SecretViewSet(ModelViewSet):
 
         if request.user.is_authenticated:
 
+            # resolve the roles the user can decrypt once for the whole request
+            self.role_ids = get_member_role_ids(request.user)
+
             # read session key from HTTP cookie or header. The session key must exist in order to encrypt/decrypt.
-            if 'session_key' in request.COOKIES:
-                session_key = base64.b64decode(request.COOKIES['session_key'])
-            elif 'HTTP_X_SESSION_KEY' in request.META:
-                session_key = base64.b64decode(request.META['HTTP_X_SESSION_KEY'])
-            else:
-                session_key = None
+            session_key = get_request_session_key(request)
 
             # can't encrypt secret plaintext without a session key.
-            if self.action in ['create', 'update'] and session_key is None:
+            if self.action in ['create', 'update', 'partial_update', 'bulk_update', 'bulk_partial_update'] and \
+                    session_key is None:
                 raise ValidationError("A session key must exist when creatt or update secrets.")
+            if self.action in ['create', 'update', 'partial_update', 'bulk_update', 'bulk_partial_update'] and \
+                    MasterKeyRotation.objects.in_progress().exists():
+                raise ValidationError(ERR_ROTATION_IN_PROGRESS)
+            if self.action in ['decrypt_batch', 'encrypted_batch'] and session_key is None:
+                raise ValidationError("A session key must exist to decrypt secrets.")
 
             # get master key for encryption/decryption if a session key exist.
             if session_key is not None:
                 try:
-                    sk = SessionKey.objects.get(userkey__user=request.user)
-                    self.master_key = sk.get_master_key(session_key)
-                except (SessionKey.DoesNotExist, InvalidKey):
-                    raise ValidationError("Invalid session key.")
+                    self.master_key = get_master_key(request.user, session_key)
+                    self.session_key = session_key
+                except InvalidKey:
+                    raise ValidationError("Invalid or expired session key.")
+
+    def _validate_batch(self, items):
+        if not isinstance(items, list) or not items:
+            raise ValidationError("Expected a list of secrets.")
+        if len(items) > MAX_BATCH_SIZE:
+            raise ValidationError("No more than {} secrets can be saved at once.".format(MAX_BATCH_SIZE))
+
+    def _unique_errors(self, serializers):
+        """
+        Check device/role/name uniqueness of a batch with one query. Return list of errors in batch order.
+        """
+        keys = []
+        lookup = Q(pk__in=[])
+        for serializer in serializers:
+            data, instance = serializer.validated_data, serializer.instance
+            key = (
+                data['device'].pk if 'device' in data else instance.device_id,
+                data['role'].pk if 'role' in data else instance.role_id,
+                data['name'] if 'name' in data else getattr(instance, 'name', ''),
+            )
+            keys.append(key)
+            lookup |= Q(device_id=key[0], role_id=key[1], name=key[2])
+        updated_pks = [serializer.instance.pk for serializer in serializers if serializer.instance]
+        existing = set(Secret.objects.filter(lookup).exclude(pk__in=updated_pks).values_list(
+            'device_id', 'role_id', 'name'
+        ))
+
+        errors = []
+        seen = set()
+        for key in keys:
+            if key in existing or key in seen:
+                errors.append({'non_field_errors': [ERR_SECRET_EXISTS]})
+            else:
+                errors.append({})
+            seen.add(key)
+        return errors
+
+    def _merge_unique_errors(self, serializers, errors):
+        valid = [serializer for serializer, error in zip(serializers, errors) if not error]
+        unique_errors = iter(self._unique_errors(valid))
+        return [error or next(unique_errors) for error in errors]
+
+    def create(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            return self.bulk_create(request)
+        return super().create(request, *args, **kwargs)
+
+    def bulk_create(self, request):
+        """
+        Create a list of secrets in one transaction. Nothing is saved if any item is invalid, the errors are returned
+        in the same order as the items.
+        """
+        self._validate_batch(request.data)
+        serializers = [self.get_serializer(data=item) for item in request.data]
+        errors = [{} if serializer.is_valid() else serializer.errors for serializer in serializers]
+        errors = self._merge_unique_errors(serializers, errors)
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        secrets = [Secret(**serializer.validated_data) for serializer in serializers]
+        with transaction.atomic():
+            Secret.objects.bulk_create(secrets)
+        # bulk_create() doesn't send post_save
+        bump_tree_version()
+
+        return Response(self.get_serializer(secrets, many=True).data, status=status.HTTP_201_CREATED)
+
+    def bulk_update(self, request, partial=False):
+        """
+        Update a list of secrets identified by `id` in one transaction. Nothing is saved if any item is invalid, the
+        errors are returned in the same order as the items.
+        """
+        self._validate_batch(request.data)
+        try:
+            pks = [int(item['id']) for item in request.data]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError("Each secret must define its id.")
+        if len(set(pks)) != len(pks):
+            raise ValidationError("Each secret can only be updated once per request.")
+
+        with transaction.atomic():
+            instances = self.get_queryset().select_for_update().in_bulk(pks)
+            serializers = []
+            errors = []
+            for pk, item in zip(pks, request.data):
+                if pk not in instances:
+                    serializers.append(None)
+                    errors.append({'id': [ERR_SECRET_NOT_FOUND]})
+                    continue
+                serializer = self.get_serializer(instances[pk], data=item, partial=partial)
+                serializers.append(serializer)
+                errors.append({} if serializer.is_valid() else serializer.errors)
+            errors = self._merge_unique_errors(serializers, errors)
+            if any(errors):
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+            fields = {'last_updated'}
+            now = timezone.now()
+            secrets = []
+            for serializer in serializers:
+                secret = serializer.instance
+                for attr, value in serializer.validated_data.items():
+                    setattr(secret, attr, value)
+                    if attr != 'plaintext':
+                        fields.add(attr)
+                secret.last_updated = now
+                secrets.append(secret)
+            Secret.objects.bulk_update(secrets, fields)
+        # bulk_update() doesn't send post_save, and secrets may have moved to another device
+        bump_tree_version()
+
+        return Response(self.get_serializer(secrets, many=True).data)
+
+    def bulk_partial_update(self, request):
+        return self.bulk_update(request, partial=True)
 
     def retrieve(self, request, *args, **kwargs):
 
         secret = self.get_object()
 
         # decrypt the secret if the user have permission and the master key exist
-        if secret.decryptable_by(request.user) and self.master_key is not None:
+        if secret.decryptable_by(request.user, self.role_ids) and self.master_key is not None:
             secret.decrypt(self.master_key)
+            log_secret_access(request, [secret])
 
         serializer = self.get_serializer(secret)
         return Response(serializer.data)
@@ -186,23 +547,141 @@ class SecretViewSet(ModelViewSet):
     def list(self, request, *args, **kwargs):
 
         queryset = self.filter_queryset(self.get_queryset())
+        if self.master_key is None:
+            # Nothing will be decrypted, so don't load the encrypted columns. The hash is left out of the response
+            # too, instead of being loaded one secret at a time.
+            queryset = queryset.defer('ciphertext', 'hash')
+            self.deferred_fields = ('hash',)
 
         page = self.paginate_queryset(queryset)
-        if page is not None:
+        secrets = page if page is not None else list(queryset)
 
-            # decrypt all secrets if the master key exist
-            if self.master_key is not None:
-                secrets = []
-                for secret in page:
-                    # Enforce role permissions
-                    if secret.decryptable_by(request.user):
-                        secret.decrypt(self.master_key)
-                    secrets.append(secret)
-                serializer = self.get_serializer(secrets, many=True)
-            else:
-                serializer = self.get_serializer(page, many=True)
+        # decrypt all secrets if the master key exist
+        if self.master_key is not None:
+            # Enforce role permissions
+            decryptable = [secret for secret in secrets if secret.decryptable_by(request.user, self.role_ids)]
+            decrypt_secrets(decryptable, self.master_key)
+            log_secret_access(request, [secret for secret in decryptable if secret.plaintext is not None])
 
+        serializer = self.get_serializer(secrets, many=True)
+        if page is not None:
             return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
+
+    def _get_batch(self, request):
+        """
+        Look up the secrets of a batch request with one query. Return the requested items and dicts of the secrets
+        found by id and by (device, role, name).
+        """
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError("Expected a list of secret IDs or device/role/name objects.")
+        if len(items) > MAX_BATCH_SIZE:
+            raise ValidationError("No more than {} secrets can be decrypted at once.".format(MAX_BATCH_SIZE))
+
+        lookup = Q(pk__in=[item for item in items if isinstance(item, int) and not isinstance(item, bool)])
+        for item in items:
+            if isinstance(item, dict):
+                if not all(isinstance(item.get(key), str) for key in ('device', 'role')) or \
+                        not isinstance(item.get('name', ''), str):
+                    raise ValidationError("Each object must define device, role and name as strings.")
+                lookup |= Q(device__name=item['device'], role__slug=item['role'], name=item.get('name', ''))
+            elif not isinstance(item, int) or isinstance(item, bool):
+                raise ValidationError("Expected a list of secret IDs or device/role/name objects.")
+        secrets = Secret.objects.filter(lookup).select_related('device', 'role')
+        by_pk = {secret.pk: secret for secret in secrets}
+        by_key = {(secret.device.name, secret.role.slug, secret.name): secret for secret in by_pk.values()}
+
+        return items, by_pk, by_key
+
+    def _batch_results(self, items, by_pk, by_key, decryptable, render):
+        """
+        Return one result per requested item, in request order. render(secret) returns the result of a decryptable
+        secret.
+        """
+        results = []
+        for item in items:
+            if isinstance(item, dict):
+                secret = by_key.get((item['device'], item['role'], item.get('name', '')))
+            else:
+                secret = by_pk.get(item)
+            if secret is None:
+                results.append({'request': item, 'error': ERR_SECRET_NOT_FOUND})
+            elif secret.pk not in decryptable:
+                results.append({'request': item, 'id': secret.pk, 'error': ERR_SECRET_PERMISSION})
+            else:
+                results.append(dict(render(secret), request=item))
+        return results
+
+    @action(detail=False, methods=['post'], url_path='decrypt-batch', permission_classes=[IsAuthenticated])
+    def decrypt_batch(self, request):
+        """
+        Decrypt many secrets in one request. The body is a list where each item is a secret ID or an object with
+        `device` (name), `role` (slug) and `name`:
+
+            [12, 15, {"device": "sw-01", "role": "admin", "name": "root"}]
+
+        Results are returned in the same order. An item which can't be decrypted holds an `error` message.
+        """
+        items, by_pk, by_key = self._get_batch(request)
+
+        # Enforce role permissions and decrypt
+        decryptable = [
+            secret for secret in by_pk.values() if secret.decryptable_by(request.user, self.role_ids)
+        ]
+        decrypt_secrets(decryptable, self.master_key)
+        log_secret_access(request, [secret for secret in decryptable if secret.plaintext is not None])
+        decryptable = {secret.pk for secret in decryptable}
+
+        return Response(self._batch_results(
+            items, by_pk, by_key, decryptable, lambda secret: self.get_serializer(secret).data
+        ))
+
+    @action(detail=False, methods=['post'], url_path='encrypted-batch', permission_classes=[IsAuthenticated])
+    def encrypted_batch(self, request):
+        """
+        Return secrets encrypted, to be decrypted by the client. Only available if `SECRET_CLIENT_DECRYPTION` is
+        enabled. The body is the same as for `decrypt-batch`. The response holds the master key wrapped with the
+        session key (XOR, as stored in the session key) and the AES-GCM ciphertext of each secret, both base64
+        encoded:
+
+            {
+                "wrapped_key": "...",
+                "secrets": [{"request": 12, "id": 12, "ciphertext": "..."}, ...]
+            }
+
+        Secrets in the legacy AES-CFB format are decrypted by the server and returned with `plaintext`.
+        """
+        if not settings.SECRET_CLIENT_DECRYPTION:
+            raise ValidationError(ERR_CLIENT_DECRYPTION_DISABLED)
+        items, by_pk, by_key = self._get_batch(request)
+
+        # Enforce role permissions. Only legacy secrets are decrypted here.
+        decryptable = [
+            secret for secret in by_pk.values() if secret.decryptable_by(request.user, self.role_ids)
+        ]
+        decrypt_secrets(
+            [secret for secret in decryptable if secret.cipher_version != CIPHER_VERSION_GCM], self.master_key
+        )
+        log_secret_access(request, [secret for secret in decryptable if secret.plaintext is not None])
+        log_secret_access(
+            request, [secret for secret in decryptable if secret.plaintext is None and not secret.decrypt_error],
+            SecretAccessLog.ACCESS_CLIENT
+        )
+        decryptable = {secret.pk for secret in decryptable}
+
+        def render(secret):
+            if secret.plaintext is not None or secret.decrypt_error:
+                return self.get_serializer(secret).data
+            return {
+                'id': secret.pk,
+                'device': secret.device_id,
+                'role': secret.role_id,
+                'name': secret.name,
+                'ciphertext': base64.b64encode(secret.ciphertext).decode(),
+            }
+
+        return Response({
+            'wrapped_key': base64.b64encode(strxor.strxor(self.session_key, self.master_key)).decode(),
+            'secrets': self._batch_results(items, by_pk, by_key, decryptable, render),
+        })
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SecretConfig(AppConfig):
     name = 'secret'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,148 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection
+from django.utils import timezone
+from .models import Secret, SecretAccessLog
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLogWriter:
+    """
+    Write SecretAccessLog records in the background. Requests only put records in a bounded in-process queue. A
+    writer thread takes up to batch_size records, waiting at most flush_interval seconds for a batch to fill, and
+    saves them with one bulk insert. When the queue is full, new records are dropped and counted rather than slowing
+    down the request.
+    """
+    def __init__(self, buffer_size=10000, batch_size=500, flush_interval=2.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=buffer_size)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _start(self):
+        # Started on first use, so each (forked) worker process runs its own thread
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='secret-audit-log', daemon=True)
+                self._thread.start()
+
+    def log(self, records):
+        self._start()
+        for record in records:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+                    if self.dropped == 1 or not self.dropped % 1000:
+                        logger.warning("Secret audit log buffer is full, %d records dropped", self.dropped)
+
+    def _take(self, block=True):
+        """
+        Return the next batch of records. If block is False, return what is queued without waiting.
+        """
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if not block:
+                    batch.append(self._queue.get_nowait())
+                elif not batch:
+                    batch.append(self._queue.get())
+                elif timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    break
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            try:
+                SecretAccessLog.objects.bulk_create(batch)
+            except IntegrityError:
+                # A Secret or user was deleted after the access, keep the record without the reference
+                secret_ids = set(Secret.objects.filter(
+                    pk__in={record.secret_id for record in batch}
+                ).values_list('pk', flat=True))
+                user_ids = set(User.objects.filter(
+                    pk__in={record.user_id for record in batch}
+                ).values_list('pk', flat=True))
+                for record in batch:
+                    if record.secret_id not in secret_ids:
+                        record.secret_id = None
+                    if record.user_id not in user_ids:
+                        record.user_id = None
+                SecretAccessLog.objects.bulk_create(batch)
+        except Exception:
+            logger.exception("Failed to write %d secret audit log records", len(batch))
+            connection.close()
+
+    def _run(self):
+        while True:
+            self._write(self._take())
+
+    def flush(self):
+        """
+        Write all queued records from the calling thread.
+        """
+        while True:
+            batch = self._take(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def pending(self):
+        return self._queue.qsize()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_log_writer():
+    """
+    Return the audit log writer of this process.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AuditLogWriter(
+                buffer_size=settings.SECRET_AUDIT_BUFFER_SIZE,
+                batch_size=settings.SECRET_AUDIT_BATCH_SIZE,
+                flush_interval=settings.SECRET_AUDIT_FLUSH_INTERVAL
+            )
+            atexit.register(_writer.flush)
+    return _writer
+
+
+def log_secret_access(request, secrets, access=SecretAccessLog.ACCESS_DECRYPT):
+    """
+    Record that the user of request read the given Secrets.
+    """
+    if not settings.SECRET_AUDIT_LOG:
+        return
+    now = timezone.now()
+    user = request.user
+    remote_addr = request.META.get('REMOTE_ADDR') or None
+    get_audit_log_writer().log([
+        SecretAccessLog(
+            time=now,
+            secret_id=secret.pk,
+            secret_name=secret.name,
+            user_id=user.pk,
+            username=user.get_username(),
+            access=access,
+            remote_addr=remote_addr
+        ) for secret in secrets
+    ])
@@ -0,0 +1,192 @@
+import base64
+import binascii
+import json
+import struct
+import zlib
+from django.db import transaction
+from organisation.models import Device
+from organisation.regions import bump_tree_version
+from .models import MasterKeyRotation, Secret, SecretRole
+from .utils import master_key_fingerprint
+
+# Archive layout:
+# +--------+-+----------------+------------+-------+------------+-------+-----+----+
+# |DCAVAULT|V|Key fingerprint |Length (4B) |Chunk  |Length (4B) |Chunk  | ... |0000|
+# +--------+-+----------------+------------+-------+------------+-------+-----+----+
+# Each chunk is a zlib-compressed list of JSON lines, one line per Secret. Secrets are stored as they are in the
+# database, encrypted with the master key, with the device name and role slug as natural keys. The fingerprint of
+# that master key (16 bytes) follows the version byte.
+ARCHIVE_MAGIC = b'DCAVAULT'
+ARCHIVE_VERSION = 2
+FINGERPRINT_SIZE = 16
+FRAME_HEADER = struct.Struct('>I')
+# Chunks are closed early when they grow over this size, so large Secrets don't inflate memory use
+MAX_CHUNK_BYTES = 4 * 1024 * 1024
+# Limits applied when reading an archive. A chunk may go over MAX_CHUNK_BYTES by its last Secret, and compressed
+# data is never bigger than the uncompressed data by more than a few bytes.
+MAX_FRAME_BYTES = 2 * MAX_CHUNK_BYTES
+MAX_DECOMPRESSED_BYTES = 2 * MAX_CHUNK_BYTES
+RECORD_FIELDS = ('device', 'role', 'name', 'ciphertext')
+
+
+class ArchiveError(Exception):
+    """
+    When an archive can't be read.
+    """
+    pass
+
+
+def _frame(records):
+    chunk = zlib.compress('\n'.join(records).encode('utf8'))
+    return FRAME_HEADER.pack(len(chunk)) + chunk
+
+
+def iter_backup(master_key, chunk_size=500):
+    """
+    Yield the archive of all Secrets as bytes, one compressed chunk of up to chunk_size Secrets at a time. Secrets are
+    read from the database with a streaming cursor. The master key is only used for the fingerprint in the header.
+    """
+    yield ARCHIVE_MAGIC + bytes([ARCHIVE_VERSION]) + master_key_fingerprint(master_key)
+
+    secrets = Secret.objects.order_by('pk').values_list(
+        'device__name', 'role__slug', 'name', 'ciphertext', 'hash'
+    ).iterator(chunk_size=chunk_size)
+    records = []
+    size = 0
+    for device, role, name, ciphertext, hash in secrets:
+        records.append(json.dumps({
+            'device': device,
+            'role': role,
+            'name': name,
+            'ciphertext': base64.b64encode(ciphertext).decode(),
+            'hash': hash,
+        }))
+        size += len(records[-1])
+        if len(records) == chunk_size or size >= MAX_CHUNK_BYTES:
+            yield _frame(records)
+            records = []
+            size = 0
+    if records:
+        yield _frame(records)
+
+    yield FRAME_HEADER.pack(0)
+
+
+def _read(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ArchiveError("Unexpected end of archive.")
+    return data
+
+
+def _parse_record(line):
+    """
+    Return the Secret record of an archive line, with the ciphertext decoded to bytes.
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict) or not all(isinstance(record.get(key), str) for key in RECORD_FIELDS) or \
+            not isinstance(record.get('hash', ''), str):
+        raise ArchiveError("Invalid secret record in archive.")
+    try:
+        record['ciphertext'] = base64.b64decode(record['ciphertext'], validate=True)
+    except binascii.Error:
+        raise ArchiveError("Invalid secret ciphertext in archive.")
+    record.setdefault('hash', '')
+    return record
+
+
+def _decompress(data):
+    decompressor = zlib.decompressobj()
+    chunk = decompressor.decompress(data, MAX_DECOMPRESSED_BYTES)
+    if decompressor.unconsumed_tail:
+        raise ArchiveError("Archive chunk is too large.")
+    if not decompressor.eof:
+        raise ArchiveError("Corrupted archive chunk.")
+    return chunk
+
+
+def iter_archive(f, master_key):
+    """
+    Yield lists of Secret records from an archive file object, one chunk at a time. Raise ArchiveError if the archive
+    was not written with master_key, and as soon as a chunk or one of its records is invalid or too large.
+    """
+    if _read(f, len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+        raise ArchiveError("Not a secret archive.")
+    version = _read(f, 1)[0]
+    if version != ARCHIVE_VERSION:
+        raise ArchiveError("Unsupported archive version: {}".format(version))
+    if _read(f, FINGERPRINT_SIZE) != master_key_fingerprint(master_key):
+        raise ArchiveError(
+            "Archive was written with another master key. Its secrets can't be decrypted with the current master key."
+        )
+
+    while True:
+        length, = FRAME_HEADER.unpack(_read(f, FRAME_HEADER.size))
+        if not length:
+            return
+        if length > MAX_FRAME_BYTES:
+            raise ArchiveError("Archive chunk is too large.")
+        try:
+            lines = _decompress(_read(f, length)).decode('utf8').split('\n')
+            records = [_parse_record(line) for line in lines]
+        except (zlib.error, ValueError):
+            raise ArchiveError("Corrupted archive chunk.")
+        yield records
+
+
+def restore_backup(f, master_key):
+    """
+    Restore Secrets from an archive file object, one chunk per transaction. Devices and roles must already exist.
+    Secrets which already exist (same device, role and name) are kept, as well as all but the first copy of a Secret
+    found several times in the archive. The ciphertext is restored as is, so the archive must have been written with
+    the current master key; nothing is restored while a master key rotation is in progress. Return the number of
+    restored and skipped Secrets.
+    """
+    restored = skipped = 0
+    for records in iter_archive(f, master_key):
+        devices = dict(Device.objects.filter(
+            name__in={r['device'] for r in records}
+        ).values_list('name', 'pk'))
+        roles = dict(SecretRole.objects.filter(
+            slug__in={r['role'] for r in records}
+        ).values_list('slug', 'pk'))
+
+        secrets = []
+        for record in records:
+            if record['device'] not in devices or record['role'] not in roles:
+                skipped += 1
+                continue
+            secrets.append(Secret(
+                device_id=devices[record['device']],
+                role_id=roles[record['role']],
+                name=record['name'],
+                ciphertext=record['ciphertext'],
+                hash=record['hash'],
+            ))
+
+        with transaction.atomic():
+            # Checked for each chunk: restored ciphertext would not be re-encrypted by a rotation which already
+            # went past it
+            if MasterKeyRotation.objects.in_progress().exists():
+                raise ArchiveError(
+                    "Master key rotation is in progress. Secrets can't be restored until it completes."
+                )
+            existing = Secret.objects.filter(
+                device_id__in={secret.device_id for secret in secrets}
+            ).values_list('device_id', 'role_id', 'name')
+            # Earlier chunks are already saved, so duplicates across chunks are part of existing
+            seen = set(existing)
+            new = []
+            for secret in secrets:
+                key = (secret.device_id, secret.role_id, secret.name)
+                if key not in seen:
+                    seen.add(key)
+                    new.append(secret)
+            Secret.objects.bulk_create(new)
+        # bulk_create() doesn't send post_save
+        bump_tree_version()
+
+        restored += len(new)
+        skipped += len(secrets) - len(new)
+
+    return restored, skipped
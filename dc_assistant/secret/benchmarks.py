@@ -0,0 +1,249 @@
+import base64
+import fnmatch
+import platform
+import timeit
+import Crypto
+import django
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from Crypto.Util import strxor
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from organisation.models import Device, DeviceRole, Location, Region, Vendor, VendorModel
+from .cache import public_key_cache, session_key_cache
+from .models import Secret, SecretRole, SessionKey, UserKey
+from .utils import encrypt_master_key, generate_random_key, import_public_key
+
+# Plaintext sizes of the Secret benchmarks. 64KB is the maximum plaintext size.
+PLAINTEXT_SIZES = (
+    ('8B', 8),
+    ('1KB', 1024),
+    ('64KB', 65535),
+)
+
+# Registered benchmarks: name -> function(bench). See benchmark().
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Register a benchmark. The decorated function prepares its fixtures and calls bench.measure() for each timed
+    operation.
+    """
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+class Bench:
+    """
+    Times operations and collects the results. Each operation is run `number` times per round, the best of `repeat`
+    rounds is reported.
+    """
+    def __init__(self, number=100, repeat=5):
+        self.number = number
+        self.repeat = repeat
+        self.results = []
+        self._rsa_keys = {}
+
+    def measure(self, name, func, number=None):
+        number = number or self.number
+        best = min(timeit.repeat(func, number=number, repeat=self.repeat))
+        self.results.append({
+            'name': name,
+            'number': number,
+            'seconds': best,
+            'usec_per_op': best / number * 1e6,
+        })
+
+    def rsa_key(self, bits):
+        """
+        Return a private RSA key of the given size, generated once per run.
+        """
+        if bits not in self._rsa_keys:
+            self._rsa_keys[bits] = RSA.generate(bits)
+        return self._rsa_keys[bits]
+
+
+@benchmark('rsa_public_key')
+def bench_rsa_public_key(bench):
+    master_key = generate_random_key()
+    for bits in (2048, 4096):
+        public_key = bench.rsa_key(bits).publickey().exportKey('PEM').decode()
+
+        def uncached():
+            PKCS1_OAEP.new(RSA.importKey(public_key)).encrypt(master_key)
+
+        bench.measure('import_public_key[{}]/uncached'.format(bits), lambda: RSA.importKey(public_key))
+        import_public_key(public_key)
+        bench.measure('import_public_key[{}]/cached'.format(bits), lambda: import_public_key(public_key))
+        bench.measure('encrypt_master_key[{}]/uncached'.format(bits), uncached)
+        bench.measure('encrypt_master_key[{}]/cached'.format(bits), lambda: encrypt_master_key(master_key, public_key))
+    public_key_cache.clear()
+
+
+@benchmark('secret_padding')
+def bench_secret_padding(bench):
+    secret = Secret()
+    for label, size in PLAINTEXT_SIZES:
+        plaintext = 'x' * size
+        padded = secret._pad(plaintext)
+        bench.measure('Secret._pad[{}]'.format(label), lambda: secret._pad(plaintext))
+        bench.measure('Secret._unpad[{}]'.format(label), lambda: secret._unpad(padded))
+
+
+@benchmark('secret_crypto')
+def bench_secret_crypto(bench):
+    master_key = generate_random_key()
+    for label, size in PLAINTEXT_SIZES:
+        plaintext = 'x' * size
+        secret = Secret(plaintext=plaintext)
+
+        def encrypt():
+            secret.plaintext = plaintext
+            secret.encrypt(master_key)
+
+        def decrypt():
+            secret.plaintext = None
+            secret.decrypt(master_key)
+
+        bench.measure('Secret.encrypt[{}]'.format(label), encrypt)
+        bench.measure('Secret.decrypt[{}]'.format(label), decrypt)
+
+
+@benchmark('session_key')
+def bench_session_key(bench):
+    master_key = generate_random_key()
+    key = generate_random_key()
+    # Same fields as SessionKey.save() sets, without writing to the database
+    session_key = SessionKey(cipher=strxor.strxor(key, master_key), hash=make_password(key))
+
+    def uncached():
+        session_key_cache.clear()
+        session_key.get_master_key(key)
+
+    bench.measure('SessionKey.get_master_key/uncached', uncached, number=max(1, bench.number // 20))
+    bench.measure('SessionKey.get_master_key/cached', lambda: session_key.get_master_key(key))
+    session_key_cache.clear()
+
+
+@benchmark('user_key')
+def bench_user_key(bench):
+    master_key = generate_random_key()
+    for bits in (2048, 4096):
+        rsa_key = bench.rsa_key(bits)
+        private_key = rsa_key.exportKey('PEM').decode()
+        public_key = rsa_key.publickey().exportKey('PEM').decode()
+        user_key = UserKey(public_key=public_key, master_key_cipher=encrypt_master_key(master_key, public_key))
+        bench.measure(
+            'UserKey.get_master_key[{}]'.format(bits), lambda: user_key.get_master_key(private_key),
+            number=max(1, bench.number // 10)
+        )
+    public_key_cache.clear()
+
+
+class Rollback(Exception):
+    pass
+
+
+@benchmark('secret_list')
+def bench_secret_list(bench):
+    """
+    Time the API list of secrets, decrypted with a session key. The fixtures are created in a transaction which is
+    rolled back, so the database is left unchanged. The audit log is off: its writer thread would commit access
+    records of the fixture secrets to the real audit table.
+    """
+    from .api.views import SecretViewSet
+
+    view = SecretViewSet.as_view({'get': 'list'})
+    factory = APIRequestFactory()
+    try:
+        with override_settings(SECRET_AUDIT_LOG=False), transaction.atomic():
+            master_key = generate_random_key()
+            user = User.objects.create(username='benchmark-{}'.format(timezone.now().timestamp()), is_superuser=True)
+            public_key = bench.rsa_key(2048).publickey().exportKey('PEM').decode()
+            user_key = UserKey.objects.create(
+                user=user, public_key=public_key, master_key_cipher=encrypt_master_key(master_key, public_key)
+            )
+            session_key = SessionKey(userkey=user_key, name='benchmark')
+            session_key.save(master_key=master_key)
+            header = base64.b64encode(session_key.key).decode()
+
+            region = Region.objects.create(name='benchmark', slug='benchmark')
+            location = Location.objects.create(name='benchmark', slug='benchmark', region=region)
+            vendor = Vendor.objects.create(name='benchmark', slug='benchmark')
+            vendor_model = VendorModel.objects.create(vendor=vendor, model='benchmark', slug='benchmark')
+            device_role = DeviceRole.objects.create(name='benchmark', slug='benchmark', color='000000')
+            device = Device.objects.create(
+                name='benchmark', device_model=vendor_model, device_role=device_role, location=location
+            )
+            role = SecretRole.objects.create(name='benchmark', slug='benchmark')
+
+            count = 0
+            for page_size in (50, 500):
+                secrets = []
+                for i in range(count, page_size):
+                    secret = Secret(device=device, role=role, name='secret{}'.format(i), plaintext='x' * 16)
+                    secret.encrypt(master_key)
+                    secrets.append(secret)
+                Secret.objects.bulk_create(secrets)
+                count = page_size
+
+                def list_page():
+                    request = factory.get('/api/secrets/secrets/', {'device_id': device.pk}, HTTP_X_SESSION_KEY=header)
+                    force_authenticate(request, user=user)
+                    response = view(request)
+                    assert response.status_code == 200 and len(response.data) == page_size
+
+                bench.measure(
+                    'SecretViewSet.list[{}]'.format(page_size), list_page, number=max(1, bench.number // page_size)
+                )
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def environment():
+    """
+    Return versions of the software the benchmarks ran with.
+    """
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'pycryptodome': Crypto.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+    }
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compare results with baseline results. Return list of (name, baseline us/op, us/op, change) of the operations
+    which got slower by more than threshold (0.1 is 10%).
+    """
+    baseline = {result['name']: result['usec_per_op'] for result in baseline}
+    regressions = []
+    for result in results:
+        before = baseline.get(result['name'])
+        if before:
+            change = result['usec_per_op'] / before - 1
+            if change > threshold:
+                regressions.append((result['name'], before, result['usec_per_op'], change))
+    return regressions
+
+
+def run(patterns=None, number=100, repeat=5):
+    """
+    Run the benchmarks whose name matches one of the shell-style patterns (all by default). Return list of results.
+    """
+    bench = Bench(number=number, repeat=repeat)
+    for name, func in BENCHMARKS.items():
+        if patterns and not any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+            continue
+        func(bench)
+    return bench.results
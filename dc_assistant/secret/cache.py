@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+
+class TTLCache:
+    """
+    Small thread-safe in-process cache. Entries expire after `ttl` seconds and the least recently used entry is
+    dropped when the cache holds more than `maxsize` entries.
+    """
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return default
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_value(self, value):
+        """
+        Drop every entry holding `value`.
+        """
+        with self._lock:
+            for key in [k for k, (v, _) in self._data.items() if v == value]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Session keys which already passed the slow password hash check: keyed digest of the presented key -> stored hash
+session_key_cache = TTLCache(
+    maxsize=settings.SESSION_KEY_CACHE_SIZE,
+    ttl=settings.SESSION_KEY_CACHE_TTL
+)
+
+# SecretRole membership: user id -> ids of roles the user belongs to
+role_membership_cache = TTLCache(
+    maxsize=settings.SECRET_ROLE_CACHE_SIZE,
+    ttl=settings.SECRET_ROLE_CACHE_TTL
+)
+
+# Parsed RSA public keys: SHA256 fingerprint of the PEM -> RSA key object
+public_key_cache = TTLCache(
+    maxsize=settings.RSA_PUBLIC_KEY_CACHE_SIZE,
+    ttl=settings.RSA_PUBLIC_KEY_CACHE_TTL
+)
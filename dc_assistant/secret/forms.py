@@ -5,7 +5,8 @@ from django.forms import TextInput
 from django.contrib.auth.forms import AuthenticationForm, PasswordChangeForm
 from Crypto.Cipher import PKCS1_OAEP
 from Crypto.PublicKey import RSA
-from .models import Secret, UserKey, SecretRole
+from .models import Secret, UserKey, SecretRole, SecretAttachment
+from .utils import import_public_key
 from extend.forms import StaticSelectWidget, SlugField, Select2Multiple
 
 def validate_rsa_key(key, is_secret=True):
@@ -15,7 +16,7 @@ def validate_rsa_key(key, is_secret=True):
     if key.startswith('ssh-rsa '):
         raise forms.ValidationError("OpenSSH format is not supported. You need PEM (base64) format.")
     try:
-        key = RSA.importKey(key)
+        key = RSA.importKey(key) if is_secret else import_public_key(key)
     except ValueError:
         raise forms.ValidationError("Invalid RSA key.  You need PEM (base64) format.")
     except Exception as e:
@@ -165,3 +166,19 @@ class SecretRoleAddForm(forms.ModelForm):
             'users': Select2Multiple(),
             'groups': Select2Multiple(),
         }
+
+
+class SecretAttachmentAddForm(forms.ModelForm):
+    upload = forms.FileField(
+        label='File',
+        widget=forms.ClearableFileInput(attrs={
+            'class': 'requires-session-key form-control'
+        })
+    )
+
+    class Meta:
+        model = SecretAttachment
+        fields = ['name', 'upload']
+        widgets = {
+            'name': TextInput(attrs={'class': 'form-control'}),
+        }
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from Crypto.PublicKey import RSA
+from django.conf import settings
+
+
+def generate_rsa_key_pair(key_size):
+    """
+    Generate RSA key pair and return (private key, public key) in PEM format.
+    """
+    key = RSA.generate(key_size)
+    return key.exportKey('PEM').decode(), key.publickey().exportKey('PEM').decode()
+
+
+class RSAKeyPairPool:
+    """
+    Pool of pre-generated RSA key pairs. Key pairs are generated in a separate process so a request only takes a ready
+    pair. When a pair is taken, the pool refills in the background. If no pair of the requested size is ready, the
+    pair is generated in the calling thread and counted as a miss.
+    """
+    def __init__(self, key_sizes, depth):
+        self.key_sizes = list(key_sizes)
+        self.depth = depth
+        self._ready = {size: deque() for size in self.key_sizes}
+        self._pending = {size: 0 for size in self.key_sizes}
+        self._served = {size: 0 for size in self.key_sizes}
+        self._misses = {size: 0 for size in self.key_sizes}
+        # Reentrant: a done callback runs in the submitting thread if the future has already finished
+        self._lock = threading.RLock()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Don't fork a multithreaded worker
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _refill(self, key_size):
+        # Must be called with self._lock held
+        while len(self._ready[key_size]) + self._pending[key_size] < self.depth:
+            try:
+                future = self._get_executor().submit(generate_rsa_key_pair, key_size)
+            except BrokenProcessPool:
+                # The generator process died. Start a new one on the next refill.
+                self._executor = None
+                return
+            self._pending[key_size] += 1
+            future.add_done_callback(lambda f, size=key_size: self._add(size, f))
+
+    def _add(self, key_size, future):
+        with self._lock:
+            self._pending[key_size] -= 1
+            if future.exception() is None:
+                self._ready[key_size].append(future.result())
+
+    def start(self):
+        """
+        Begin filling the pool for every supported key size.
+        """
+        with self._lock:
+            for key_size in self.key_sizes:
+                self._refill(key_size)
+
+    def get(self, key_size):
+        """
+        Return (private key, public key) of the given size.
+        """
+        if key_size not in self._ready or not self.depth:
+            return generate_rsa_key_pair(key_size)
+        with self._lock:
+            self._served[key_size] += 1
+            try:
+                key_pair = self._ready[key_size].popleft()
+            except IndexError:
+                key_pair = None
+                self._misses[key_size] += 1
+            self._refill(key_size)
+        if key_pair is None:
+            key_pair = generate_rsa_key_pair(key_size)
+        return key_pair
+
+    def stats(self):
+        """
+        Return pool state and exhaustion counters for each key size.
+        """
+        with self._lock:
+            return {
+                size: {
+                    'ready': len(self._ready[size]),
+                    'pending': self._pending[size],
+                    'served': self._served[size],
+                    'misses': self._misses[size],
+                }
+                for size in self.key_sizes
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_key_pair_pool():
+    """
+    Return the RSA key pair pool of this process. It is created and starts filling on first use; the WSGI and ASGI
+    applications call this at startup.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RSAKeyPairPool(settings.RSA_KEY_POOL_SIZES, settings.RSA_KEY_POOL_DEPTH)
+            _pool.start()
+    return _pool
+
+
+def _forget_pool():
+    """
+    A forked worker (e.g. gunicorn --preload) can't use the generator process of its parent, it starts its own pool.
+    """
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_pool)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from secret.models import UserKey
+
+
+class MasterKeyCommand(BaseCommand):
+    """
+    Base for commands which need the master key. The master key is recovered from the UserKey of the given user with
+    the user's private key read from a file.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', required=True,
+            help="Username which owns an active user key"
+        )
+        parser.add_argument(
+            '--private-key', required=True,
+            help="Path to the user's private RSA key in PEM format"
+        )
+
+    def get_user_key(self, options):
+        try:
+            user_key = UserKey.objects.get(user__username=options['user'])
+        except UserKey.DoesNotExist:
+            raise CommandError("No UserKey found for user {}.".format(options['user']))
+        if not user_key.is_active():
+            raise CommandError("UserKey has not been activated for decryption.")
+        return user_key
+
+    def get_private_key(self, options):
+        with open(options['private_key']) as f:
+            return f.read()
+
+    def get_master_key(self, options):
+        master_key = self.get_user_key(options).get_master_key(self.get_private_key(options))
+        if master_key is None:
+            raise CommandError("Invalid private key.")
+        return master_key
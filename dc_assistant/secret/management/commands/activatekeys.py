@@ -0,0 +1,33 @@
+from django.core.management.base import CommandError
+from secret.management.base import MasterKeyCommand
+from secret.models import UserKey
+
+
+class Command(MasterKeyCommand):
+    help = "Activate user keys by encrypting the master key with their public keys"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            'usernames', nargs='*',
+            help="Users whose keys are activated (default: all inactive user keys)"
+        )
+
+    def handle(self, *args, **options):
+        master_key = self.get_master_key(options)
+
+        if options['usernames']:
+            user_keys = UserKey.objects.filter(user__username__in=options['usernames'])
+            missing = set(options['usernames']) - set(user_keys.values_list('user__username', flat=True))
+            if missing:
+                raise CommandError("No UserKey found for: {}".format(', '.join(sorted(missing))))
+        else:
+            user_keys = UserKey.objects.filter(master_key_cipher__isnull=True)
+
+        def progress(done, total):
+            self.stdout.write("{}/{} user keys encrypted".format(done, total))
+
+        activated, invalid = user_keys.activate(master_key, progress)
+        for user_key in invalid:
+            self.stderr.write("Invalid public key of {}".format(user_key))
+        self.stdout.write(self.style.SUCCESS("Done: {} user keys activated".format(len(activated))))
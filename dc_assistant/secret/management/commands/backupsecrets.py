@@ -0,0 +1,32 @@
+import sys
+from secret.backup import iter_backup
+from secret.management.base import MasterKeyCommand
+
+
+class Command(MasterKeyCommand):
+    help = "Write an archive of all secrets, still encrypted with the master key"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            'path',
+            help="Archive file, - for standard output"
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help="Number of secrets per compressed chunk"
+        )
+
+    def handle(self, *args, **options):
+        master_key = self.get_master_key(options)
+        if options['path'] == '-':
+            f = sys.stdout.buffer
+        else:
+            f = open(options['path'], 'wb')
+        try:
+            for data in iter_backup(master_key, chunk_size=options['chunk_size']):
+                f.write(data)
+        finally:
+            if f is not sys.stdout.buffer:
+                f.close()
+                self.stdout.write(self.style.SUCCESS("Secrets saved to {}".format(options['path'])))
@@ -0,0 +1,71 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from secret.benchmarks import BENCHMARKS, compare, environment, run
+
+
+class Command(BaseCommand):
+    help = "Benchmark the crypto operations of secrets. Available benchmarks: {}".format(', '.join(BENCHMARKS))
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'benchmarks', nargs='*',
+            help="Names or shell-style patterns of the benchmarks to run (default: all)"
+        )
+        parser.add_argument(
+            '--number', type=int, default=100,
+            help="Number of calls of each operation per round"
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help="Number of rounds, the best round is reported"
+        )
+        parser.add_argument(
+            '--json',
+            help="Write the results as JSON to this file ('-' for standard output)"
+        )
+        parser.add_argument(
+            '--compare',
+            help="JSON results of an earlier run. Fail if an operation got slower than --threshold."
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.1,
+            help="Allowed slowdown compared to --compare (default: 0.1, i.e. 10%%)"
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)['results']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError("Can't read baseline results: {}".format(e))
+
+        results = run(options['benchmarks'], number=options['number'], repeat=options['repeat'])
+
+        if options['json']:
+            report = json.dumps({
+                'date': timezone.now().isoformat(),
+                'environment': environment(),
+                'number': options['number'],
+                'repeat': options['repeat'],
+                'results': results,
+            }, indent=2)
+            if options['json'] == '-':
+                self.stdout.write(report)
+            else:
+                with open(options['json'], 'w') as f:
+                    f.write(report)
+        if options['json'] != '-':
+            width = max([len(result['name']) for result in results] + [0])
+            for result in results:
+                self.stdout.write("{:<{}}  {:>12.1f} us/op".format(result['name'], width, result['usec_per_op']))
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['threshold'])
+            for name, before, after, change in regressions:
+                self.stderr.write("{}: {:.1f} -> {:.1f} us/op (+{:.0%})".format(name, before, after, change))
+            if regressions:
+                raise CommandError("{} operations got slower than the baseline.".format(len(regressions)))
+            self.stdout.write(self.style.SUCCESS("No regression compared to the baseline."))
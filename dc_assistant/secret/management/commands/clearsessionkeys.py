@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from secret.models import SessionKey
+
+
+class Command(BaseCommand):
+    help = "Delete expired session keys"
+
+    def handle(self, *args, **options):
+        deleted, _ = SessionKey.objects.expired().delete()
+        self.stdout.write(self.style.SUCCESS("Deleted {} expired session keys".format(deleted)))
@@ -0,0 +1,25 @@
+from django.core.management.base import CommandError
+from secret.backup import ArchiveError, restore_backup
+from secret.management.base import MasterKeyCommand
+
+
+class Command(MasterKeyCommand):
+    help = "Restore secrets from an archive written by backupsecrets with the current master key"
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            'path',
+            help="Archive file"
+        )
+
+    def handle(self, *args, **options):
+        master_key = self.get_master_key(options)
+        with open(options['path'], 'rb') as f:
+            try:
+                restored, skipped = restore_backup(f, master_key)
+            except ArchiveError as e:
+                raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(
+            "Done: {} secrets restored, {} skipped (existing or missing device/role)".format(restored, skipped)
+        ))
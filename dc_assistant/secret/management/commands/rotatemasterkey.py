@@ -0,0 +1,48 @@
+from django.core.management.base import CommandError
+from secret.management.base import MasterKeyCommand
+from secret.models import InvalidKey
+from secret.rotation import MasterKeyRotator, RotationError
+
+
+class Command(MasterKeyCommand):
+    help = (
+        "Re-encrypt all secrets with a new master key. An interrupted rotation is resumed. Secrets can't be read "
+        "until the rotation completes: session keys still wrap the old master key, so re-encrypted secrets fail to "
+        "decrypt. Secrets which can't be decrypted with the old master key are reported and left as they are."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Number of secrets re-encrypted per transaction"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            rotator = MasterKeyRotator(
+                self.get_user_key(options), self.get_private_key(options), batch_size=options['batch_size']
+            )
+        except (InvalidKey, RotationError) as e:
+            raise CommandError(e)
+        if rotator.rotation.processed:
+            self.stdout.write("Resuming rotation after secret id {}".format(rotator.rotation.last_secret_id))
+
+        try:
+            rotation = rotator.run(progress=self.progress)
+        except RotationError as e:
+            raise CommandError(e)
+        if rotation.failed_secrets:
+            self.stderr.write(
+                "{} secrets could not be decrypted with the old master key and were not rotated: {}".format(
+                    len(rotation.failed_secrets), ', '.join(str(pk) for pk in rotation.failed_secrets)
+                )
+            )
+        self.stdout.write(self.style.SUCCESS(
+            "Done: {} secrets re-encrypted, session keys were reset".format(rotation.processed)
+        ))
+
+    def progress(self, rotation, rate):
+        self.stdout.write("Re-encrypted {} secrets (last id {}), {:.0f} secrets/s".format(
+            rotation.processed, rotation.last_secret_id, rate
+        ))
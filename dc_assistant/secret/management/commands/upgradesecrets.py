@@ -0,0 +1,58 @@
+from django.core.management.base import CommandError
+from django.db import transaction
+from secret.management.base import MasterKeyCommand
+from secret.models import MasterKeyRotation, Secret, CIPHER_VERSION_GCM
+
+
+class Command(MasterKeyCommand):
+    help = (
+        "Re-encrypt secrets stored in the legacy AES-CFB format with AES-GCM. Secrets which can't be decrypted are "
+        "reported and left as they are."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Number of secrets re-encrypted per transaction"
+        )
+
+    def handle(self, *args, **options):
+        master_key = self.get_master_key(options)
+        batch_size = options['batch_size']
+
+        upgraded = 0
+        failed = []
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                # Checked for each batch: a rotation which went past these secrets would not re-encrypt them again
+                if MasterKeyRotation.objects.in_progress().exists():
+                    raise CommandError(
+                        "Master key rotation is in progress. Secrets can't be upgraded until it completes."
+                    )
+                secrets = list(
+                    Secret.objects.select_for_update().filter(pk__gt=last_pk).only(
+                        'pk', 'ciphertext', 'hash'
+                    ).order_by('pk')[:batch_size]
+                )
+                if not secrets:
+                    break
+                last_pk = secrets[-1].pk
+                batch = []
+                for secret in secrets:
+                    if secret.cipher_version == CIPHER_VERSION_GCM:
+                        continue
+                    try:
+                        secret.decrypt(master_key)
+                    except ValueError as e:
+                        self.stderr.write("Secret {} can't be decrypted, skipped: {}".format(secret.pk, e))
+                        failed.append(secret.pk)
+                        continue
+                    secret.encrypt(master_key)
+                    batch.append(secret)
+                Secret.objects.bulk_update(batch, ['ciphertext', 'hash'])
+            upgraded += len(batch)
+            self.stdout.write("Upgraded {} secrets (last id {})".format(upgraded, last_pk))
+
+        self.stdout.write(self.style.SUCCESS("Done: {} secrets upgraded, {} skipped".format(upgraded, len(failed))))
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.3 on 2026-10-18 14:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('secret', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='secret',
+            name='ciphertext',
+            field=models.BinaryField(max_length=65581),
+        ),
+        migrations.AlterField(
+            model_name='secret',
+            name='hash',
+            field=models.CharField(blank=True, editable=False, max_length=128),
+        ),
+    ]
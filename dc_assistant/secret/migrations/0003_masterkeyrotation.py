@@ -0,0 +1,30 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('secret', '0002_secret_gcm_ciphertext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MasterKeyRotation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('master_key_cipher', models.BinaryField(max_length=512)),
+                ('last_secret_id', models.PositiveIntegerField(default=0, editable=False)),
+                ('processed', models.PositiveIntegerField(default=0, editable=False)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('completed', models.DateTimeField(blank=True, null=True)),
+                ('userkey', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='master_key_rotations', to='secret.UserKey')),
+            ],
+            options={
+                'ordering': ['-started'],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('secret', '0003_masterkeyrotation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='masterkeyrotation',
+            name='last_attachment_id',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='SecretAttachment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateField(auto_now_add=True, null=True)),
+                ('last_updated', models.DateTimeField(auto_now=True, null=True)),
+                ('name', models.CharField(max_length=100)),
+                ('file', models.FileField(editable=False, upload_to='secret-attachments')),
+                ('size', models.PositiveIntegerField(default=0, editable=False, help_text='Plaintext size in bytes')),
+                ('secret', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='secret.Secret')),
+            ],
+            options={
+                'ordering': ['secret', 'name'],
+            },
+        ),
+    ]
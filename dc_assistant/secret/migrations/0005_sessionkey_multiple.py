@@ -0,0 +1,47 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_session_keys(apps, schema_editor):
+    # Existing session keys have no lookup digest. Users simply request a new session key.
+    apps.get_model('secret', 'SessionKey').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('secret', '0004_secretattachment'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_session_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='sessionkey',
+            name='userkey',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='session_keys', to='secret.UserKey'),
+        ),
+        migrations.AddField(
+            model_name='sessionkey',
+            name='name',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='sessionkey',
+            name='digest',
+            field=models.CharField(default='', editable=False, max_length=64, unique=True),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='sessionkey',
+            name='expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterModelOptions(
+            name='sessionkey',
+            options={'ordering': ['userkey__user__username', 'name']},
+        ),
+        migrations.AlterUniqueTogether(
+            name='sessionkey',
+            unique_together={('userkey', 'name')},
+        ),
+    ]
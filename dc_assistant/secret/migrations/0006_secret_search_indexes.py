@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# Trigram GIN indexes for secret search. Django runs icontains as UPPER(column::text) LIKE UPPER(...), so the indexes
+# are built on the same expression.
+SEARCH_INDEXES = (
+    ('secret_secret_name_trgm', 'secret_secret'),
+    ('secret_device_name_trgm', 'organisation_device'),
+    ('secret_secretrole_name_trgm', 'secret_secretrole'),
+    ('secret_tag_name_trgm', 'extend_tag'),
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table in SEARCH_INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS {} ON {} USING gin (UPPER(name::text) gin_trgm_ops)'.format(name, table)
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table in SEARCH_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('secret', '0005_sessionkey_multiple'),
+        ('organisation', '0002_auto_20200916_2258'),
+        ('extend', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
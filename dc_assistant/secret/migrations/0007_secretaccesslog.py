@@ -0,0 +1,40 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('secret', '0006_secret_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SecretAccessLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField()),
+                ('secret_name', models.CharField(blank=True, max_length=100)),
+                ('username', models.CharField(max_length=150)),
+                ('access', models.CharField(choices=[('decrypt', 'Decrypted by the server'), ('client', 'Sent for decryption by the browser'), ('attachment', 'Attachment downloaded')], max_length=20)),
+                ('remote_addr', models.GenericIPAddressField(blank=True, null=True)),
+                ('secret', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='access_log', to='secret.Secret')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='secret_access_log', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-time'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='secretaccesslog',
+            index=models.Index(fields=['secret', 'time'], name='secret_secr_secret__737bab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='secretaccesslog',
+            index=models.Index(fields=['user', 'time'], name='secret_secr_user_id_c8ab6c_idx'),
+        ),
+    ]
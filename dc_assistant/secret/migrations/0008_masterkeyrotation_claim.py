@@ -0,0 +1,40 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:36
+
+from django.db import migrations, models
+
+
+def mark_in_progress(apps, schema_editor):
+    """
+    Mark the most recent rotation which has not completed as active. Older unfinished rotations can't be resumed.
+    """
+    MasterKeyRotation = apps.get_model('secret', 'MasterKeyRotation')
+    rotation = MasterKeyRotation.objects.filter(completed__isnull=True).order_by('-started').first()
+    if rotation is not None:
+        rotation.active = True
+        rotation.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('secret', '0007_secretaccesslog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='masterkeyrotation',
+            name='active',
+            field=models.BooleanField(default=None, editable=False, help_text='True while in progress, null when completed', null=True, unique=True),
+        ),
+        migrations.RunPython(mark_in_progress, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='masterkeyrotation',
+            name='active',
+            field=models.BooleanField(default=True, editable=False, help_text='True while in progress, null when completed', null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='masterkeyrotation',
+            name='owner',
+            field=models.CharField(blank=True, editable=False, help_text='Process running the rotation', max_length=100),
+        ),
+    ]
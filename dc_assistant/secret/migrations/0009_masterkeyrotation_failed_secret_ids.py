@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('secret', '0008_masterkeyrotation_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='masterkeyrotation',
+            name='failed_secret_ids',
+            field=models.TextField(blank=True, editable=False, help_text='Comma separated ids of secrets which could not be decrypted with the old master key'),
+        ),
+    ]
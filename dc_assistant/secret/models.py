@@ -1,16 +1,20 @@
 import os
+from datetime import timedelta
 from django.db import models
 from django.contrib.auth.models import Group, User
 from django.core.exceptions import ValidationError
 
 from Crypto.Cipher import AES
-from Crypto.PublicKey import RSA
 from Crypto.Util import strxor
 
+from django.core.files.storage import default_storage
 from django.shortcuts import reverse
+from django.utils import timezone
 from django.utils.encoding import force_bytes
-from django.db.models import QuerySet
-from .utils import encrypt_master_key, decrypt_master_key, generate_random_key
+from django.db.models import Q, QuerySet
+from .cache import session_key_cache, role_membership_cache, public_key_cache
+from .utils import encrypt_master_key, encrypt_master_key_many, decrypt_master_key, generate_random_key, \
+    session_key_digest, encrypt_stream, decrypt_stream, import_public_key, public_key_fingerprint
 from django.contrib.auth.hashers import make_password, check_password
 from taggit.managers import TaggableManager
 from extend.models import TaggedItem, LoggingModel
@@ -23,8 +27,16 @@ __all__ = (
     'SecretRole',
     'SessionKey',
     'UserKey',
+    'MasterKeyRotation',
+    'SecretAttachment',
+    'SecretAccessLog',
 )
 
+# Secret ciphertext formats
+CIPHER_VERSION_CFB = 1
+CIPHER_VERSION_GCM = 2
+
+
 class InvalidKey(Exception):
     """
     When a provided key is invalid.
@@ -44,6 +56,29 @@ class UserKeyQuerySet(QuerySet):
     def active(self):
         return self.filter(master_key_cipher__isnull=False)
 
+    def activate(self, master_key, progress=None):
+        """
+        Activate all filled UserKeys of the queryset. The master key is encrypted for every public key on a process
+        pool and all UserKeys are saved with one bulk update. progress(done, total) is called as keys are encrypted.
+        Return lists of activated UserKeys and UserKeys with an invalid public key.
+        """
+        user_keys = [user_key for user_key in self.select_related('user') if user_key.is_filled()]
+        ciphers = encrypt_master_key_many(master_key, [user_key.public_key for user_key in user_keys], progress)
+
+        now = timezone.now()
+        activated = []
+        invalid = []
+        for user_key, cipher in zip(user_keys, ciphers):
+            if cipher is None:
+                invalid.append(user_key)
+                continue
+            user_key.master_key_cipher = cipher
+            user_key.last_updated = now
+            activated.append(user_key)
+        self.model.objects.bulk_update(activated, ['master_key_cipher', 'last_updated'], batch_size=500)
+
+        return activated, invalid
+
 
 class UserKey(models.Model):
     """
@@ -96,7 +131,7 @@ class UserKey(models.Model):
         if self.public_key:
             # Validate the public key format
             try:
-                pubkey = RSA.import_key(self.public_key)
+                pubkey = import_public_key(self.public_key)
             except ValueError:
                 raise ValidationError({
                     'public_key': "Invalid RSA key format."
@@ -122,6 +157,9 @@ class UserKey(models.Model):
         # Check that public_key was modified. If yes, clean the initial master_key_cipher.
         if self.__initial_master_key_cipher and self.public_key != self.__initial_public_key:
             self.master_key_cipher = None
+        # Drop the replaced public key from the parsed key cache
+        if self.__initial_public_key and self.public_key != self.__initial_public_key:
+            public_key_cache.delete(public_key_fingerprint(self.__initial_public_key))
         # If no other active UserKeys exist, generate a new master key and use it to activate this UserKey.
         if self.is_filled() and not self.is_active() and not UserKey.objects.active().count():
             master_key = generate_random_key()
@@ -215,19 +253,49 @@ class SecretRole(LoggingModel):
         """
         if user.is_superuser:
             return True
-        return user in self.users.all() or user.groups.filter(pk__in=self.groups.all()).exists()
+        return self.pk in get_member_role_ids(user)
+
+
+def get_member_role_ids(user):
+    """
+    Return ids of SecretRoles the user belongs to directly or through a group. The result is cached per user until
+    role users or groups change through this worker, or for SECRET_ROLE_CACHE_TTL seconds.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    role_ids = role_membership_cache.get(user.pk)
+    if role_ids is None:
+        role_ids = frozenset(SecretRole.objects.filter(
+            Q(users=user) | Q(groups__user=user)
+        ).values_list('pk', flat=True))
+        role_membership_cache.set(user.pk, role_ids)
+    return role_ids
+
+
+class SessionKeyQuerySet(QuerySet):
+
+    def active(self):
+        return self.filter(Q(expires__isnull=True) | Q(expires__gt=timezone.now()))
+
+    def expired(self):
+        return self.filter(expires__lte=timezone.now())
 
 
 class SessionKey(models.Model):
     """
-    A SessionKey is User's temporary key for the encryption and decryption of secrets.
+    A SessionKey is User's temporary key for the encryption and decryption of secrets. A UserKey can hold several
+    named SessionKeys at once (one per automation client, for example), each with an optional expiry time.
     """
-    userkey = models.OneToOneField(
+    userkey = models.ForeignKey(
         to=UserKey,
         on_delete=models.CASCADE,
-        related_name='session_key',
+        related_name='session_keys',
         editable=False
     )
+    name = models.CharField(
+        max_length=50,
+        blank=True
+    )
     cipher = models.BinaryField(
         max_length=512,
         editable=False
@@ -236,18 +304,35 @@ class SessionKey(models.Model):
         max_length=128,
         editable=False
     )
+    digest = models.CharField(
+        max_length=64,
+        unique=True,
+        editable=False
+    )
     created = models.DateTimeField(
         auto_now_add=True
     )
+    expires = models.DateTimeField(
+        blank=True,
+        null=True
+    )
 
     key = None
 
+    objects = SessionKeyQuerySet.as_manager()
+
     class Meta:
-        ordering = ['userkey__user__username']
+        ordering = ['userkey__user__username', 'name']
+        unique_together = ['userkey', 'name']
 
     def __str__(self):
+        if self.name:
+            return '{} ({})'.format(self.userkey.user.username, self.name)
         return self.userkey.user.username
 
+    def is_expired(self):
+        return self.expires is not None and self.expires <= timezone.now()
+
     def save(self, master_key=None, *args, **kwargs):
 
         if master_key is None:
@@ -258,6 +343,8 @@ class SessionKey(models.Model):
             self.key = generate_random_key()
         # Generate SHA256 hash using Django's built-in password hashing mechanism
         self.hash = make_password(self.key)
+        # Keyed digest to look up the SessionKey from the presented key
+        self.digest = session_key_digest(self.key)
         # Encrypt master key using the session key
         self.cipher = strxor.strxor(self.key, master_key)
 
@@ -265,16 +352,19 @@ class SessionKey(models.Model):
 
     def get_master_key(self, session_key):
 
-        # Validate the provided session key
-        if not check_password(session_key, self.hash):
-            raise InvalidKey("Invalid session key")
+        # Validate the provided session key. The slow hash check is skipped if this key was already verified against
+        # the current hash (a replaced SessionKey always gets a new hash).
+        digest = session_key_digest(session_key)
+        if session_key_cache.get(digest) != self.hash:
+            if not check_password(session_key, self.hash):
+                raise InvalidKey("Invalid session key")
+            session_key_cache.set(digest, self.hash)
         # Decrypt master key using provided session key
         master_key = strxor.strxor(session_key, bytes(self.cipher))
 
         return master_key
 
     def get_session_key(self, master_key):
-        print(master_key)
 
         # Recover session key using the master key
         session_key = strxor.strxor(master_key, bytes(self.cipher))
@@ -287,8 +377,9 @@ class SessionKey(models.Model):
 
 class Secret(LoggingModel):
     """
-    A Secret is AES256-encrypted instance of sensitive data, such as passwords or secret keys. Irreversible
-    SHA-256 hash is stored with the ciphertext for validation when need to decrypt.
+    A Secret is AES256-GCM encrypted instance of sensitive data, such as passwords or secret keys. The GCM tag stored
+    with the ciphertext validates it on decryption. Secrets encrypted by older versions use AES256-CFB with an
+    irreversible SHA-256 hash of the plaintext for validation.
     Each Secret is assigned to Device. Devices may have a lot of Secrets.
     A name (It my be login in case if secret is login/password pair) stored as plain text in the database.
     A Secret can be up to 65535 bytes (64KB) in length.
@@ -308,18 +399,20 @@ class Secret(LoggingModel):
         max_length=100,
         blank=True
     )
-    # 128-bit IV + 16-bit pad length + 65535B secret + 15B padding
+    # 8-bit version + 96-bit nonce + 128-bit tag + 16-bit pad length + 65535B secret + 15B padding
     ciphertext = models.BinaryField(
-        max_length=65568,
+        max_length=65581,
         editable=False
     )
     hash = models.CharField(
         max_length=128,
+        blank=True,
         editable=False
     )
     tag = TaggableManager(through=TaggedItem)
 
     plaintext = None
+    decrypt_error = None
 
     class Meta:
         ordering = ['device', 'role', 'name']
@@ -366,42 +459,64 @@ class Secret(LoggingModel):
             plaintext_length = (ord(s[0]) << 8) + ord(s[1])
         else:
             plaintext_length = (s[0] << 8) + s[1]
-        return s[2:plaintext_length + 2].decode('utf8')
+        return str(memoryview(s)[2:plaintext_length + 2], 'utf8')
 
     def encrypt(self, secret_key):
         """
-        Generate a random Initialization Vector (IV). Complete the plaintext to the block size (16 bytes) and
-        encrypt. Prepare the IV for use in decryption. At the finally record the hash of the plaintext for validation
-        upon decryption.
+        Generate a random nonce, complete the plaintext to the block size (16 bytes) and encrypt it with AES-GCM.
+        The GCM tag authenticates the ciphertext, so no separate hash of the plaintext is stored.
+        +-+------------+----------------+------------------------------+
+        |V|Nonce (12B) |Tag (16B)       |Encrypted padded plaintext    |
+        +-+------------+----------------+------------------------------+
         """
         if self.plaintext is None:
             raise Exception("Must unlock or set plaintext before locking.")
         # Pad and encrypt plaintext
-        iv = os.urandom(16)
-        aes = AES.new(secret_key, AES.MODE_CFB, iv)
-        self.ciphertext = iv + aes.encrypt(self._pad(self.plaintext))
-        # Generate SHA256 using Django's built-in password hashing mechanism
-        self.hash = make_password(self.plaintext, hasher=SecretValidationHasher())
+        nonce = os.urandom(12)
+        aes = AES.new(secret_key, AES.MODE_GCM, nonce=nonce)
+        ciphertext, tag = aes.encrypt_and_digest(self._pad(self.plaintext))
+        self.ciphertext = bytes([CIPHER_VERSION_GCM]) + nonce + tag + ciphertext
+        self.hash = ''
         self.plaintext = None
 
+    @property
+    def cipher_version(self):
+        """
+        Return format version of the stored ciphertext. Legacy CFB ciphertext (16B IV + padded plaintext) is always a
+        multiple of the block size and has no version byte.
+        """
+        if len(self.ciphertext) % 16 == 0:
+            return CIPHER_VERSION_CFB
+        return self.ciphertext[0]
+
     def decrypt(self, secret_key):
         """
-        Use the first 16 bytes of self.ciphertext as the IV. The remainder is decrypted
-        using the IV and the secret private key. Padding is removed to open the plaintext. At the end it validate the
-        decrypted plaintext value against the stored hash.
+        Decrypt the ciphertext according to its format version. AES-GCM ciphertext is verified with its tag. Legacy
+        AES-CFB ciphertext uses the first 16 bytes as the IV and the decrypted plaintext is validated against the
+        stored hash.
         """
         if self.plaintext is not None:
             return
         if not self.ciphertext:
             raise Exception("Must define ciphertext before unlocking.")
-        # Decrypt ciphertext and remove padding
-        iv = bytes(self.ciphertext[0:16])
-        ciphertext = bytes(self.ciphertext[16:])
-        aes = AES.new(secret_key, AES.MODE_CFB, iv)
-        plaintext = self._unpad(aes.decrypt(ciphertext))
-        # Verify decrypted plaintext against hash
-        if not self.validate(plaintext):
-            raise ValueError("Invalid key or ciphertext!")
+        version = self.cipher_version
+        # Slice a view of the stored ciphertext rather than copying its parts
+        data = memoryview(self.ciphertext)
+        if version == CIPHER_VERSION_GCM:
+            aes = AES.new(secret_key, AES.MODE_GCM, nonce=data[1:13])
+            try:
+                plaintext = self._unpad(aes.decrypt_and_verify(data[29:], data[13:29]))
+            except ValueError:
+                raise ValueError("Invalid key or ciphertext!")
+        elif version == CIPHER_VERSION_CFB:
+            # Decrypt ciphertext and remove padding
+            aes = AES.new(secret_key, AES.MODE_CFB, data[0:16])
+            plaintext = self._unpad(aes.decrypt(data[16:]))
+            # Verify decrypted plaintext against hash
+            if not self.validate(plaintext):
+                raise ValueError("Invalid key or ciphertext!")
+        else:
+            raise ValueError("Unknown ciphertext version: {}".format(version))
         self.plaintext = plaintext
 
     def validate(self, plaintext):
@@ -412,8 +527,226 @@ class Secret(LoggingModel):
             raise Exception("Hash generated for not this secret.")
         return check_password(plaintext, self.hash, preferred=SecretValidationHasher())
 
-    def decryptable_by(self, user):
+    def decryptable_by(self, user, role_ids=None):
+        """
+        Check user permission to decrypt this Secret. Pass role_ids from get_member_role_ids() when checking many
+        Secrets.
+        """
+        if user.is_superuser:
+            return True
+        if role_ids is None:
+            role_ids = get_member_role_ids(user)
+        return self.role_id in role_ids
+
+
+class SecretAttachment(LoggingModel):
+    """
+    A file attached to a Secret (certificate bundle, keytab, license file and so on). The file is stored under
+    MEDIA_ROOT encrypted with the master key, in chunks, so it is never loaded into memory as a whole.
+    """
+    secret = models.ForeignKey(
+        to=Secret,
+        on_delete=models.CASCADE,
+        related_name='attachments'
+    )
+    name = models.CharField(
+        max_length=100
+    )
+    file = models.FileField(
+        upload_to='secret-attachments',
+        editable=False
+    )
+    size = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='Plaintext size in bytes'
+    )
+
+    class Meta:
+        ordering = ['secret', 'name']
+
+    def __str__(self):
+        return self.name
+
+    def get_absolute_url(self):
+        return reverse('secret:secretattachment', args=[self.pk])
+
+    def encrypt(self, chunks, secret_key):
+        """
+        Encrypt iterable of bytes with the secret key and write it to a new file. The file name is saved to the
+        instance, the instance itself is not saved.
+        """
+        name = default_storage.get_available_name(
+            '{}/{}'.format(self.file.field.upload_to, generate_random_key(128).hex())
+        )
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        size = 0
+
+        def count(chunks):
+            nonlocal size
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+
+        with open(path, 'wb') as f:
+            for data in encrypt_stream(count(chunks), secret_key):
+                f.write(data)
+        self.file.name = name
+        self.size = size
+
+    def decrypt(self, secret_key):
+        """
+        Return iterator over the decrypted file content.
+        """
+        def read():
+            with default_storage.open(self.file.name, 'rb') as f:
+                yield from decrypt_stream(f, secret_key)
+        return read()
+
+
+class MasterKeyRotationQuerySet(QuerySet):
+
+    def in_progress(self):
+        return self.filter(active=True)
+
+
+class MasterKeyRotation(models.Model):
+    """
+    Checkpoint of master key rotation. The new master key is stored encrypted with the public key of the UserKey
+    which started the rotation, so an interrupted rotation can be resumed with the same private key. Secrets up to
+    last_secret_id and attachments up to last_attachment_id are already encrypted with the new master key, except
+    failed_secret_ids: Secrets which could not be decrypted with the old master key and were left as they were.
+    The process running the rotation is recorded as owner and saves the row after every batch; a rotation whose row
+    was not saved for CLAIM_TIMEOUT is free to be resumed. `active` is unique, so only one rotation can be in progress.
+    """
+    CLAIM_TIMEOUT = timedelta(minutes=5)
+
+    userkey = models.ForeignKey(
+        to=UserKey,
+        on_delete=models.PROTECT,
+        related_name='master_key_rotations',
+        editable=False
+    )
+    master_key_cipher = models.BinaryField(
+        max_length=512,
+        editable=False
+    )
+    last_secret_id = models.PositiveIntegerField(
+        default=0,
+        editable=False
+    )
+    last_attachment_id = models.PositiveIntegerField(
+        default=0,
+        editable=False
+    )
+    processed = models.PositiveIntegerField(
+        default=0,
+        editable=False
+    )
+    failed_secret_ids = models.TextField(
+        blank=True,
+        editable=False,
+        help_text='Comma separated ids of secrets which could not be decrypted with the old master key'
+    )
+    started = models.DateTimeField(
+        auto_now_add=True
+    )
+    last_updated = models.DateTimeField(
+        auto_now=True
+    )
+    completed = models.DateTimeField(
+        blank=True,
+        null=True
+    )
+    active = models.BooleanField(
+        default=True,
+        null=True,
+        unique=True,
+        editable=False,
+        help_text='True while in progress, null when completed'
+    )
+    owner = models.CharField(
+        max_length=100,
+        blank=True,
+        editable=False,
+        help_text='Process running the rotation'
+    )
+    objects = MasterKeyRotationQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-started']
+
+    def __str__(self):
+        return 'Master key rotation {}'.format(self.started)
+
+    def is_claimed(self):
         """
-        Check user permission to decrypt this Secret.
+        Return True if a process is running this rotation.
         """
-        return self.role.has_member(user)
\ No newline at end of file
+        return bool(self.owner) and self.last_updated > timezone.now() - self.CLAIM_TIMEOUT
+
+    @property
+    def failed_secrets(self):
+        return [int(pk) for pk in self.failed_secret_ids.split(',') if pk]
+
+    def add_failed_secrets(self, ids):
+        self.failed_secret_ids = ','.join(str(pk) for pk in self.failed_secrets + list(ids))
+
+
+class SecretAccessLog(models.Model):
+    """
+    Audit record of a user reading a Secret. Records are written in batches by the audit log writer (see
+    secret/audit.py), so `time` is the time of access, not of the insert. The username and secret name are kept so
+    records stay readable after the user or the Secret is deleted.
+    """
+    ACCESS_DECRYPT = 'decrypt'
+    ACCESS_CLIENT = 'client'
+    ACCESS_ATTACHMENT = 'attachment'
+    ACCESS_CHOICES = (
+        (ACCESS_DECRYPT, 'Decrypted by the server'),
+        (ACCESS_CLIENT, 'Sent for decryption by the browser'),
+        (ACCESS_ATTACHMENT, 'Attachment downloaded'),
+    )
+
+    time = models.DateTimeField()
+    secret = models.ForeignKey(
+        to=Secret,
+        on_delete=models.SET_NULL,
+        related_name='access_log',
+        blank=True,
+        null=True
+    )
+    secret_name = models.CharField(
+        max_length=100,
+        blank=True
+    )
+    user = models.ForeignKey(
+        to=User,
+        on_delete=models.SET_NULL,
+        related_name='secret_access_log',
+        blank=True,
+        null=True
+    )
+    username = models.CharField(
+        max_length=150
+    )
+    access = models.CharField(
+        max_length=20,
+        choices=ACCESS_CHOICES
+    )
+    remote_addr = models.GenericIPAddressField(
+        blank=True,
+        null=True
+    )
+
+    class Meta:
+        ordering = ['-time']
+        indexes = [
+            models.Index(fields=['secret', 'time']),
+            models.Index(fields=['user', 'time']),
+        ]
+
+    def __str__(self):
+        return '{} {} {}'.format(self.username, self.access, self.secret_name)
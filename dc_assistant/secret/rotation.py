@@ -0,0 +1,190 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from .models import InvalidKey, MasterKeyRotation, Secret, SecretAttachment, SessionKey, UserKey
+from .utils import decrypt_master_key, encrypt_master_key, generate_random_key
+
+logger = logging.getLogger(__name__)
+
+
+class RotationError(Exception):
+    pass
+
+
+class RotationRunning(RotationError):
+    """
+    Another process is running the master key rotation.
+    """
+    pass
+
+
+class MasterKeyRotator:
+    """
+    Re-encrypt all Secrets and their attachments with a new master key. Secrets are processed in primary key order,
+    one batch per transaction, and the last processed id is saved with each batch. Attachments follow one at a time.
+    Running the rotator again with the same user key resumes an interrupted rotation. When everything is done, the
+    new master key is wrapped for every active UserKey and all session keys (which wrap the old master key) are
+    deleted in one transaction. The rotation is claimed in the database, so only one process runs it at a time;
+    RotationRunning is raised if it is claimed by another one.
+
+    A Secret which can't be decrypted with the old master key is logged, recorded in the rotation and left as it is.
+    Until the rotation completes, users still hold session keys of the old master key, so Secrets which are already
+    re-encrypted can't be read.
+    """
+    def __init__(self, user_key, private_key, batch_size=500):
+        if settings.SESSION_KEY_STORE == 'locmem':
+            raise RotationError(
+                "The master key can't be rotated with the 'locmem' session key store: other workers would keep "
+                "session keys of the old master key. Select the 'file' or 'database' store first."
+            )
+        self.batch_size = batch_size
+        self.old_master_key = user_key.get_master_key(private_key)
+        if self.old_master_key is None:
+            raise InvalidKey("Invalid private key.")
+        self.owner = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])[-100:]
+
+        with transaction.atomic():
+            self.rotation = MasterKeyRotation.objects.in_progress().select_for_update().first()
+            if self.rotation is None:
+                self.new_master_key = generate_random_key()
+                try:
+                    with transaction.atomic():
+                        self.rotation = MasterKeyRotation.objects.create(
+                            userkey=user_key,
+                            master_key_cipher=encrypt_master_key(self.new_master_key, user_key.public_key),
+                            owner=self.owner
+                        )
+                except IntegrityError:
+                    # Another process started a rotation at the same time
+                    raise RotationRunning("Master key rotation is already running.")
+                return
+            if self.rotation.userkey_id != user_key.pk:
+                raise InvalidKey("Master key rotation was started by {} and must be resumed by the same user.".format(
+                    self.rotation.userkey
+                ))
+            if self.rotation.is_claimed():
+                raise RotationRunning("Master key rotation is already running.")
+            self.new_master_key = decrypt_master_key(bytes(self.rotation.master_key_cipher), private_key)
+            self.rotation.owner = self.owner
+            self.rotation.save()
+
+    def _checkpoint(self):
+        """
+        Lock the rotation row and check it is still claimed by this rotator. Must be called in a transaction.
+        """
+        owner = MasterKeyRotation.objects.select_for_update().values_list('owner', flat=True).get(
+            pk=self.rotation.pk
+        )
+        if owner != self.owner:
+            raise RotationRunning("Master key rotation was taken over by another process.")
+
+    def release(self):
+        """
+        Give up the claim on the rotation, so it can be resumed at once.
+        """
+        MasterKeyRotation.objects.filter(pk=self.rotation.pk, owner=self.owner).update(owner='')
+
+    def run(self, progress=None):
+        """
+        Rotate the remaining Secrets. progress(rotation, rate) is called after each batch with the throughput in
+        Secrets per second. Return the completed MasterKeyRotation.
+        """
+        try:
+            return self._run(progress)
+        except BaseException:
+            # Let the rotation be resumed at once instead of after the claim expires
+            self.release()
+            raise
+
+    def _run(self, progress):
+        rotation = self.rotation
+        started = time.monotonic()
+        processed = 0
+
+        while True:
+            with transaction.atomic():
+                self._checkpoint()
+                secrets = list(
+                    Secret.objects.select_for_update().filter(pk__gt=rotation.last_secret_id).only(
+                        'pk', 'ciphertext', 'hash'
+                    ).order_by('pk')[:self.batch_size]
+                )
+                if not secrets:
+                    break
+                rotated = []
+                failed = []
+                for secret in secrets:
+                    try:
+                        secret.decrypt(self.old_master_key)
+                    except ValueError as e:
+                        logger.error("Secret %s can't be decrypted with the old master key, not rotated: %s",
+                                     secret.pk, e)
+                        failed.append(secret.pk)
+                        continue
+                    secret.encrypt(self.new_master_key)
+                    rotated.append(secret)
+                Secret.objects.bulk_update(rotated, ['ciphertext', 'hash'])
+
+                rotation.last_secret_id = secrets[-1].pk
+                rotation.processed += len(rotated)
+                if failed:
+                    rotation.add_failed_secrets(failed)
+                rotation.save()
+
+            processed += len(rotated)
+            if progress is not None:
+                progress(rotation, processed / max(time.monotonic() - started, 1e-6))
+
+        for attachment in SecretAttachment.objects.filter(pk__gt=rotation.last_attachment_id).order_by('pk'):
+            old_name = attachment.file.name
+            attachment.encrypt(attachment.decrypt(self.old_master_key), self.new_master_key)
+            with transaction.atomic():
+                self._checkpoint()
+                attachment.save()
+                rotation.last_attachment_id = attachment.pk
+                rotation.save()
+            default_storage.delete(old_name)
+
+        with transaction.atomic():
+            self._checkpoint()
+            user_keys = list(UserKey.objects.active().select_for_update())
+            for user_key in user_keys:
+                user_key.master_key_cipher = encrypt_master_key(self.new_master_key, user_key.public_key)
+            UserKey.objects.bulk_update(user_keys, ['master_key_cipher'])
+            SessionKey.objects.all().delete()
+            rotation.completed = timezone.now()
+            rotation.active = None
+            rotation.owner = ''
+            rotation.save()
+
+        return rotation
+
+
+def rotation_running():
+    """
+    Return True if a process is running the master key rotation.
+    """
+    rotation = MasterKeyRotation.objects.in_progress().first()
+    return rotation is not None and rotation.is_claimed()
+
+
+def start_rotation(rotator):
+    """
+    Run the rotator in a background thread.
+    """
+    def run():
+        try:
+            rotator.run()
+        except Exception:
+            logger.exception("Master key rotation failed")
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, name='master-key-rotation', daemon=True).start()
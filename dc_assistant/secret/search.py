@@ -0,0 +1,48 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import Case, FloatField, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from extend.models import TaggedItem
+
+
+def _tagged(queryset, **filters):
+    return TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(queryset.model), **filters)
+
+
+def search_secrets(queryset, value):
+    """
+    Filter Secrets whose name, device name, role name or a tag name contains value, ordered by relevance.
+
+    The filter is the same on all databases. On PostgreSQL the case-insensitive substring match is served by the
+    trigram GIN indexes of migration 0006 and matches are ranked by trigram similarity. Other databases rank exact
+    and prefix matches of the secret name first.
+    """
+    queryset = queryset.filter(
+        Q(name__icontains=value) |
+        Q(device__name__icontains=value) |
+        Q(role__name__icontains=value) |
+        Q(pk__in=_tagged(queryset, tag__name__icontains=value).values('object_id'))
+    )
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        tag_rank = _tagged(queryset, object_id=OuterRef('pk')).annotate(
+            rank=TrigramSimilarity('tag__name', value)
+        ).order_by('-rank').values('rank')[:1]
+        rank = Greatest(
+            TrigramSimilarity('name', value),
+            TrigramSimilarity('device__name', value),
+            TrigramSimilarity('role__name', value),
+            Coalesce(Subquery(tag_rank, output_field=FloatField()), Value(0.0)),
+        )
+    else:
+        rank = Case(
+            When(name__iexact=value, then=Value(3)),
+            When(name__istartswith=value, then=Value(2)),
+            When(name__icontains=value, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+
+    return queryset.annotate(search_rank=rank).order_by('-search_rank', 'device', 'role', 'name')
@@ -0,0 +1,202 @@
+import base64
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .cache import TTLCache
+from .models import InvalidKey, SessionKey
+from .utils import session_key_digest
+
+
+class SessionKeyRecord(namedtuple('SessionKeyRecord', ['user_id', 'cipher', 'hash', 'expires'])):
+    """
+    What is needed to unlock the master key with a session key: owner, encrypted master key, hash of the session key
+    and expiry time (UNIX timestamp or None).
+    """
+    @classmethod
+    def from_session_key(cls, session_key):
+        expires = session_key.expires.timestamp() if session_key.expires else None
+        return cls(session_key.userkey.user_id, bytes(session_key.cipher), session_key.hash, expires)
+
+    def is_expired(self):
+        return self.expires is not None and self.expires <= time.time()
+
+
+class DatabaseSessionKeyStore:
+    """
+    Read session keys from the SessionKey table on every request.
+    """
+    def get(self, digest):
+        """
+        Return SessionKeyRecord of an active session key, or None.
+        """
+        try:
+            session_key = SessionKey.objects.active().select_related('userkey').get(digest=digest)
+        except SessionKey.DoesNotExist:
+            return None
+        return SessionKeyRecord.from_session_key(session_key)
+
+    def delete(self, digest):
+        pass
+
+    def clear_expired(self):
+        pass
+
+
+class CachedSessionKeyStore(DatabaseSessionKeyStore):
+    """
+    Keep session keys read from the database for `ttl` seconds, so the lookup of a known key needs no database query.
+    Subclasses implement _load(), _save() and delete().
+    """
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+
+    def get(self, digest):
+        record = self._load(digest)
+        if record is None:
+            record = super().get(digest)
+            if record is None:
+                return None
+            self._save(digest, record)
+        return record
+
+    def _load(self, digest):
+        raise NotImplementedError
+
+    def _save(self, digest, record):
+        raise NotImplementedError
+
+
+class LocMemSessionKeyStore(CachedSessionKeyStore):
+    """
+    Keep session keys in the memory of each worker. A replaced or deleted session key is only forgotten by the worker
+    which deleted it; other workers accept it until their entry expires. Use with a single worker or a short TTL.
+    """
+    def __init__(self, ttl=300):
+        super().__init__(ttl)
+        self._cache = TTLCache(maxsize=settings.SESSION_KEY_CACHE_SIZE, ttl=ttl)
+
+    def _load(self, digest):
+        return self._cache.get(digest)
+
+    def _save(self, digest, record):
+        self._cache.set(digest, record)
+
+    def delete(self, digest):
+        self._cache.delete(digest)
+
+
+class FileSessionKeyStore(CachedSessionKeyStore):
+    """
+    Keep session keys as small files in a directory shared by all workers of the host (a tmpfs such as /dev/shm is
+    best). A deleted session key is removed for all workers at once. Files are replaced atomically, so readers never
+    see a partial entry. The directory must be owned by the user running the workers and closed to everyone else.
+    """
+    def __init__(self, path, ttl=300):
+        super().__init__(ttl)
+        self.path = path
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        # The directory may have been created beforehand by another user, or be a symlink to somewhere else
+        info = os.lstat(path)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.geteuid() or info.st_mode & 0o077:
+            raise ImproperlyConfigured(
+                "SESSION_KEY_STORE_PATH {} must be a directory owned by the current user, without group or other "
+                "permissions.".format(path)
+            )
+
+    def _file(self, digest):
+        return os.path.join(self.path, digest)
+
+    def _load(self, digest):
+        try:
+            with open(self._file(digest)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data['cached_until'] <= time.time():
+            return None
+        return SessionKeyRecord(data['user_id'], base64.b64decode(data['cipher']), data['hash'], data['expires'])
+
+    def _save(self, digest, record):
+        data = {
+            'user_id': record.user_id,
+            'cipher': base64.b64encode(record.cipher).decode(),
+            'hash': record.hash,
+            'expires': record.expires,
+            'cached_until': time.time() + self.ttl,
+        }
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self._file(digest))
+        except OSError:
+            # The store is only a cache, the database still holds the session key
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def delete(self, digest):
+        try:
+            os.unlink(self._file(digest))
+        except OSError:
+            pass
+
+    def clear_expired(self):
+        """
+        Remove entries which expired and were not read again.
+        """
+        now = time.time()
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                if os.stat(path).st_mtime + self.ttl <= now:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+
+SESSION_KEY_STORES = ('database', 'locmem', 'file')
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_key_store():
+    """
+    Return the session key store selected by the SESSION_KEY_STORE setting.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = settings.SESSION_KEY_STORE
+            if backend == 'database':
+                _store = DatabaseSessionKeyStore()
+            elif backend == 'locmem':
+                _store = LocMemSessionKeyStore(ttl=settings.SESSION_KEY_STORE_TTL)
+            elif backend == 'file':
+                if not settings.SESSION_KEY_STORE_PATH:
+                    raise ImproperlyConfigured("SESSION_KEY_STORE_PATH is required by the 'file' session key store.")
+                _store = FileSessionKeyStore(settings.SESSION_KEY_STORE_PATH, ttl=settings.SESSION_KEY_STORE_TTL)
+            else:
+                raise ImproperlyConfigured("SESSION_KEY_STORE must be one of: {}".format(
+                    ', '.join(SESSION_KEY_STORES)
+                ))
+    return _store
+
+
+def get_master_key(user, session_key):
+    """
+    Return the master key unlocked by a session key of the user. Raise InvalidKey if the session key is unknown,
+    expired or belongs to another user.
+    """
+    record = get_session_key_store().get(session_key_digest(session_key))
+    if record is None or record.user_id != user.pk or record.is_expired():
+        raise InvalidKey("Invalid session key")
+    return SessionKey(cipher=record.cipher, hash=record.hash).get_master_key(session_key)
@@ -0,0 +1,88 @@
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.db import connection, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .cache import session_key_cache, role_membership_cache
+from organisation.regions import bump_tree_version
+from .models import Secret, SecretAttachment, SecretRole, SessionKey
+from .sessionstore import get_session_key_store
+
+
+@receiver(post_save, sender=SessionKey)
+@receiver(post_delete, sender=SessionKey)
+def invalidate_session_key(instance, **kwargs):
+    """
+    Forget verified session key and drop it from the session key store when SessionKey is replaced or deleted.
+    """
+    session_key_cache.delete_value(instance.hash)
+    get_session_key_store().delete(instance.digest)
+
+
+_last_session_key_cleanup = 0
+_session_key_cleanup_lock = threading.Lock()
+
+
+def _delete_expired_session_keys():
+    try:
+        SessionKey.objects.expired().delete()
+        get_session_key_store().clear_expired()
+    finally:
+        connection.close()
+
+
+@receiver(post_save, sender=SessionKey)
+def cleanup_session_keys(created, **kwargs):
+    """
+    Delete expired session keys in a background thread when a new one is issued, at most once per
+    SESSION_KEY_CLEANUP_INTERVAL seconds in each worker.
+    """
+    global _last_session_key_cleanup
+    if not created:
+        return
+    with _session_key_cleanup_lock:
+        now = time.monotonic()
+        if now - _last_session_key_cleanup < settings.SESSION_KEY_CLEANUP_INTERVAL:
+            return
+        _last_session_key_cleanup = now
+
+    def start():
+        threading.Thread(target=_delete_expired_session_keys, name='session-key-cleanup', daemon=True).start()
+    transaction.on_commit(start)
+
+
+@receiver(m2m_changed, sender=SecretRole.users.through)
+@receiver(m2m_changed, sender=SecretRole.groups.through)
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(post_delete, sender=SecretRole)
+@receiver(post_delete, sender=Group)
+def invalidate_role_membership(**kwargs):
+    """
+    Forget cached SecretRole membership when role users or groups change.
+    """
+    role_membership_cache.clear()
+
+
+@receiver(post_delete, sender=SecretAttachment)
+def delete_attachment_file(instance, **kwargs):
+    """
+    Remove the encrypted file of a deleted attachment.
+    """
+    instance.file.delete(save=False)
+
+
+@receiver(post_save, sender=Secret)
+def invalidate_region_secret_count(created, **kwargs):
+    """
+    Region statistics count the secrets of each region. Secrets are saved again on re-encryption, only new ones
+    change the counts.
+    """
+    if created:
+        bump_tree_version()
+
+
+@receiver(post_delete, sender=Secret)
+def invalidate_region_secret_count_on_delete(**kwargs):
+    bump_tree_version()
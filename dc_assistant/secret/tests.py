@@ -1,3 +1,780 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import shutil
+import stat
+import tempfile
+import time
+import zlib
+from datetime import timedelta
+from unittest import mock
+from Crypto.Cipher import AES
+from Crypto.PublicKey import RSA
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from organisation.models import Device, DeviceRole, Location, Region, Vendor, VendorModel
+from rest_framework.test import APIClient
+from .api.views import MAX_BATCH_SIZE
+from .audit import AuditLogWriter
+from .backup import ARCHIVE_MAGIC, ARCHIVE_VERSION, FRAME_HEADER, MAX_CHUNK_BYTES, ArchiveError, _frame, iter_backup, \
+    restore_backup
+from .benchmarks import run as run_benchmarks
+from .cache import role_membership_cache, session_key_cache
+from .models import CIPHER_VERSION_CFB, CIPHER_VERSION_GCM, InvalidKey, MasterKeyRotation, Secret, SecretRole, \
+    SecretAccessLog, SecretAttachment, SecretValidationHasher, SessionKey, UserKey
+from .rotation import MasterKeyRotator, RotationError, RotationRunning, rotation_running
+from .sessionstore import DatabaseSessionKeyStore, FileSessionKeyStore, LocMemSessionKeyStore, get_master_key, \
+    get_session_key_store
+from .utils import STREAM_CHUNK_SIZE, STREAM_HEADER_SIZE, STREAM_TAG_SIZE, decrypt_master_key, generate_random_key, \
+    master_key_fingerprint, session_key_digest
 
-# Create your tests here.
+# Generating an RSA key takes a while, all tests share one
+PRIVATE_KEY = RSA.generate(2048)
+
+
+class SecretTestCase(TestCase):
+    """
+    A superuser with an active UserKey, and a device and role to attach secrets to.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='admin', is_superuser=True, is_staff=True)
+        cls.private_key = PRIVATE_KEY.export_key().decode()
+        cls.user_key = UserKey.objects.create(user=cls.user, public_key=PRIVATE_KEY.publickey().export_key().decode())
+        cls.master_key = cls.user_key.get_master_key(cls.private_key)
+
+        region = Region.objects.create(name='Region', slug='region')
+        location = Location.objects.create(name='Location', slug='location', region=region)
+        vendor = Vendor.objects.create(name='Vendor', slug='vendor')
+        model = VendorModel.objects.create(vendor=vendor, model='Model', slug='model')
+        device_role = DeviceRole.objects.create(name='Switch', slug='switch', color='ff0000')
+        cls.device = Device.objects.create(name='sw-01', device_model=model, device_role=device_role, location=location)
+        cls.role = SecretRole.objects.create(name='Admin', slug='admin')
+
+    def create_secret(self, name, plaintext, master_key=None):
+        secret = Secret(device=self.device, role=self.role, name=name, plaintext=plaintext)
+        secret.encrypt(master_key or self.master_key)
+        secret.save()
+        return secret
+
+    def create_legacy_secret(self, name, plaintext):
+        """
+        Save a secret the way older versions did: AES-CFB and a hash of the plaintext.
+        """
+        secret = Secret(device=self.device, role=self.role, name=name)
+        iv = os.urandom(16)
+        secret.ciphertext = iv + AES.new(self.master_key, AES.MODE_CFB, iv).encrypt(secret._pad(plaintext))
+        secret.hash = make_password(plaintext, hasher=SecretValidationHasher())
+        secret.save()
+        return secret
+
+    def write_private_key(self):
+        """
+        Return path of a file holding the private key, for management commands.
+        """
+        fd, path = tempfile.mkstemp(suffix='.pem')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.private_key)
+        self.addCleanup(os.unlink, path)
+        return path
+
+    def decrypt(self, pk, master_key=None):
+        secret = Secret.objects.get(pk=pk)
+        secret.decrypt(master_key or self.master_key)
+        return secret.plaintext
+
+
+class SecretCipherTest(SecretTestCase):
+
+    def test_encrypt_decrypt(self):
+        for plaintext in ('', 'p@ss', 'x' * 62, 'x' * 63, 'пароль' * 100, 'x' * 65535):
+            secret = self.create_secret('s{}'.format(len(plaintext)), plaintext)
+            self.assertEqual(secret.cipher_version, CIPHER_VERSION_GCM)
+            self.assertEqual(self.decrypt(secret.pk), plaintext)
+
+    def test_short_secrets_have_same_size(self):
+        self.assertEqual(
+            len(self.create_secret('a', 'a').ciphertext), len(self.create_secret('b', 'x' * 62).ciphertext)
+        )
+
+    def test_tampered_ciphertext_is_rejected(self):
+        secret = self.create_secret('s', 'p@ss')
+        # Flip a bit of the nonce, the tag and the encrypted data in turn
+        for offset in (1, 13, 29, len(secret.ciphertext) - 1):
+            ciphertext = bytearray(secret.ciphertext)
+            ciphertext[offset] ^= 1
+            tampered = Secret(ciphertext=bytes(ciphertext))
+            with self.assertRaises(ValueError):
+                tampered.decrypt(self.master_key)
+
+    def test_wrong_key_is_rejected(self):
+        secret = self.create_secret('s', 'p@ss')
+        with self.assertRaises(ValueError):
+            self.decrypt(secret.pk, generate_random_key())
+
+    def test_legacy_cfb_decrypt(self):
+        secret = self.create_legacy_secret('legacy', 'old p@ss')
+        self.assertEqual(secret.cipher_version, CIPHER_VERSION_CFB)
+        self.assertEqual(self.decrypt(secret.pk), 'old p@ss')
+        with self.assertRaises(ValueError):
+            self.decrypt(secret.pk, generate_random_key())
+
+    def test_upgradesecrets(self):
+        legacy = [self.create_legacy_secret('l{}'.format(i), 'legacy {}'.format(i)) for i in range(5)]
+        current = self.create_secret('current', 'current')
+        ciphertext = bytes(Secret.objects.get(pk=current.pk).ciphertext)
+
+        call_command(
+            'upgradesecrets', user='admin', private_key=self.write_private_key(), batch_size=2, stdout=io.StringIO()
+        )
+
+        for i, secret in enumerate(legacy):
+            upgraded = Secret.objects.get(pk=secret.pk)
+            self.assertEqual(upgraded.cipher_version, CIPHER_VERSION_GCM)
+            self.assertEqual(upgraded.hash, '')
+            self.assertEqual(self.decrypt(secret.pk), 'legacy {}'.format(i))
+        # Secrets already in the current format are left alone
+        self.assertEqual(bytes(Secret.objects.get(pk=current.pk).ciphertext), ciphertext)
+
+    def test_upgradesecrets_skips_undecryptable_secrets(self):
+        legacy = self.create_legacy_secret('legacy', 'legacy')
+        broken = self.create_legacy_secret('broken', 'broken')
+        # Flip a bit of the first plaintext byte, the plaintext no longer matches the hash
+        ciphertext = bytearray(broken.ciphertext)
+        ciphertext[18] ^= 1
+        Secret.objects.filter(pk=broken.pk).update(ciphertext=bytes(ciphertext))
+        stderr = io.StringIO()
+
+        call_command('upgradesecrets', user='admin', private_key=self.write_private_key(), stdout=io.StringIO(),
+                     stderr=stderr)
+
+        self.assertIn('Secret {} can\'t be decrypted'.format(broken.pk), stderr.getvalue())
+        self.assertEqual(Secret.objects.get(pk=legacy.pk).cipher_version, CIPHER_VERSION_GCM)
+        self.assertEqual(Secret.objects.get(pk=broken.pk).cipher_version, CIPHER_VERSION_CFB)
+
+    def test_upgradesecrets_is_refused_during_rotation(self):
+        legacy = self.create_legacy_secret('legacy', 'legacy')
+        MasterKeyRotator(self.user_key, self.private_key)
+        with self.assertRaisesRegex(CommandError, 'rotation is in progress'):
+            call_command('upgradesecrets', user='admin', private_key=self.write_private_key(), stdout=io.StringIO())
+        self.assertEqual(Secret.objects.get(pk=legacy.pk).cipher_version, CIPHER_VERSION_CFB)
+
+
+class Interrupted(Exception):
+    pass
+
+
+class MasterKeyRotationTest(SecretTestCase):
+
+    def interrupt_after(self, processed):
+        def progress(rotation, rate):
+            if rotation.processed >= processed:
+                raise Interrupted()
+        return progress
+
+    def test_interrupted_rotation_is_resumed(self):
+        secrets = [self.create_secret('s{}'.format(i), 'p{}'.format(i)) for i in range(7)]
+        SessionKey(userkey=self.user_key).save(master_key=self.master_key)
+
+        with self.assertRaises(Interrupted):
+            MasterKeyRotator(self.user_key, self.private_key, batch_size=3).run(progress=self.interrupt_after(3))
+        rotation = MasterKeyRotation.objects.in_progress().get()
+        self.assertEqual(rotation.last_secret_id, secrets[2].pk)
+        self.assertEqual(rotation.processed, 3)
+        # The claim is released, so the rotation can be resumed at once
+        self.assertFalse(rotation_running())
+        new_master_key = decrypt_master_key(bytes(rotation.master_key_cipher), self.private_key)
+        self.assertEqual(self.decrypt(secrets[2].pk, new_master_key), 'p2')
+        self.assertEqual(self.decrypt(secrets[3].pk), 'p3')
+
+        rotator = MasterKeyRotator(self.user_key, self.private_key, batch_size=3)
+        self.assertEqual(rotator.rotation.pk, rotation.pk)
+        rotation = rotator.run()
+
+        self.assertIsNotNone(rotation.completed)
+        self.assertEqual(rotation.processed, 7)
+        self.assertFalse(MasterKeyRotation.objects.in_progress().exists())
+        self.assertFalse(SessionKey.objects.exists())
+        master_key = UserKey.objects.get(pk=self.user_key.pk).get_master_key(self.private_key)
+        self.assertEqual(master_key, new_master_key)
+        for i, secret in enumerate(secrets):
+            self.assertEqual(self.decrypt(secret.pk, master_key), 'p{}'.format(i))
+        with self.assertRaises(ValueError):
+            self.decrypt(secrets[0].pk, self.master_key)
+
+    def test_claimed_rotation_is_not_run_twice(self):
+        self.create_secret('s', 'p')
+        first = MasterKeyRotator(self.user_key, self.private_key)
+        self.assertTrue(rotation_running())
+        with self.assertRaises(RotationRunning):
+            MasterKeyRotator(self.user_key, self.private_key)
+
+        # A claim which is not renewed expires and the rotation can be taken over
+        MasterKeyRotation.objects.update(last_updated=timezone.now() - MasterKeyRotation.CLAIM_TIMEOUT)
+        second = MasterKeyRotator(self.user_key, self.private_key)
+        self.assertEqual(second.rotation.pk, first.rotation.pk)
+        with self.assertRaises(RotationRunning):
+            first.run()
+        second.run()
+        self.assertFalse(rotation_running())
+        self.assertEqual(MasterKeyRotation.objects.get().processed, 1)
+
+    def test_undecryptable_secret_is_skipped(self):
+        a = self.create_secret('a', 'pa')
+        broken = self.create_secret('broken', 'p', master_key=generate_random_key())
+        b = self.create_secret('b', 'pb')
+
+        with self.assertLogs('secret.rotation', 'ERROR'):
+            rotation = MasterKeyRotator(self.user_key, self.private_key, batch_size=2).run()
+        self.assertIsNotNone(rotation.completed)
+        self.assertEqual(rotation.processed, 2)
+        self.assertEqual(MasterKeyRotation.objects.get().failed_secrets, [broken.pk])
+        master_key = UserKey.objects.get(pk=self.user_key.pk).get_master_key(self.private_key)
+        self.assertEqual(self.decrypt(a.pk, master_key), 'pa')
+        self.assertEqual(self.decrypt(b.pk, master_key), 'pb')
+        self.assertEqual(bytes(Secret.objects.get(pk=broken.pk).ciphertext), bytes(broken.ciphertext))
+
+    @override_settings(SESSION_KEY_STORE='locmem')
+    def test_locmem_store_is_refused(self):
+        with self.assertRaises(RotationError):
+            MasterKeyRotator(self.user_key, self.private_key)
+        self.assertFalse(MasterKeyRotation.objects.exists())
+
+
+class SecretBackupTest(SecretTestCase):
+
+    def backup(self, chunk_size=500):
+        return io.BytesIO(b''.join(iter_backup(self.master_key, chunk_size=chunk_size)))
+
+    def archive(self, *chunks, frames=()):
+        """
+        Return archive of chunks, each a list of record dicts, followed by raw frames.
+        """
+        return io.BytesIO(
+            ARCHIVE_MAGIC + bytes([ARCHIVE_VERSION]) + master_key_fingerprint(self.master_key) +
+            b''.join(_frame([json.dumps(record) for record in records]) for records in chunks) +
+            b''.join(frames) + FRAME_HEADER.pack(0)
+        )
+
+    def restore(self, archive):
+        return restore_backup(archive, self.master_key)
+
+    def record(self, name, device='sw-01', role='admin', ciphertext=b'ciphertext'):
+        return {
+            'device': device,
+            'role': role,
+            'name': name,
+            'ciphertext': base64.b64encode(ciphertext).decode(),
+            'hash': '',
+        }
+
+    def test_backup_restore(self):
+        for i in range(5):
+            self.create_secret('s{}'.format(i), 'p{}'.format(i))
+        archive = self.backup(chunk_size=2)
+        Secret.objects.filter(name__in=['s1', 's4']).delete()
+
+        self.assertEqual(self.restore(archive), (2, 3))
+        self.assertEqual(Secret.objects.count(), 5)
+        self.assertEqual(self.decrypt(Secret.objects.get(name='s4').pk), 'p4')
+
+    def test_unknown_device_or_role_is_skipped(self):
+        archive = self.archive([self.record('a'), self.record('b', device='sw-99'), self.record('c', role='nope')])
+        self.assertEqual(self.restore(archive), (1, 2))
+        self.assertEqual(list(Secret.objects.values_list('name', flat=True)), ['a'])
+
+    def test_duplicate_records_are_restored_once(self):
+        archive = self.archive(
+            [self.record('a', ciphertext=b'first'), self.record('a', ciphertext=b'second'), self.record('b')],
+            [self.record('a', ciphertext=b'third'), self.record('c')],
+        )
+        self.assertEqual(self.restore(archive), (3, 2))
+        self.assertEqual(bytes(Secret.objects.get(name='a').ciphertext), b'first')
+
+    def test_invalid_records_are_rejected(self):
+        invalid = [
+            ['not an object'],
+            {'device': 'sw-01', 'role': 'admin', 'name': 'a'},
+            dict(self.record('a'), device=['sw-01']),
+            dict(self.record('a'), name=None),
+            dict(self.record('a'), ciphertext='not base64!'),
+            dict(self.record('a'), hash=1),
+        ]
+        for record in invalid:
+            with self.assertRaises(ArchiveError):
+                self.restore(self.archive([self.record('b'), record]))
+        self.assertFalse(Secret.objects.exists())
+
+    def test_truncated_archive_is_rejected(self):
+        self.create_secret('a', 'p')
+        data = self.backup().getvalue()
+        Secret.objects.all().delete()
+        with self.assertRaises(ArchiveError):
+            self.restore(io.BytesIO(data[:-6]))
+
+    def test_restore_is_refused_during_rotation(self):
+        MasterKeyRotator(self.user_key, self.private_key)
+        with self.assertRaises(ArchiveError):
+            self.restore(self.archive([self.record('a')]))
+        self.assertFalse(Secret.objects.exists())
+
+    def test_other_master_key_is_rejected(self):
+        self.create_secret('a', 'p')
+        archive = self.backup()
+        Secret.objects.all().delete()
+        with self.assertRaisesRegex(ArchiveError, 'another master key'):
+            restore_backup(archive, generate_random_key())
+        self.assertFalse(Secret.objects.exists())
+
+    def test_oversized_chunks_are_rejected(self):
+        # Frame length over the limit, rejected before it is read
+        with self.assertRaisesRegex(ArchiveError, 'too large'):
+            self.restore(self.archive(frames=[FRAME_HEADER.pack(0xffffffff)]))
+        # Small frame which decompresses to far more than a chunk
+        bomb = zlib.compress(b'\n' * (4 * MAX_CHUNK_BYTES))
+        with self.assertRaisesRegex(ArchiveError, 'too large'):
+            self.restore(self.archive([self.record('a')], frames=[FRAME_HEADER.pack(len(bomb)) + bomb]))
+        self.assertEqual(list(Secret.objects.values_list('name', flat=True)), ['a'])
+
+
+class SecretAttachmentTest(SecretTestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.secret = self.create_secret('s', 'p')
+
+    def attach(self, data, piece_size=1000):
+        attachment = SecretAttachment(secret=self.secret, name='file')
+        attachment.encrypt((data[i:i + piece_size] for i in range(0, len(data), piece_size)), self.master_key)
+        attachment.save()
+        return attachment
+
+    def test_round_trip(self):
+        for size in (0, 1, STREAM_CHUNK_SIZE - 1, STREAM_CHUNK_SIZE, STREAM_CHUNK_SIZE + 1, 2 * STREAM_CHUNK_SIZE,
+                     2 * STREAM_CHUNK_SIZE + 1):
+            data = os.urandom(size)
+            attachment = self.attach(data)
+            self.assertEqual(attachment.size, size)
+            self.assertEqual(b''.join(attachment.decrypt(self.master_key)), data, size)
+
+    def test_wrong_key_is_rejected(self):
+        attachment = self.attach(os.urandom(100))
+        with self.assertRaises(ValueError):
+            b''.join(attachment.decrypt(generate_random_key()))
+
+    def test_truncated_file_is_rejected(self):
+        record_size = STREAM_CHUNK_SIZE + STREAM_TAG_SIZE
+        for size in (STREAM_CHUNK_SIZE, 2 * STREAM_CHUNK_SIZE, 2 * STREAM_CHUNK_SIZE + 10):
+            attachment = self.attach(os.urandom(size))
+            with default_storage.open(attachment.file.name, 'rb') as f:
+                encrypted = f.read()
+            # Cut at every record boundary, inside the last record and inside the header
+            lengths = list(range(STREAM_HEADER_SIZE, len(encrypted), record_size)) + [
+                len(encrypted) - 1, STREAM_HEADER_SIZE - 1
+            ]
+            for length in lengths:
+                with default_storage.open(attachment.file.name, 'wb') as f:
+                    f.write(encrypted[:length])
+                with self.assertRaises(ValueError, msg='{} of {} bytes'.format(length, len(encrypted))):
+                    b''.join(attachment.decrypt(self.master_key))
+
+
+class SecretRoleTest(SecretTestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(username='alice')
+        self.secret = self.create_secret('s', 'p')
+
+    def test_revoked_user_loses_access(self):
+        self.role.users.add(self.alice)
+        self.assertTrue(self.secret.decryptable_by(self.alice))
+        self.role.users.remove(self.alice)
+        self.assertFalse(self.secret.decryptable_by(self.alice))
+
+    def test_revoked_group_loses_access(self):
+        group = Group.objects.create(name='admins')
+        self.role.groups.add(group)
+        self.alice.groups.add(group)
+        self.assertTrue(self.secret.decryptable_by(self.alice))
+        self.alice.groups.remove(group)
+        self.assertFalse(self.secret.decryptable_by(self.alice))
+
+        self.alice.groups.add(group)
+        self.assertTrue(self.secret.decryptable_by(self.alice))
+        group.delete()
+        self.assertFalse(self.secret.decryptable_by(self.alice))
+
+    def test_revocation_by_another_worker(self):
+        self.role.users.add(self.alice)
+        self.assertTrue(self.secret.decryptable_by(self.alice))
+
+        # Deleting the through rows sends no m2m_changed, as for a change made through another worker
+        SecretRole.users.through.objects.filter(user=self.alice).delete()
+        self.assertTrue(self.secret.decryptable_by(self.alice))
+        with mock.patch('time.monotonic', return_value=time.monotonic() + role_membership_cache.ttl):
+            self.assertFalse(self.secret.decryptable_by(self.alice))
+
+    def use_store(self, backend, **options):
+        """
+        Select a session key store for the rest of the test and return it.
+        """
+        settings = override_settings(SESSION_KEY_STORE=backend, **options)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        store = mock.patch('secret.sessionstore._store', None)
+        store.start()
+        self.addCleanup(store.stop)
+        return get_session_key_store()
+
+    def store_path(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        return os.path.join(path, 'session-keys')
+
+    def create_session_key(self, **kwargs):
+        session_key = SessionKey(userkey=self.user_key, **kwargs)
+        session_key.save(master_key=self.master_key)
+        return session_key
+
+    def test_backends(self):
+        for backend, store_class, options in (
+            ('database', DatabaseSessionKeyStore, {}),
+            ('locmem', LocMemSessionKeyStore, {}),
+            ('file', FileSessionKeyStore, {'SESSION_KEY_STORE_PATH': self.store_path()}),
+        ):
+            with self.subTest(backend):
+                self.assertIsInstance(self.use_store(backend, **options), store_class)
+                session_key = self.create_session_key(name=backend)
+                key = session_key.key
+                self.assertEqual(get_master_key(self.user, key), self.master_key)
+                # Served from the store, without reading the database
+                if backend != 'database':
+                    with self.assertNumQueries(0):
+                        self.assertEqual(get_master_key(self.user, key), self.master_key)
+
+                other = User.objects.create(username='other-{}'.format(backend))
+                with self.assertRaises(InvalidKey):
+                    get_master_key(other, key)
+
+                session_key.delete()
+                with self.assertRaises(InvalidKey):
+                    get_master_key(self.user, key)
+
+    def test_expired_session_key_is_refused(self):
+        self.use_store('file', SESSION_KEY_STORE_PATH=self.store_path())
+        session_key = self.create_session_key(expires=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(get_master_key(self.user, session_key.key), self.master_key)
+        with mock.patch('time.time', return_value=time.time() + 600):
+            with self.assertRaises(InvalidKey):
+                get_master_key(self.user, session_key.key)
+
+    def test_file_store_permissions(self):
+        path = self.store_path()
+        FileSessionKeyStore(path)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o700)
+
+        os.chmod(path, 0o750)
+        with self.assertRaises(ImproperlyConfigured):
+            FileSessionKeyStore(path)
+
+        link = path + '-link'
+        os.chmod(path, 0o700)
+        os.symlink(path, link)
+        with self.assertRaises(ImproperlyConfigured):
+            FileSessionKeyStore(link)
+
+    def test_file_store_requires_path(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.use_store('file')
+        with self.assertRaises(ImproperlyConfigured):
+            self.use_store('memcached')
+
+
+class SessionKeyTest(SecretTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def request_session_key(self, **data):
+        response = self.client.post(
+            reverse('secrets-api:get-session-key-list'), dict(data, private_key=self.private_key)
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return base64.b64decode(response.json()['session_key'])
+
+    def test_verified_key_is_cached(self):
+        key = self.request_session_key()
+        self.assertEqual(get_master_key(self.user, key), self.master_key)
+        with mock.patch('secret.models.check_password') as check_password:
+            self.assertEqual(get_master_key(self.user, key), self.master_key)
+        check_password.assert_not_called()
+
+    def test_deleted_key_is_forgotten(self):
+        key = self.request_session_key()
+        get_master_key(self.user, key)
+        self.assertIsNotNone(session_key_cache.get(session_key_digest(key)))
+
+        SessionKey.objects.get(userkey=self.user_key).delete()
+        self.assertIsNone(session_key_cache.get(session_key_digest(key)))
+        with self.assertRaises(InvalidKey):
+            get_master_key(self.user, key)
+
+    def test_replaced_key_is_forgotten(self):
+        old_key = self.request_session_key(name='ci')
+        get_master_key(self.user, old_key)
+
+        new_key = self.request_session_key(name='ci')
+        self.assertEqual(get_master_key(self.user, new_key), self.master_key)
+        with self.assertRaises(InvalidKey):
+            get_master_key(self.user, old_key)
+        # preserve_key returns the current key instead of replacing it
+        response = self.client.post(
+            reverse('secrets-api:get-session-key-list') + '?preserve_key=1',
+            {'private_key': self.private_key, 'name': 'ci'}
+        )
+        self.assertEqual(base64.b64decode(response.json()['session_key']), new_key)
+
+    def test_named_keys(self):
+        ci = self.request_session_key(name='ci')
+        backup = self.request_session_key(name='backup')
+        # Each name holds its own key, requesting one doesn't invalidate the other
+        self.assertEqual(get_master_key(self.user, ci), self.master_key)
+        self.assertEqual(get_master_key(self.user, backup), self.master_key)
+        self.assertEqual(
+            list(SessionKey.objects.filter(userkey=self.user_key).values_list('name', flat=True)), ['backup', 'ci']
+        )
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SessionKey(userkey=self.user_key, name='ci').save(master_key=self.master_key)
+
+    def test_expiry(self):
+        key = self.request_session_key(name='ci', ttl=60)
+        session_key = SessionKey.objects.get(userkey=self.user_key, name='ci')
+        self.assertAlmostEqual(session_key.expires, timezone.now() + timedelta(seconds=60), delta=timedelta(seconds=5))
+        self.assertEqual(get_master_key(self.user, key), self.master_key)
+
+        SessionKey.objects.filter(pk=session_key.pk).update(expires=timezone.now() - timedelta(seconds=1))
+        with self.assertRaises(InvalidKey):
+            get_master_key(self.user, key)
+        self.assertEqual(list(SessionKey.objects.expired()), [session_key])
+        # An expired key is replaced even with preserve_key
+        response = self.client.post(
+            reverse('secrets-api:get-session-key-list') + '?preserve_key=1',
+            {'private_key': self.private_key, 'name': 'ci'}
+        )
+        self.assertNotEqual(base64.b64decode(response.json()['session_key']), key)
+        self.assertFalse(SessionKey.objects.expired().exists())
+
+    def test_invalid_parameters(self):
+        url = reverse('secrets-api:get-session-key-list')
+        for data in ({'ttl': 0}, {'ttl': -5}, {'ttl': 'soon'}, {'name': 'x' * 200}):
+            response = self.client.post(url, dict(data, private_key=self.private_key))
+            self.assertEqual(response.status_code, 400, data)
+        self.assertFalse(SessionKey.objects.exists())
+
+
+class SecretAPITest(SecretTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def session_key(self, user_key=None):
+        session_key = SessionKey(userkey=user_key or self.user_key)
+        session_key.save(master_key=self.master_key)
+        return base64.b64encode(session_key.key).decode()
+
+    def test_list_without_session_key(self):
+        for i in range(3):
+            self.create_secret('s{}'.format(i), 'p{}'.format(i))
+        # The encrypted columns are neither loaded nor fetched one secret at a time
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('secrets-api:secret-list'))
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual(len(results), 3)
+        self.assertNotIn('hash', results[0])
+        self.assertIsNone(results[0]['plaintext'])
+
+    def test_list_with_session_key(self):
+        self.create_secret('s', 'p')
+        response = self.client.get(reverse('secrets-api:secret-list'), HTTP_X_SESSION_KEY=self.session_key())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['plaintext'], 'p')
+        self.assertIn('hash', response.json()[0])
+
+    def member(self, username, *roles):
+        """
+        Return a user with an active UserKey, member of roles, and a session key for it.
+        """
+        user = User.objects.create(username=username)
+        user_key = UserKey(user=user, public_key=self.user_key.public_key)
+        user_key.activate(self.master_key)
+        user_key.save()
+        for role in roles:
+            role.users.add(user)
+        return user, self.session_key(user_key)
+
+    def decrypt_batch(self, items, session_key=None, **kwargs):
+        if session_key is not None:
+            kwargs['HTTP_X_SESSION_KEY'] = session_key
+        return self.client.post(reverse('secrets-api:secret-decrypt-batch'), items, format='json', **kwargs)
+
+    def test_decrypt_batch_permissions(self):
+        other_role = SecretRole.objects.create(name='Other', slug='other')
+        allowed = self.create_secret('allowed', 'p1')
+        denied = Secret(device=self.device, role=other_role, name='denied', plaintext='p2')
+        denied.encrypt(self.master_key)
+        denied.save()
+        alice, session_key = self.member('alice', self.role)
+        self.client.force_authenticate(alice)
+
+        response = self.decrypt_batch([
+            {'device': 'sw-01', 'role': 'other', 'name': 'denied'},
+            allowed.pk,
+            0,
+            {'device': 'sw-01', 'role': 'admin', 'name': 'missing'},
+            {'device': 'sw-01', 'role': 'admin', 'name': 'allowed'},
+        ], session_key)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual(results[0], {
+            'request': {'device': 'sw-01', 'role': 'other', 'name': 'denied'},
+            'id': denied.pk,
+            'error': 'You do not have permission to decrypt this secret.',
+        })
+        self.assertEqual((results[1]['request'], results[1]['plaintext']), (allowed.pk, 'p1'))
+        self.assertEqual(results[2], {'request': 0, 'error': 'Secret not found.'})
+        self.assertEqual(results[3]['error'], 'Secret not found.')
+        self.assertEqual(results[4]['plaintext'], 'p1')
+        self.assertNotIn('plaintext', results[0])
+
+    def test_decrypt_batch_bad_requests(self):
+        secret = self.create_secret('s', 'p')
+        session_key = self.session_key()
+
+        self.assertEqual(self.decrypt_batch([secret.pk]).status_code, 400)
+        self.assertEqual(
+            self.decrypt_batch([secret.pk], base64.b64encode(generate_random_key()).decode()).status_code, 400
+        )
+        for items in (
+            {'id': secret.pk},
+            [secret.pk, True],
+            [str(secret.pk)],
+            [{'device': 'sw-01', 'name': 's'}],
+            [{'device': 'sw-01', 'role': 'admin', 'name': 1}],
+            [secret.pk] * (MAX_BATCH_SIZE + 1),
+        ):
+            self.assertEqual(self.decrypt_batch(items, session_key).status_code, 400, items)
+
+    def test_bulk_create(self):
+        url = reverse('secrets-api:secret-list')
+        session_key = self.session_key()
+        item = {'device': self.device.pk, 'role': self.role.pk, 'plaintext': 'p'}
+
+        response = self.client.post(url, [
+            dict(item, name='a'), dict(item, name='b', device=0), dict(item, name='a'), dict(item, name='c'),
+        ], format='json', HTTP_X_SESSION_KEY=session_key)
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual([bool(error) for error in errors], [False, True, True, False])
+        self.assertIn('device', errors[1])
+        self.assertIn('non_field_errors', errors[2])
+        # Nothing is saved when one item is invalid
+        self.assertFalse(Secret.objects.exists())
+
+        response = self.client.post(url, [dict(item, name='a'), dict(item, name='b', plaintext='q')], format='json',
+                                    HTTP_X_SESSION_KEY=session_key)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.decrypt(Secret.objects.get(name='b').pk), 'q')
+
+    def test_bulk_update(self):
+        url = reverse('secrets-api:secret-list')
+        session_key = self.session_key()
+        a = self.create_secret('a', 'pa')
+        b = self.create_secret('b', 'pb')
+
+        for items in (
+            [{'id': a.pk, 'name': 'a2'}, {'id': b.pk, 'name': 'a2'}],
+            [{'id': a.pk, 'plaintext': 'new'}, {'id': 0, 'name': 'c'}],
+            [{'id': a.pk, 'plaintext': 'new'}, {'id': b.pk, 'device': 0}],
+        ):
+            response = self.client.patch(url, items, format='json', HTTP_X_SESSION_KEY=session_key)
+            self.assertEqual(response.status_code, 400, items)
+            self.assertEqual(response.json()[0], {}, items)
+            # The valid item is rolled back with the invalid one
+            self.assertEqual(self.decrypt(a.pk), 'pa')
+            self.assertEqual(
+                sorted(Secret.objects.values_list('name', flat=True)), ['a', 'b']
+            )
+
+        response = self.client.patch(url, [{'id': a.pk, 'plaintext': 'new'}, {'id': b.pk, 'name': 'b2'}],
+                                     format='json', HTTP_X_SESSION_KEY=session_key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.decrypt(a.pk), 'new')
+        self.assertEqual(Secret.objects.get(pk=b.pk).name, 'b2')
+
+
+class SecretAuditLogTest(SecretTestCase):
+
+    @override_settings(SECRET_AUDIT_LOG=True)
+    def test_benchmark_leaves_audit_log_unchanged(self):
+        count = SecretAccessLog.objects.count()
+        with mock.patch.object(AuditLogWriter, 'log') as log:
+            results = run_benchmarks(['secret_list'], number=1, repeat=1)
+        self.assertEqual([result['name'] for result in results], ['SecretViewSet.list[50]', 'SecretViewSet.list[500]'])
+        log.assert_not_called()
+        self.assertEqual(SecretAccessLog.objects.count(), count)
+
+    def access_log(self, secret, user=None):
+        user = user or self.user
+        return SecretAccessLog(
+            time=timezone.now(), secret_id=secret.pk, secret_name=secret.name, user_id=user.pk,
+            username=user.username, access=SecretAccessLog.ACCESS_DECRYPT
+        )
+
+    def test_full_buffer_drops_records(self):
+        secret = self.create_secret('a', 'p')
+        writer = AuditLogWriter(buffer_size=2, batch_size=10, flush_interval=0)
+        # Without the writer thread the records stay queued until flushed
+        with mock.patch.object(writer, '_start'):
+            writer.log([self.access_log(secret) for _ in range(3)])
+            writer.log([self.access_log(secret)])
+        self.assertEqual(writer.dropped, 2)
+        self.assertEqual(writer.pending(), 2)
+
+        writer.flush()
+        self.assertEqual(writer.pending(), 0)
+        self.assertEqual(SecretAccessLog.objects.filter(secret=secret).count(), 2)
+
+    def test_deleted_references_are_cleared(self):
+        a = self.create_secret('a', 'p')
+        b = self.create_secret('b', 'p')
+        other = User.objects.create(username='other')
+        batch = [self.access_log(a), self.access_log(b, other)]
+        b.delete()
+        other.delete()
+
+        # SQLite only checks foreign keys on commit: fail the first insert as other databases would
+        with mock.patch.object(SecretAccessLog.objects, 'bulk_create', side_effect=[IntegrityError(), None]) as insert:
+            AuditLogWriter()._write(batch)
+        self.assertEqual(insert.call_count, 2)
+        insert.assert_called_with(batch)
+        self.assertEqual(
+            [(record.secret_id, record.secret_name, record.user_id, record.username) for record in batch],
+            [(a.pk, 'a', self.user.pk, 'admin'), (None, 'b', None, 'other')]
+        )
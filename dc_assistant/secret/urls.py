@@ -8,6 +8,8 @@ urlpatterns = [
     path('user-key/edit/', views.UserKeyAddEditView.as_view(), name='userkey_edit'),
     path('secrets/', views.SecretListView.as_view(), name='secret_list'),
     path('secrets/<int:pk>/', views.SecretView.as_view(), name='secret'),
+    path('secrets/<int:pk>/add-attachment/', views.secret_attachment_add, name='secret_addattachment'),
+    path('attachments/<int:pk>/', views.secret_attachment_download, name='secretattachment'),
 
     path('secret-roles/', views.SecretRoleListView.as_view(), name='secretrole_list'),
     path('secret-roles/add/', views.SecretRoleAdd.as_view(), name='secretrole_add'),
@@ -1,6 +1,15 @@
+import hashlib
+import hmac
+import multiprocessing
 import os
-from Crypto.Cipher import PKCS1_OAEP
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+from Crypto.Cipher import AES, PKCS1_OAEP
 from Crypto.PublicKey import RSA
+from django.utils.encoding import force_bytes
+from .cache import public_key_cache
 
 
 def generate_random_key(bits=256):
@@ -12,11 +21,45 @@ def generate_random_key(bits=256):
     return os.urandom(int(bits / 8))
 
 
+def session_key_digest(session_key):
+    """
+    Return keyed SHA256 digest of session key. The digest is safe to keep in memory as a cache key.
+    """
+    return hmac.new(force_bytes(settings.SECRET_KEY), session_key, hashlib.sha256).hexdigest()
+
+
+def public_key_fingerprint(public_key):
+    """
+    Return SHA256 fingerprint of a PEM encoded public key.
+    """
+    return hashlib.sha256(force_bytes(public_key.strip())).hexdigest()
+
+
+def master_key_fingerprint(master_key):
+    """
+    Return 16 bytes SHA256 fingerprint of the master key. It identifies the key without revealing it.
+    """
+    return hashlib.sha256(b'dc_assistant master key:' + master_key).digest()[:16]
+
+
+def import_public_key(public_key):
+    """
+    Parse PEM encoded public key. Parsed public keys are cached by fingerprint, private keys are never cached.
+    """
+    fingerprint = public_key_fingerprint(public_key)
+    key = public_key_cache.get(fingerprint)
+    if key is None:
+        key = RSA.importKey(public_key)
+        if not key.has_private():
+            public_key_cache.set(fingerprint, key)
+    return key
+
+
 def encrypt_master_key(master_key, public_key):
     """
     Encrypt secret key with provided public key.
     """
-    key = RSA.importKey(public_key)
+    key = import_public_key(public_key)
     cipher = PKCS1_OAEP.new(key)
     return cipher.encrypt(master_key)
 
@@ -27,4 +70,166 @@ def decrypt_master_key(master_key_cipher, private_key):
     """
     key = RSA.importKey(private_key)
     cipher = PKCS1_OAEP.new(key)
-    return cipher.decrypt(master_key_cipher)
\ No newline at end of file
+    return cipher.decrypt(master_key_cipher)
+
+
+# Fewer public keys are encrypted in the calling process, starting worker processes would take longer
+ENCRYPT_MASTER_KEY_PARALLEL_MIN = 16
+
+
+def _encrypt_master_key_chunk(master_key, public_keys):
+    ciphers = []
+    for public_key in public_keys:
+        try:
+            ciphers.append(encrypt_master_key(master_key, public_key))
+        except (ValueError, IndexError, TypeError):
+            ciphers.append(None)
+    return ciphers
+
+
+def encrypt_master_key_many(master_key, public_keys, progress=None, chunk_size=16):
+    """
+    Encrypt secret key with each of the public keys. The RSA operations run on a pool of worker processes, chunk_size
+    keys per task. Return list of ciphers in the order of public_keys, None where a public key is invalid.
+    progress(done, total) is called after each chunk.
+    """
+    public_keys = list(public_keys)
+    total = len(public_keys)
+    chunks = [public_keys[i:i + chunk_size] for i in range(0, total, chunk_size)]
+
+    if settings.USERKEY_ACTIVATE_WORKERS == 1 or total < ENCRYPT_MASTER_KEY_PARALLEL_MIN:
+        results = (_encrypt_master_key_chunk(master_key, chunk) for chunk in chunks)
+        executor = None
+    else:
+        # Don't fork a multithreaded worker
+        executor = ProcessPoolExecutor(
+            max_workers=settings.USERKEY_ACTIVATE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        results = executor.map(_encrypt_master_key_chunk, [master_key] * len(chunks), chunks)
+
+    ciphers = []
+    try:
+        for chunk_ciphers in results:
+            ciphers.extend(chunk_ciphers)
+            if progress is not None:
+                progress(len(ciphers), total)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return ciphers
+
+
+_decrypt_executor = None
+_decrypt_executor_lock = threading.Lock()
+
+
+def _get_decrypt_executor():
+    global _decrypt_executor
+    with _decrypt_executor_lock:
+        if _decrypt_executor is None:
+            _decrypt_executor = ThreadPoolExecutor(
+                max_workers=settings.SECRET_DECRYPT_WORKERS,
+                thread_name_prefix='secret-decrypt'
+            )
+    return _decrypt_executor
+
+
+def _decrypt_secret(secret, master_key):
+    try:
+        secret.decrypt(master_key)
+    except Exception as e:
+        secret.decrypt_error = str(e) or e.__class__.__name__
+
+
+def decrypt_secrets(secrets, master_key):
+    """
+    Decrypt list of Secrets in place on a bounded thread pool (AES and hashing release the GIL). The order of secrets
+    is kept. A failed decryption doesn't stop the others, its message is saved to secret.decrypt_error.
+    """
+    if settings.SECRET_DECRYPT_WORKERS <= 1 or len(secrets) < settings.SECRET_DECRYPT_PARALLEL_MIN:
+        for secret in secrets:
+            _decrypt_secret(secret, master_key)
+    else:
+        executor = _get_decrypt_executor()
+        # Wait for all results; map() keeps the order
+        list(executor.map(lambda secret: _decrypt_secret(secret, master_key), secrets))
+    return secrets
+
+
+# Streaming encryption of large data (attachments). The stream is split into chunks encrypted with AES-GCM; each nonce
+# holds a random prefix, the chunk number and a last chunk flag, so chunks can't be reordered, dropped or truncated.
+# +-+------------------+-------------------------+-----+--------------------------+
+# |V|Nonce prefix (7B) |Chunk 1 (64KB) + tag 16B | ... |Last chunk (<=64KB) + tag |
+# +-+------------------+-------------------------+-----+--------------------------+
+STREAM_VERSION = 1
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_HEADER_SIZE = 8
+STREAM_TAG_SIZE = 16
+
+
+def _stream_cipher(key, prefix, counter, last):
+    nonce = prefix + struct.pack('>I?', counter, last)
+    return AES.new(key, AES.MODE_GCM, nonce=nonce)
+
+
+def _rechunk(chunks, size):
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    yield bytes(buffer)
+
+
+def encrypt_stream(chunks, key):
+    """
+    Encrypt iterable of bytes with the key. Yield the encrypted stream piece by piece.
+    """
+    prefix = os.urandom(STREAM_HEADER_SIZE - 1)
+    yield bytes([STREAM_VERSION]) + prefix
+
+    counter = 0
+    pieces = _rechunk(chunks, STREAM_CHUNK_SIZE)
+    current = next(pieces)
+    for following in pieces:
+        # A full chunk followed only by an empty remainder is the last one
+        last = not following
+        ciphertext, tag = _stream_cipher(key, prefix, counter, last).encrypt_and_digest(current)
+        yield ciphertext + tag
+        if last:
+            return
+        counter += 1
+        current = following
+    ciphertext, tag = _stream_cipher(key, prefix, counter, True).encrypt_and_digest(current)
+    yield ciphertext + tag
+
+
+def decrypt_stream(f, key):
+    """
+    Decrypt stream read from file object f with the key. Yield the plaintext chunk by chunk. Raise ValueError if the
+    key is wrong or the stream was modified.
+    """
+    header = f.read(STREAM_HEADER_SIZE)
+    if len(header) != STREAM_HEADER_SIZE or header[0] != STREAM_VERSION:
+        raise ValueError("Invalid encrypted stream.")
+    prefix = header[1:]
+
+    record_size = STREAM_CHUNK_SIZE + STREAM_TAG_SIZE
+    counter = 0
+    current = f.read(record_size)
+    while True:
+        following = f.read(record_size)
+        last = not following
+        if len(current) < STREAM_TAG_SIZE:
+            raise ValueError("Invalid encrypted stream.")
+        cipher = _stream_cipher(key, prefix, counter, last)
+        try:
+            yield cipher.decrypt_and_verify(current[:-STREAM_TAG_SIZE], current[-STREAM_TAG_SIZE:])
+        except ValueError:
+            raise ValueError("Invalid key or encrypted stream!")
+        if last:
+            return
+        counter += 1
+        current = following
\ No newline at end of file
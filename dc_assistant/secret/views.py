@@ -3,7 +3,7 @@ from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.views.generic import View, CreateView, UpdateView
 from django.contrib.auth.views import LoginView, PasswordChangeView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.contrib.auth import login as auth_login
 from django.shortcuts import get_object_or_404, redirect, render, reverse
 from django.utils.http import is_safe_url
@@ -13,9 +13,12 @@ from django.db.models import Count
 from organisation.models import Device
 from extend.views import ListObjectsView
 from .forms import UserAuthenticationForm, UserChangePasswordForm, SecretRoleAddForm
-from .models import SessionKey, Secret, UserKey, SecretRole
-from .forms import SecretAddForm, UserKeyForm
+from .models import Secret, UserKey, SecretRole, MasterKeyRotation, SecretAttachment, InvalidKey, \
+    SecretAccessLog
+from .audit import log_secret_access
+from .forms import SecretAddForm, UserKeyForm, SecretAttachmentAddForm
 from .decorators import userkey_required
+from . import sessionstore
 from extend import filters
 from .tables import SecretTable, SecretRoleTable
 
@@ -70,6 +73,19 @@ def get_session_key(request):
     return session_key
 
 
+def get_master_key(request):
+    """
+    Return master key unlocked by the session key of request, or None.
+    """
+    session_key = get_session_key(request)
+    if session_key is None:
+        return None
+    try:
+        return sessionstore.get_master_key(request.user, session_key)
+    except InvalidKey:
+        return None
+
+
 @userkey_required()
 def secret_add(request, pk):
 
@@ -85,18 +101,15 @@ def secret_add(request, pk):
         print(request)
         if form.is_valid():
             # Valid session key in order to create a Secret
-            if session_key is None:
+            if MasterKeyRotation.objects.in_progress().exists():
+                form.add_error(None, "Master key rotation is in progress. Please try again later.")
+            elif session_key is None:
                 form.add_error(None, "No session key was provided with the request. Unable to encrypt secret data.")
             # Create and encrypt the new Secret
             else:
-                master_key = None
-                try:
-                    sk = SessionKey.objects.get(userkey__user=request.user)
-                    print('sk:', sk)
-                    master_key = sk.get_master_key(session_key)
-                    print('master_key:', master_key)
-                except SessionKey.DoesNotExist:
-                    form.add_error(None, "No session key found for this user.")
+                master_key = get_master_key(request)
+                if master_key is None:
+                    form.add_error(None, "No valid session key found for this user.")
 
                 if master_key is not None:
                     secret = form.save(commit=False)
@@ -168,7 +181,8 @@ class UserKeyAddEditView(LoginRequiredMixin, View):
 
 class SecretListView(PermissionRequiredMixin, ListObjectsView):
     permission_required = 'secret.view_secret'
-    queryset = Secret.objects.prefetch_related('role', 'device')
+    # Nothing is decrypted in the table, so don't load the encrypted columns
+    queryset = Secret.objects.prefetch_related('role', 'device').defer('ciphertext', 'hash')
     filterset = filters.SecretFilterSet
     table = SecretTable
     template_name = 'secret/secret_tab.html'
@@ -183,9 +197,55 @@ class SecretView(PermissionRequiredMixin, View):
 
         return render(request, 'secret/secret.html', {
             'secret': secret,
+            'attachments': secret.attachments.all(),
+            'attachment_form': SecretAttachmentAddForm(),
         })
 
 
+@userkey_required()
+def secret_attachment_add(request, pk):
+
+    secret = get_object_or_404(Secret, pk=pk)
+    if request.method != 'POST' or not secret.decryptable_by(request.user):
+        return redirect(secret.get_absolute_url())
+
+    form = SecretAttachmentAddForm(request.POST, request.FILES, instance=SecretAttachment(secret=secret))
+    master_key = get_master_key(request)
+    if not form.is_valid():
+        messages.error(request, "Invalid attachment: {}".format(form.errors.as_text()))
+    elif MasterKeyRotation.objects.in_progress().exists():
+        messages.error(request, "Master key rotation is in progress. Please try again later.")
+    elif master_key is None:
+        messages.error(request, "No valid session key was provided with the request. Unable to encrypt attachment.")
+    else:
+        # The upload is encrypted chunk by chunk while it is written to disk
+        attachment = form.save(commit=False)
+        attachment.encrypt(form.cleaned_data['upload'].chunks(), master_key)
+        attachment.save()
+        messages.success(request, "Added attachment: {}.".format(attachment))
+
+    return redirect(secret.get_absolute_url())
+
+
+@userkey_required()
+def secret_attachment_download(request, pk):
+
+    attachment = get_object_or_404(SecretAttachment.objects.select_related('secret'), pk=pk)
+    if not attachment.secret.decryptable_by(request.user):
+        messages.error(request, "You do not have permission to decrypt this secret.")
+        return redirect(attachment.secret.get_absolute_url())
+    master_key = get_master_key(request)
+    if master_key is None:
+        messages.error(request, "No valid session key was provided with the request. Unable to decrypt attachment.")
+        return redirect(attachment.secret.get_absolute_url())
+
+    log_secret_access(request, [attachment.secret], SecretAccessLog.ACCESS_ATTACHMENT)
+    response = StreamingHttpResponse(attachment.decrypt(master_key), content_type='application/octet-stream')
+    response['Content-Length'] = attachment.size
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(attachment.name.replace('"', ''))
+    return response
+
+
 class SecretRoleAdd(CreateView):
     permission_required = 'secret.add_secretrole'
     form_class = SecretRoleAddForm